@@ -5,28 +5,25 @@ from django.db import transaction, models
 from django.db.models import Q
 from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
 from django.contrib import admin, messages
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
 from django.template.response import TemplateResponse
 from django.urls import path
 from django.shortcuts import redirect
 from django.utils import timezone
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
 from django.utils.text import Truncator
 from django.core.management import call_command
 from django.http import HttpResponse
-import xlsxwriter
 import logging
-import openpyxl
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
 
 from .models import (
     Company, GuideProfile, BookingSale, FamilyBooking, Traveler,
-    InboundEmail, CancelledBookingSale, ExcursionNetPrice
+    InboundEmail, CancelledBookingSale, ExcursionNetPrice, OutboundEmail, PrintJob, HotelAlias, ImportJob
 )
 from .services.netto import resolve_net_prices
+from .services import import_jobs, inbound_match, inbound_search, outbox
 from .services import costasolinfo as csi
-from .forms import TouristsImportForm
-from .importers import tourists_excel
+from .forms import HotelAliasForm, TouristsImportForm
 
 log = logging.getLogger(__name__)
 
@@ -71,18 +68,83 @@ def fetch_gmail_now(modeladmin, request, queryset):
     call_command("fetch_gmail")
     modeladmin.message_user(request, "Готово: входящие обновлены.")
 
+@admin.action(description="Привязать к броням (код / ответ на наше письмо)")
+def match_to_bookings(modeladmin, request, queryset):
+    stats = inbound_match.reconcile(queryset, relink=True)
+    modeladmin.message_user(request, f"Проверено: {stats['scanned']}, привязано: {stats['linked']}.")
+
+class InboundEmailChangeList(ChangeList):
+    def get_ordering(self, request, queryset):
+        # при поиске без явной сортировки по колонке — по релевантности (search_rank из inbound_search)
+        if self.query.strip() and ORDER_VAR not in self.params:
+            return ["-search_rank", "-pk"]
+        return super().get_ordering(request, queryset)
+
 @admin.register(InboundEmail)
 class InboundEmailAdmin(admin.ModelAdmin):
-    list_display = ("subject", "from_email", "date", "created_at")
-    search_fields = ("subject", "from_email", "to_email", "snippet", "body_text")
-    readonly_fields = ("uid", "message_id", "raw_headers", "created_at", "html_preview")
-    actions = [fetch_gmail_now]
+    list_display = ("subject", "from_email", "date", "booking", "created_at")
+    list_select_related = ("booking",)
+    # поиск идёт по полнотекстовому индексу (get_search_results), поле нужно, чтобы админка показала строку поиска
+    search_fields = ("subject",)
+    search_help_text = "Слова из темы, адресов и текста письма; последнее слово — начало слова."
+    readonly_fields = ("uid", "message_id", "in_reply_to", "references", "raw_key", "raw_size",
+                       "raw_headers", "created_at", "text_preview", "html_preview")
+    raw_id_fields = ("booking",)
+    actions = [fetch_gmail_now, match_to_bookings]
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return inbound_search.filter_queryset(queryset, search_term), False
+
+    def get_changelist(self, request, **kwargs):
+        return InboundEmailChangeList
+
+    def text_preview(self, obj):
+        return format_html('<pre style="white-space:pre-wrap;margin:0;">{}</pre>', obj.body_text or "—")
+    text_preview.short_description = "Текст"
 
     def html_preview(self, obj):
         return format_html('<div style="border:1px solid #eee;padding:8px;">{}</div>', obj.body_html or "—")
     html_preview.short_description = "HTML"
 
 
+# ───────────────────────────────────────────────────────────────────────────────
+# OutboundEmail (outbox)
+@admin.action(description="Отправить повторно (вернуть в очередь)")
+def outbox_retry_now(modeladmin, request, queryset):
+    n = outbox.retry_now(queryset)
+    modeladmin.message_user(request, f"Возвращено в очередь: {n}")
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "booking", "status", "attempts", "next_attempt_at", "to_email", "sent_at", "created_at")
+    list_filter = ("status", "kind")
+    search_fields = ("booking__booking_code", "to_email", "subject")
+    readonly_fields = ("message_id", "last_error", "created_at", "sent_at")
+    list_select_related = ("booking",)
+    raw_id_fields = ("booking",)
+    actions = [outbox_retry_now]
+
+
+# PrintJob (спулер Zebra)
+@admin.action(description="Напечатать повторно (вернуть в очередь)")
+def print_retry_now(modeladmin, request, queryset):
+    n = queryset.update(status="PENDING", next_attempt_at=timezone.now())
+    modeladmin.message_user(request, f"Возвращено в очередь печати: {n}")
+
+@admin.register(PrintJob)
+class PrintJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "printer", "fmt", "booking", "status", "attempts", "next_attempt_at", "printed_at", "created_at")
+    list_filter = ("status", "printer", "fmt")
+    search_fields = ("booking__booking_code",)
+    list_select_related = ("booking",)
+    raw_id_fields = ("booking",)
+    exclude = ("payload",)
+    readonly_fields = ("last_error", "printed_at", "created_at")
+    actions = [print_retry_now]
+
+
 # ------- вспомогалки ---------------------------------------------------------
 def _status_badge(status: str) -> str:
     s = (status or "").upper()
@@ -137,6 +199,12 @@ def backfill_region_name(modeladmin, request, queryset):
             fixed += 1
     modeladmin.message_user(request, f"Обновлено записей: {fixed}")
 
+@admin.action(description="Пересобрать снапшот имён туристов")
+def refresh_travelers_names(modeladmin, request, queryset):
+    qs = queryset.only("id", "travelers_csv", "travelers_names")
+    fixed = BookingSale.refresh_travelers_names(qs)
+    modeladmin.message_user(request, f"Обновлено записей: {fixed}")
+
 # ------- BookingSale (основной список продаж) --------------------------------
 @admin.register(BookingSale)
 class BookingSaleAdmin(admin.ModelAdmin):
@@ -153,7 +221,7 @@ class BookingSaleAdmin(admin.ModelAdmin):
         "pickup_point_name", "room_number"
     )
     readonly_fields = ("created_at",)
-    actions = ["export_bookings_xlsx", backfill_region_name]
+    actions = ["export_bookings_xlsx", backfill_region_name, refresh_travelers_names]
 
     def travelers_names_readonly(self, obj):
         if not obj or not obj.travelers_names:
@@ -460,18 +528,16 @@ class FamilyBookingAdmin(admin.ModelAdmin):
                 up_file = form.cleaned_data.get("file")
                 dry = bool(form.cleaned_data.get("dry_run", False))
                 try:
-                    result = tourists_excel.import_file(up_file, dry_run=dry)
-                    families = result.get("families_created", 0)
-                    travelers = result.get("travelers_created", 0)
-                    skipped = result.get("skipped", 0)
-                    msg = f"Семей: {families}, туристов: {travelers}, пропущено: {skipped}."
+                    # разбор — в фоне (manage.py import_worker), здесь только очередь
+                    job = import_jobs.submit(up_file, dry_run=dry, user=request.user)
                     messages.success(
                         request,
-                        ("Проверка прошла успешно. " if dry else "Импорт завершён. ") + msg
+                        f"{'Проверка' if dry else 'Импорт'} #{job.id} поставлен в очередь — "
+                        f"прогресс и замечания на странице задания."
                     )
-                    return redirect("admin:sales_familybooking_changelist")
+                    return redirect("admin:sales_importjob_change", job.id)
                 except Exception as e:
-                    log.exception("Ошибка при импорте туристов")
+                    log.exception("Ошибка при постановке импорта туристов")
                     messages.error(request, f"Ошибка импорта: {e}")
             else:
                 messages.error(request, f"Проверьте форму: {form.errors.as_text()}")
@@ -482,6 +548,46 @@ class FamilyBookingAdmin(admin.ModelAdmin):
         return TemplateResponse(request, "admin/sales/familybooking/import_form.html", context)
 
 
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "original_name", "dry_run", "status", "progress_display",
+                    "created_families", "created_travelers", "skipped", "created_by", "created_at")
+    list_filter = ("status", "dry_run")
+    search_fields = ("original_name",)
+    list_select_related = ("created_by",)
+    actions = ("requeue",)
+    exclude = ("issues",)
+    readonly_fields = (
+        "file", "original_name", "dry_run", "created_by", "status", "attempts", "next_attempt_at",
+        "last_error", "sheet", "rows_total", "rows_done", "next_row", "created_families",
+        "updated_families", "created_travelers", "skipped", "column_mapping", "issues_table",
+        "created_at", "started_at", "finished_at",
+    )
+
+    def has_add_permission(self, request):
+        return False    # задания создаются из формы импорта
+
+    @admin.display(description="Прогресс")
+    def progress_display(self, obj):
+        p = obj.progress
+        return f"{obj.rows_done}" if p is None else f"{obj.rows_done} ({p:.0%})"
+
+    @admin.display(description="Замечания")
+    def issues_table(self, obj):
+        if not obj.issues:
+            return "—"
+        rows = format_html_join(
+            "", "<tr><td>{}</td><td>{}</td><td>{}</td></tr>",
+            ((i.get("rownum"), i.get("message"), i.get("payload") or "") for i in obj.issues),
+        )
+        return format_html("<table><tr><th>#</th><th>Сообщение</th><th>Данные</th></tr>{}</table>", rows)
+
+    @admin.action(description="Перезапустить (продолжить с последней записанной пачки)")
+    def requeue(self, request, queryset):
+        n = queryset.exclude(status="DONE").update(status="PENDING", attempts=0, next_attempt_at=timezone.now())
+        self.message_user(request, f"Поставлено в очередь: {n}")
+
+
 # ───────────────────────────────────────────────────────────────────────────────
 # Traveler
 @admin.register(Traveler)
@@ -494,6 +600,20 @@ class TravelerAdmin(admin.ModelAdmin):
     search_fields = ("last_name", "first_name", "passport", "email", "phone")
 
 
+@admin.register(HotelAlias)
+class HotelAliasAdmin(admin.ModelAdmin):
+    form = HotelAliasForm
+    list_display = ("raw_name", "hotel_id", "hotel_name", "region_name", "resolved_at")
+    list_filter = ("region_name",)
+    search_fields = ("alias", "raw_name", "hotel_name")
+    readonly_fields = ("alias", "resolved_at")
+
+    def save_model(self, request, obj, form, change):
+        # alias выставляет HotelAliasForm из написания; ручная правка соответствия постоянна
+        obj.resolved_at = timezone.now()
+        super().save_model(request, obj, form, change)
+
+
 # ───────────────────────────────────────────────────────────────────────────────
 # Прочие справочники
 @admin.register(Company)
@@ -1,6 +1,30 @@
 # sales/forms.py
 from django import forms
 
+from .models import HotelAlias
+from .services.hotels import alias_key
+
 class TouristsImportForm(forms.Form):
     file = forms.FileField(label="Файл с туристами (Excel/CSV)")
     dry_run = forms.BooleanField(label="Только проверка", required=False)
+
+
+class HotelAliasForm(forms.ModelForm):
+    """Ключ alias считается из написания; совпадение с другой строкой — ошибка формы, а не 500."""
+
+    class Meta:
+        model = HotelAlias
+        fields = ("raw_name", "hotel_id", "hotel_name", "region_name")
+
+    def clean_raw_name(self):
+        raw = self.cleaned_data["raw_name"]
+        key = alias_key(raw)
+        if not key:
+            raise forms.ValidationError("Пустое написание.")
+        clash = HotelAlias.objects.filter(alias=key).exclude(pk=self.instance.pk).first()
+        if clash is not None:
+            raise forms.ValidationError(
+                f"Это написание уже сопоставлено (запись #{clash.pk}: «{clash.raw_name}») — поправьте её."
+            )
+        self.instance.alias = key
+        return raw
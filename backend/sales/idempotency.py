@@ -0,0 +1,135 @@
+# backend/sales/idempotency.py
+"""
+Поддержка заголовка Idempotency-Key для мутирующих POST.
+
+Гиды на плохой мобильной связи повторяют запросы. Если клиент прислал
+Idempotency-Key, ключ сначала занимается отдельной короткой транзакцией
+(запись без ответа — «в работе»): параллельный повтор видит её и получает
+409, а сама вьюха идёт своими транзакциями, не держа общую блокировку
+записи SQLite. Успешный ответ сохраняется в ту же запись, и повторы с тем
+же ключом получают его — одним индексированным запросом.
+
+Если процесс упал между вьюхой и сохранением ответа, запись «в работе»
+через IDEMPOTENCY_IN_PROGRESS_SECONDS может занять повтор с тем же телом.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+TTL = timedelta(seconds=getattr(settings, "IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+IN_PROGRESS = timedelta(seconds=getattr(settings, "IDEMPOTENCY_IN_PROGRESS_SECONDS", 5 * 60))
+
+
+def _scope(name: str, request, kwargs) -> str:
+    user = getattr(request, "user", None)
+    uid = user.pk if getattr(user, "is_authenticated", False) else "-"
+    parts = [name, str(uid), *(str(v) for _, v in sorted(kwargs.items()))]
+    return ":".join(parts)[:128]
+
+
+def _request_hash(request) -> str:
+    try:
+        data = request.data
+        if hasattr(data, "lists"):  # QueryDict из form/multipart
+            data = dict(data.lists())
+        raw = json.dumps(data, sort_keys=True, default=str)
+    except Exception:
+        raw = ""
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _replay(rec: IdempotencyKey, request_hash: str) -> Response:
+    if rec.request_hash != request_hash:
+        return Response({"detail": f"{HEADER} was already used with a different payload"}, status=422)
+    if rec.status_code is None:
+        return Response({"detail": f"A request with this {HEADER} is still in progress"}, status=409)
+    resp = Response(rec.response_body, status=rec.status_code)
+    resp["Idempotent-Replayed"] = "true"
+    return resp
+
+
+def _begin(scope: str, key: str, request_hash: str, now):
+    """
+    Занять ключ коротким коммитом. (запись, None) — выполняем вьюху;
+    (None, ответ) — ключ уже использован: сохранённый ответ, 409 или 422.
+    """
+    with transaction.atomic():
+        IdempotencyKey.objects.filter(scope=scope, key=key, expires_at__lte=now).delete()
+        try:
+            with transaction.atomic():
+                rec = IdempotencyKey.objects.create(scope=scope, key=key, request_hash=request_hash, expires_at=now + TTL)
+            return rec, None
+        except IntegrityError:
+            rec = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+    if rec is None:     # запись удалили между create и чтением — предыдущий запрос завершился ошибкой
+        return None, Response({"detail": f"A request with this {HEADER} is still in progress"}, status=409)
+
+    stale = rec.status_code is None and rec.request_hash == request_hash and rec.created_at <= now - IN_PROGRESS
+    # тот запрос не завершился (процесс упал) — занимаем ключ условным update, как аренды в outbox
+    if stale and IdempotencyKey.objects.filter(pk=rec.pk, status_code__isnull=True, created_at=rec.created_at).update(created_at=now):
+        rec.created_at = now
+        return rec, None
+    return None, _replay(rec, request_hash)
+
+
+def idempotent(name: str):
+    """
+    Декоратор метода APIView (post). Без заголовка — обычное поведение.
+    Запоминаем только успешные ответы (< 400): ошибки валидации, 5xx и
+    исключения снимают отметку «в работе», чтобы повтор прошёл заново.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key = (request.headers.get(HEADER) or "").strip()
+            if not key:
+                return method(self, request, *args, **kwargs)
+            if len(key) > 128:
+                return Response({"detail": f"{HEADER} is too long (max 128)"}, status=400)
+
+            scope = _scope(name, request, kwargs)
+            req_hash = _request_hash(request)
+            now = timezone.now()
+
+            rec = IdempotencyKey.objects.filter(scope=scope, key=key, expires_at__gt=now).first()
+            if rec and rec.status_code is not None:
+                return _replay(rec, req_hash)
+
+            rec, replay = _begin(scope, key, req_hash, now)
+            if replay is not None:
+                return replay
+
+            try:
+                response = method(self, request, *args, **kwargs)
+            except Exception:
+                rec.delete()
+                raise
+
+            if response.status_code >= 400 or getattr(response, "data", None) is None:
+                rec.delete()
+                return response
+
+            rec.status_code = response.status_code
+            # сохраняем ровно то, что увидит клиент (Decimal/даты как в JSONRenderer)
+            rec.response_body = json.loads(JSONRenderer().render(response.data) or b"null")
+            rec.save(update_fields=["status_code", "response_body"])
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired() -> int:
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -3,18 +3,32 @@
 # sales/importers/tourists_excel.py
 from __future__ import annotations
 
+import csv
+import io
+import logging
 import re
+import tempfile
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import datetime
-from io import BytesIO
-from typing import Any, BinaryIO, Dict, List, Optional
+from itertools import chain, islice
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
 
+import openpyxl
 import pandas as pd
+from django.conf import settings
 from django.db import IntegrityError, transaction
+from django.utils import timezone
 from django.utils.timezone import make_naive
 
 from sales.models import FamilyBooking, Traveler
-from sales.services import costasolinfo as csi
+from sales.services import hotels
+
+log = logging.getLogger(__name__)
+
+CHUNK_ROWS = getattr(settings, "TOURISTS_IMPORT_CHUNK_ROWS", 2000)
+SPOOL_BYTES = 5 * 1024 * 1024      # CSV больше — во временный файл на диске
+HEADER_SCAN_ROWS = 10
 
 
 # ---------- утилиты нормализации ----------
@@ -55,7 +69,7 @@ def _parse_date(v):
             return make_naive(v).date() if isinstance(v, pd.Timestamp) and v.tzinfo else v.date()
         except Exception:
             return v.date() if hasattr(v, "date") else None
-    for fmt in ("%d.%m.%Y", "%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y"):
+    for fmt in ("%d.%m.%Y", "%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%Y-%m-%d %H:%M:%S"):
         try:
             return datetime.strptime(str(v).strip(), fmt).date()
         except Exception:
@@ -64,24 +78,6 @@ def _parse_date(v):
     return d.date() if not pd.isna(d) else None
 
 
-def _resolve_hotel(name: str) -> tuple[Optional[int], str, str]:
-    """Пытаемся найти hotel_id по названию через CSI. Возвращаем (id, name, region_name)."""
-    try:
-        items = csi.search_hotels(name, limit=1) or []
-        if isinstance(items, dict):
-            items = items.get("items") or []
-        if items:
-            h = items[0]
-            return (
-                h.get("id"),
-                h.get("name") or h.get("title") or name,
-                (h.get("region") or h.get("region_name") or ""),
-            )
-    except Exception:
-        pass
-    return None, name, ""
-
-
 # ---------- карта колонок ----------
 
 COLMAP = {
@@ -145,35 +141,97 @@ def _norm_name_excel(s: str) -> str:
 
 # ---------- авто-детекция строки заголовков ----------
 
-def _auto_header(df0: pd.DataFrame) -> pd.DataFrame:
-    """Если заголовки 'Unnamed' или «мимо», ищем строку-шапку по знакомым названиям."""
-    def _score(cols: List[str]) -> int:
-        cols_l = [str(c).strip().lower() for c in cols]
-        score = 0
-        for aliases in COLMAP.values():
-            for a in aliases:
-                if a.lower() in cols_l:
-                    score += 1
-                    break
-        return score
-
-    if _score(list(df0.columns)) >= 2:
-        return df0  # и так норм
+def _score(cols: List[Any]) -> int:
+    cols_l = [str(c).strip().lower() for c in cols]
+    score = 0
+    for aliases in COLMAP.values():
+        for a in aliases:
+            if a.lower() in cols_l:
+                score += 1
+                break
+    return score
 
+
+def _header_index(rows: List[tuple]) -> Optional[int]:
+    """Строка-шапка среди первых строк листа — по знакомым названиям колонок."""
     best = (None, -1)
-    for i in range(min(10, len(df0))):
-        row = [str(x).strip() for x in df0.iloc[i].tolist()]
-        sc = _score(row)
+    for i, row in enumerate(rows[:HEADER_SCAN_ROWS]):
+        sc = _score([x for x in row if x is not None])
         if sc > best[1]:
             best = (i, sc)
     header_idx, sc = best
-    if header_idx is not None and sc >= 2:
-        new_cols = [str(x).strip() or f"col_{j}" for j, x in enumerate(df0.iloc[header_idx].tolist())]
-        df = df0.iloc[header_idx + 1:].copy()
-        df.columns = new_cols
-        return df
+    return header_idx if header_idx is not None and sc >= 2 else None
+
+
+def _header(row: tuple) -> List[str]:
+    # пустые и повторяющиеся названия делаем уникальными, иначе df[col] вернёт таблицу
+    cols, seen = [], set()
+    for j, x in enumerate(row):
+        name = str(x).strip() if x is not None else ""
+        name = name or f"col_{j}"
+        while name in seen:
+            name += f".{j}"
+        seen.add(name)
+        cols.append(name)
+    return cols
+
+
+# ---------- потоковое чтение ----------
+
+@contextmanager
+def _open_rows(file) -> Iterator[Tuple[str, Iterator[tuple], Optional[int]]]:
+    """
+    (имя листа, итератор строк-кортежей, число строк или None).
+    Лист не материализуется целиком: xlsx — openpyxl read-only,
+    CSV — csv.reader поверх SpooledTemporaryFile (большие — на диске).
+    """
+    name = str(getattr(file, "name", "") or "").lower()
+    if name.endswith(".csv"):
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+        try:
+            lines = 0
+            chunks = file.chunks() if hasattr(file, "chunks") else iter(lambda: file.read(1 << 16), b"")
+            for chunk in chunks:
+                spool.write(chunk)
+                lines += chunk.count(b"\n")     # оценка числа строк для прогресса
+            spool.seek(0)
+            text = io.TextIOWrapper(spool, encoding="utf-8-sig", errors="replace", newline="")
+            yield "CSV", (tuple(r) for r in csv.reader(text)), lines
+        finally:
+            spool.close()
+    elif name.endswith(".xls"):
+        # старый формат openpyxl не читает — как раньше, через pandas (такие файлы небольшие)
+        xls = pd.ExcelFile(file)
+        df0 = xls.parse(xls.sheet_names[0], header=None)
+        yield xls.sheet_names[0], (tuple(None if pd.isna(v) else v for v in r) for r in df0.itertuples(index=False)), len(df0)
+    else:
+        wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[0]
+            yield ws.title, ws.iter_rows(values_only=True), ws.max_row
+        finally:
+            wb.close()
+
+
+def _blank(row: tuple) -> bool:
+    return all(v is None or (isinstance(v, str) and not v.strip()) for v in row)
 
-    return df0
+
+def _chunked_frames(rows: Iterator[tuple], columns: List[str], first: int, size: int, start_row: int = 0):
+    """DataFrame-ы по size строк; индекс — номер строки листа (для rownum в отчёте)."""
+    width = len(columns)
+    buf, index = [], []
+    for pos, row in enumerate(rows, start=first):
+        if pos < start_row or _blank(row):
+            continue
+        row = tuple(row[:width]) + (None,) * (width - len(row))
+        buf.append(row)
+        index.append(pos)
+        if len(buf) >= size:
+            yield pd.DataFrame(buf, columns=columns, index=index, dtype=object)
+            buf, index = [], []
+    if buf:
+        yield pd.DataFrame(buf, columns=columns, index=index, dtype=object)
 
 
 # ---------- отчёт ----------
@@ -194,136 +252,268 @@ class ImportReport:
     created_travelers: int = 0
     skipped: int = 0
     issues: List[RowIssue] = field(default_factory=list)
+    next_row: int = 0       # первая строка листа, ещё не записанная (для продолжения)
 
 
-# ---------- основной импортёр ----------
+# ---------- нормализация колонок (целиком, без iterrows) ----------
 
-def import_tourists_excel(file, dry_run: bool = True) -> Dict[str, Any]:
-    # читаем .xlsx или .csv
-    if hasattr(file, "name") and str(file.name).lower().endswith(".csv"):
-        df0 = pd.read_csv(file, header=None)  # без заголовка — определим сами
-        sheet_name = "CSV"
-    else:
-        xls = pd.ExcelFile(file)
-        sheet_name = xls.sheet_names[0]
-        df0 = xls.parse(sheet_name, header=None)  # без заголовков — определим сами
-
-    df = _auto_header(df0)
-    report = ImportReport(sheet=sheet_name, total_rows=len(df))
-
-    # маппинг колонок
-    cols = {key: _find_col(df, aliases) for key, aliases in COLMAP.items()}
-    required = ["hotel", "last_name", "first_name"]
-    missing = [k for k in required if not cols.get(k)]
-    if missing:
-        report.issues.append(RowIssue(0, f"Нет обязательных колонок: {missing}"))
-        return {
-            **report.__dict__,
-            "column_mapping": {k: cols[k] for k in cols if cols[k]},
-            "issues": [i.__dict__ for i in report.issues],
-            "dry_run": dry_run,
-        }
-
-    def _do():
-        for idx, row in df.iterrows():
-            # отдельный savepoint на каждую строку
+BATCH = 500
+
+FAMILY_FIELDS = ("hotel_name", "region_name", "arrival_date", "departure_date")
+TRAVELER_FIELDS = ("middle_name", "nationality", "passport", "passport_expiry", "phone", "email", "note")
+TEXT_KEYS = ("ref_code", "last_name", "first_name", "middle_name", "nationality", "passport", "phone", "email", "note")
+DATE_KEYS = {"arrival": "arrival_date", "departure": "departure_date", "dob": "dob", "passport_expiry": "passport_expiry"}
+
+
+def _text(s: pd.Series) -> pd.Series:
+    return s.astype("string").fillna("").str.strip().astype(object)
+
+
+def _names(s: pd.Series) -> pd.Series:
+    """Векторный аналог _norm_name_excel — те же значения, что даст Traveler.save()."""
+    return s.str.replace(r"\s+", " ", regex=True).str.title()
+
+
+def _dates(s: pd.Series) -> pd.Series:
+    """Даты разбираем по уникальным значениям: в сезонном файле их сотни на тысячи строк."""
+    uniq = pd.unique(s.dropna())
+    parsed = pd.Series({v: _parse_date(v) for v in uniq}, dtype=object) if len(uniq) else pd.Series(dtype=object)
+    out = s.map(parsed)
+    return out.astype(object).where(out.notna(), None)
+
+
+def _normalize(df: pd.DataFrame, cols: Dict[str, Optional[str]]) -> pd.DataFrame:
+    frame = pd.DataFrame({"rownum": df.index + 2, "hotel_raw": _text(df[cols["hotel"]])}, index=df.index)
+    for key in TEXT_KEYS:
+        frame[key] = _text(df[cols[key]]) if cols.get(key) else ""
+    for key, name in DATE_KEYS.items():
+        frame[name] = _dates(df[cols[key]]) if cols.get(key) else None
+    for key in ("last_name", "first_name", "middle_name"):
+        frame[key] = _names(frame[key])
+    return frame
+
+
+def _resolve_hotels(names) -> Dict[str, tuple]:
+    """Каждое написание отеля — один раз на файл, через таблицу алиасов (sales.services.hotels)."""
+    return hotels.resolve_many(names)
+
+
+def _merge(into: dict, row, fields) -> None:
+    # последнее непустое значение побеждает — как при построчных обновлениях
+    for f in fields:
+        v = getattr(row, f)
+        if v is not None and v != "":
+            into[f] = v
+
+
+def _chunks(items: List, size: int = BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# ---------- план изменений ----------
+
+@dataclass
+class _Plan:
+    new_families: Dict[tuple, FamilyBooking] = field(default_factory=dict)
+    changed_families: List[FamilyBooking] = field(default_factory=list)
+    family_fields: set = field(default_factory=set)                 # какие поля реально менялись
+    family_ids: Dict[tuple, int] = field(default_factory=dict)
+    new_travelers: List[tuple] = field(default_factory=list)        # (family_key, rownum, Traveler)
+    changed_travelers: List[Traveler] = field(default_factory=list)
+    traveler_fields: set = field(default_factory=set)
+
+
+def _plan(frame: pd.DataFrame) -> _Plan:
+    """
+    Что создать и что обновить: семьи и туристы из файла сводятся по ключам,
+    существующие читаются пачками по затронутым ключам.
+    """
+    families: Dict[tuple, dict] = {}
+    travelers: Dict[tuple, dict] = {}
+    rownums: Dict[tuple, int] = {}
+    for r in frame.itertuples(index=False):
+        fkey = (r.ref_code, r.hotel_id)
+        _merge(families.setdefault(fkey, {}), r, FAMILY_FIELDS)
+        # Traveler уникален в пределах семьи по (last_name, first_name, dob)
+        tkey = (fkey, r.last_name, r.first_name, r.dob)
+        _merge(travelers.setdefault(tkey, {}), r, TRAVELER_FIELDS)
+        rownums[tkey] = r.rownum
+
+    plan = _Plan()
+
+    # существующие семьи: первая по порядку модели — как прежний .first()
+    existing: Dict[tuple, FamilyBooking] = {}
+    hotel_ids = sorted({k[1] for k in families})
+    for refs in _chunks(sorted({k[0] for k in families})):
+        for fam in FamilyBooking.objects.filter(ref_code__in=refs, hotel_id__in=hotel_ids):
+            key = (fam.ref_code, fam.hotel_id)
+            if key in families:
+                existing.setdefault(key, fam)
+
+    now = timezone.now()
+    for key, vals in families.items():
+        fam = existing.get(key)
+        if fam is None:
+            plan.new_families[key] = FamilyBooking(ref_code=key[0], hotel_id=key[1], **vals)
+            continue
+        plan.family_ids[key] = fam.pk
+        changed = False
+        for f, v in vals.items():
+            if getattr(fam, f) != v:
+                setattr(fam, f, v)
+                plan.family_fields.add(f)
+                changed = True
+        if changed:
+            fam.updated_at = now      # bulk_update не трогает auto_now
+            plan.changed_families.append(fam)
+
+    # существующие туристы — только в уже существующих семьях
+    known: Dict[tuple, Traveler] = {}
+    key_by_family = {pk: key for key, pk in plan.family_ids.items()}
+    for ids in _chunks(sorted(key_by_family)):
+        qs = Traveler.objects.filter(family_id__in=ids).only("id", "family_id", "last_name", "first_name", "dob", *TRAVELER_FIELDS)
+        for t in qs:
+            known[(key_by_family[t.family_id], t.last_name, t.first_name, t.dob)] = t
+
+    for tkey, vals in travelers.items():
+        fkey, last_name, first_name, dob = tkey
+        t = known.get(tkey)
+        if t is None:
+            t = Traveler(last_name=last_name, first_name=first_name, dob=dob, **vals)
+            plan.new_travelers.append((fkey, rownums[tkey], t))
+            continue
+        changed = False
+        for f, v in vals.items():
+            if getattr(t, f) != v:
+                setattr(t, f, v)
+                plan.traveler_fields.add(f)
+                changed = True
+        if changed:
+            t.updated_at = now
+            plan.changed_travelers.append(t)
+    return plan
+
+
+def _create_travelers(items: List[tuple], report: ImportReport) -> None:
+    for chunk in _chunks(items):
+        try:
             with transaction.atomic():
-                hotel_raw = str(row.get(cols["hotel"], "")).strip()
-                if not hotel_raw:
-                    report.issues.append(RowIssue(idx + 2, "Пустой отель"))
-                    report.skipped += 1
-                    continue
-
-                hotel_id, hotel_name, region_name = _resolve_hotel(hotel_raw)
-
-                ref_code = str(row.get(cols.get("ref_code"), "")).strip() if cols.get("ref_code") else ""
-                arrival = _parse_date(row.get(cols.get("arrival"))) if cols.get("arrival") else None
-                departure = _parse_date(row.get(cols.get("departure"))) if cols.get("departure") else None
-
-                fam = FamilyBooking.objects.filter(ref_code=ref_code or "", hotel_id=hotel_id or 0).first()
-                if not fam:
-                    fam = FamilyBooking.objects.create(
-                        ref_code=ref_code or "",
-                        hotel_id=hotel_id or 0,
-                        hotel_name=hotel_name,
-                        region_name=region_name,
-                        arrival_date=arrival,
-                        departure_date=departure,
-                    )
-                    report.created_families += 1
-                else:
-                    changed = False
-                    if arrival and fam.arrival_date != arrival:
-                        fam.arrival_date = arrival
-                        changed = True
-                    if departure and fam.departure_date != departure:
-                        fam.departure_date = departure
-                        changed = True
-                    if hotel_name and fam.hotel_name != hotel_name:
-                        fam.hotel_name = hotel_name
-                        changed = True
-                    if region_name and fam.region_name != region_name:
-                        fam.region_name = region_name
-                        changed = True
-                    if changed:
-                        fam.save(update_fields=["arrival_date", "departure_date", "hotel_name", "region_name"])
-                        report.updated_families += 1
-
-                # Traveler уникален в пределах семьи по (last_name, first_name, dob)
-                last_name = str(row.get(cols["last_name"], "")).strip()
-                first_name = str(row.get(cols["first_name"], "")).strip()
-                middle_name = str(row.get(cols.get("middle_name"), "")).strip() if cols.get("middle_name") else ""
-                dob = _parse_date(row.get(cols.get("dob"))) if cols.get("dob") else None
-
-                defaults = {
-                    "middle_name": middle_name,
-                    "nationality": str(row.get(cols.get("nationality"), "")).strip() if cols.get("nationality") else "",
-                    "passport": str(row.get(cols.get("passport"), "")).strip() if cols.get("passport") else "",
-                    "passport_expiry": _parse_date(row.get(cols.get("passport_expiry"))) if cols.get("passport_expiry") else None,
-                    "phone": str(row.get(cols.get("phone"), "")).strip() if cols.get("phone") else "",
-                    "email": str(row.get(cols.get("email"), "")).strip() if cols.get("email") else "",
-                    "note": str(row.get(cols.get("note"), "")).strip() if cols.get("note") else "",
-                }
-
-                # безопасная логика: get_or_create + обновление полей, без вставки дублей
-                try:
-                    obj, created = Traveler.objects.get_or_create(
-                        family=fam,
-                        last_name=last_name,
-                        first_name=first_name,
-                        dob=dob,
-                        defaults={k: v for k, v in defaults.items() if v not in (None, "", pd.NaT)},
-                    )
-                    if created:
-                        report.created_travelers += 1
-                    else:
-                        # обновляем только непустые и изменившиеся поля
-                        changed_fields = []
-                        for k, v in defaults.items():
-                            if v not in (None, "", pd.NaT):
-                                cur = getattr(obj, k, None)
-                                if cur != v:
-                                    setattr(obj, k, v)
-                                    changed_fields.append(k)
-                        if changed_fields:
-                            obj.save(update_fields=changed_fields)
-
-                except IntegrityError:
-                    # крайне редко (гонка/нормализация в save) — помечаем как пропуск и едем дальше
-                    report.skipped += 1
-                    report.issues.append(RowIssue(
-                        idx + 2,
-                        "Дублирующийся турист (уникальность нарушена)",
-                        {"family_id": fam.id, "last_name": last_name, "first_name": first_name, "dob": dob}
-                    ))
+                Traveler.objects.bulk_create([t for _, _, t in chunk])
+            report.created_travelers += len(chunk)
+            continue
+        except IntegrityError:
+            pass
+        # крайне редко (параллельный импорт той же семьи) — эту пачку по одному, дубли в отчёт
+        for _, rownum, t in chunk:
+            t.pk = None
+            try:
+                with transaction.atomic():
+                    t.save()
+                report.created_travelers += 1
+            except IntegrityError:
+                report.skipped += 1
+                report.issues.append(RowIssue(
+                    rownum,
+                    "Дублирующийся турист (уникальность нарушена)",
+                    {"family_id": t.family_id, "last_name": t.last_name, "first_name": t.first_name, "dob": t.dob}
+                ))
+
+
+def _apply(plan: _Plan, report: ImportReport) -> None:
+    with transaction.atomic():
+        created = list(plan.new_families.values())
+        FamilyBooking.objects.bulk_create(created, batch_size=BATCH)
+        for key, fam in plan.new_families.items():
+            plan.family_ids[key] = fam.pk
+        if plan.changed_families:
+            # только изменившиеся колонки: CASE WHEN на каждое поле в bulk_update недёшев
+            FamilyBooking.objects.bulk_update(plan.changed_families, [*sorted(plan.family_fields), "updated_at"], batch_size=BATCH)
+
+        for fkey, _, t in plan.new_travelers:
+            t.family_id = plan.family_ids[fkey]
+        _create_travelers(plan.new_travelers, report)
+        if plan.changed_travelers:
+            Traveler.objects.bulk_update(plan.changed_travelers, [*sorted(plan.traveler_fields), "updated_at"], batch_size=BATCH)
+
 
+# ---------- основной импортёр ----------
+
+def _process(df: pd.DataFrame, cols: Dict[str, Optional[str]], report: ImportReport,
+             dry_run: bool, seen: Dict[str, set]) -> None:
+    """Одна пачка строк: нормализация → отели → план → запись (своя транзакция)."""
+    frame = _normalize(df, cols)
+
+    empty = frame["hotel_raw"] == ""
+    for rownum in frame.loc[empty, "rownum"]:
+        report.issues.append(RowIssue(int(rownum), "Пустой отель"))
+    report.skipped += int(empty.sum())
+    frame = frame[~empty]
+    if frame.empty:
+        return
+
+    resolved = frame["hotel_raw"].map(_resolve_hotels(frame["hotel_raw"].unique()))
+    frame = frame.assign(
+        hotel_id=[h[0] or 0 for h in resolved],
+        hotel_name=[h[1] for h in resolved],
+        region_name=[h[2] for h in resolved],
+    )
+
+    plan = _plan(frame)
+    report.updated_families += len(plan.changed_families)
     if dry_run:
-        # сухой прогон откатывает всё
-        with transaction.atomic():
-            _do()
-            transaction.set_rollback(True)
+        # сухой прогон — только план, в базу не пишем; «новых» из прошлых пачек не считаем дважды
+        fresh = plan.new_families.keys() - seen["families"]
+        seen["families"] |= fresh
+        report.created_families += len(fresh)
+        keys = {(fkey, t.last_name, t.first_name, t.dob) for fkey, _, t in plan.new_travelers}
+        report.created_travelers += len(keys - seen["travelers"])
+        seen["travelers"] |= keys
     else:
-        _do()
+        report.created_families += len(plan.new_families)
+        _apply(plan, report)
+
+
+def import_tourists_excel(file, dry_run: bool = True, *, chunk_rows: int = CHUNK_ROWS, start_row: int = 0,
+                          on_progress: Optional[Callable[[ImportReport, Optional[int]], None]] = None) -> Dict[str, Any]:
+    """
+    Импорт .xlsx/.csv пачками по chunk_rows строк: память ограничена пачкой,
+    каждая пачка записывается своей транзакцией. on_progress(report, ожидаемое
+    число строк или None) вызывается внутри транзакции пачки — сохранённый им
+    report.next_row фиксируется вместе с данными, и start_row=next_row
+    продолжает прерванный импорт без повторов.
+    """
+    with _open_rows(file) as (sheet_name, rows, expected):
+        report = ImportReport(sheet=sheet_name)
+        head = list(islice(rows, HEADER_SCAN_ROWS))
+        header_idx = _header_index(head)
+        columns = _header(head[header_idx]) if header_idx is not None else []
+
+        # маппинг колонок
+        cols = {key: _find_col(pd.DataFrame(columns=columns), aliases) for key, aliases in COLMAP.items()}
+        required = ["hotel", "last_name", "first_name"]
+        missing = [k for k in required if not cols.get(k)]
+        if missing:
+            report.issues.append(RowIssue(0, f"Нет обязательных колонок: {missing}"))
+            return {
+                **report.__dict__,
+                "column_mapping": {k: cols[k] for k in cols if cols[k]},
+                "issues": [i.__dict__ for i in report.issues],
+                "dry_run": dry_run,
+            }
+
+        if expected is not None:
+            expected = max(0, expected - header_idx - 1)
+        body = chain(head[header_idx + 1:], rows)
+        seen: Dict[str, set] = {"families": set(), "travelers": set()}
+        for df in _chunked_frames(body, columns, header_idx + 1, max(1, chunk_rows), start_row):
+            with transaction.atomic():
+                report.total_rows += len(df)
+                _process(df, cols, report, dry_run, seen)
+                report.next_row = int(df.index[-1]) + 1
+                if on_progress:
+                    on_progress(report, expected)
+            log.info("tourists import %s: %s rows", sheet_name, report.total_rows)
 
     colmap_human = {k: cols[k] for k in cols if cols[k]}
     return {
@@ -334,15 +524,16 @@ def import_tourists_excel(file, dry_run: bool = True) -> Dict[str, Any]:
     }
 
 
-# ---------- адаптер для админки ----------
+# ---------- синхронный вход ----------
 
 def import_file(up_file: BinaryIO, dry_run: bool = False) -> dict:
     """
-    Унифицированный вход, который ожидает админка.
+    Синхронный импорт (shell, скрипты). Страница и админка ставят файл
+    в очередь — sales.services.import_jobs.
     Возвращает словарь с ключами, которые показываем в сообщении.
     """
-    data = up_file.read()
-    result = import_tourists_excel(BytesIO(data), dry_run=dry_run)
+    # файл читается потоком, целиком в память не попадает
+    result = import_tourists_excel(up_file, dry_run=dry_run)
     return {
         "families_created": int(result.get("created_families", 0)),
         "travelers_created": int(result.get("created_travelers", 0)),
@@ -0,0 +1,69 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# то, что не должно грузиться при старте воркера (нужно только PDF/импорту/выгрузкам)
+HEAVY = ("weasyprint", "pydyf", "qrcode", "PIL", "pandas", "numpy", "openpyxl", "xlsxwriter", "serial")
+
+CHILD = """
+import resource, sys, json, importlib
+import django
+django.setup()
+from django.conf import settings
+from django.urls import get_resolver
+importlib.import_module(settings.ROOT_URLCONF)
+get_resolver().url_patterns
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"rss_kb": rss, "modules": len(sys.modules)}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Boot a fresh interpreter like a web worker (django.setup + URLconf) and report import time and heavy modules"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=15, help="сколько самых дорогих импортов показать")
+
+    def handle(self, *args, **opts):
+        env = dict(os.environ)
+        env.setdefault("DJANGO_SETTINGS_MODULE", os.environ.get("DJANGO_SETTINGS_MODULE") or settings.SETTINGS_MODULE)
+
+        started = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", CHILD],
+            env=env, cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        wall_ms = (time.perf_counter() - started) * 1000
+        if proc.returncode != 0:
+            raise CommandError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "boot failed")
+
+        # строки вида: "import time:  self [us] | cumulative | imported package"
+        top_level, loaded = [], set()
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            try:
+                _, cumulative, name = line[len("import time:"):].split("|", 2)
+                cumulative = int(cumulative)
+            except ValueError:
+                continue   # заголовок
+            loaded.add(name.strip().split(".")[0])
+            if not name[1:].startswith(" "):      # без отступа — импорт верхнего уровня
+                top_level.append((cumulative, name.strip()))
+
+        stats = json.loads(proc.stdout.strip().splitlines()[-1])
+        self.stdout.write(f"boot: {wall_ms:.0f} ms wall, {stats['modules']} modules, max RSS {stats['rss_kb'] // 1024} MB")
+        self.stdout.write("slowest top-level imports:")
+        for cumulative, name in sorted(top_level, reverse=True)[: opts["top"]]:
+            self.stdout.write(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+        heavy = [m for m in HEAVY if m in loaded]
+        if heavy:
+            self.stdout.write(self.style.WARNING("heavy modules loaded at boot: " + ", ".join(heavy)))
+        else:
+            self.stdout.write(self.style.SUCCESS("no heavy modules loaded at boot"))
@@ -0,0 +1,34 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from sales.services import import_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued tourist imports (ImportJob) in the background; resumes interrupted jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=2.0, help="пауза между опросами очереди, сек")
+        parser.add_argument("--once", action="store_true", help="одно задание (если есть) и выход")
+
+    def handle(self, *args, **opts):
+        if opts["once"]:
+            job = import_jobs.run_once()
+            if job is None:
+                self.stdout.write("no pending imports")
+            else:
+                self.stdout.write(
+                    f"#{job.id} {job.status}: {job.rows_done} rows, families +{job.created_families}, "
+                    f"travelers +{job.created_travelers}, skipped {job.skipped}"
+                )
+            return
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        self.stdout.write("import_worker: waiting for jobs")
+        try:
+            import_jobs.serve(interval=opts["interval"], stop=stop)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sales.services import inbound_match
+
+
+class Command(BaseCommand):
+    help = "Link inbound emails to bookings by booking code and by reply threading"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--relink", action="store_true", help="пересчитать все письма, и уже привязанные")
+        parser.add_argument("--days", type=int, default=inbound_match.ACTIVE_DAYS,
+                            help="искать коды броней с датой не старше N дней")
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        stats = inbound_match.reconcile(relink=opts["relink"], codes=inbound_match.CodeIndex.active(days=opts["days"]))
+        self.stdout.write(
+            f"scanned {stats['scanned']}, linked {stats['linked']} in {time.perf_counter() - started:.2f}s"
+        )
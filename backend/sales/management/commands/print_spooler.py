@@ -0,0 +1,47 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales.services import print_spooler
+
+
+class Command(BaseCommand):
+    help = "Print queued Zebra tickets (PrintJob) keeping the serial port open between jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", default=print_spooler.PORT, help="serial/Bluetooth порт принтера")
+        parser.add_argument("--baud", type=int, default=print_spooler.BAUD)
+        parser.add_argument("--printer", default="default", help="имя принтера в PrintJob.printer")
+        parser.add_argument("--batch", type=int, default=20, help="заданий за одну сессию порта")
+        parser.add_argument("--interval", type=float, default=1.0, help="пауза между опросами очереди, сек")
+        parser.add_argument("--once", action="store_true", help="одна итерация и выход")
+        parser.add_argument("--fake", action="store_true", help="печатать в pty-принтер (проверка без железа)")
+
+    def handle(self, *args, **opts):
+        fake = print_spooler.FakePrinter() if opts["fake"] else None
+        port = fake.port if fake else opts["port"]
+        if not port:
+            raise CommandError("Укажите --port или PRINT_SPOOLER_PORT")
+
+        device = print_spooler.SerialPrinter(port, opts["baud"])
+        spooler = print_spooler.Spooler(device, printer=opts["printer"], batch_size=max(1, opts["batch"]))
+        try:
+            if opts["once"]:
+                stats = spooler.run_once()
+                device.close()
+                self.stdout.write(" ".join(f"{k}={v}" for k, v in stats.items()))
+                if fake:
+                    self.stdout.write(f"fake printer received {len(fake.received)} bytes")
+                return
+
+            stop = threading.Event()
+            signal.signal(signal.SIGTERM, lambda *_: stop.set())
+            self.stdout.write(f"print_spooler: {opts['printer']} on {port}")
+            try:
+                spooler.serve(interval=opts["interval"], stop=stop)
+            except KeyboardInterrupt:
+                pass
+        finally:
+            if fake:
+                fake.close()
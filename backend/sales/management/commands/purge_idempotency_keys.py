@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from sales.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired Idempotency-Key records"
+
+    def handle(self, *args, **opts):
+        self.stdout.write(f"deleted={purge_expired()}")
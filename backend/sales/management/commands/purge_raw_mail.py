@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from sales.services import raw_mail
+
+
+class Command(BaseCommand):
+    help = "Delete stored raw inbound emails no longer referenced by any InboundEmail"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace-hours", type=int, default=None)
+
+    def handle(self, *args, **opts):
+        self.stdout.write(f"deleted={raw_mail.purge_orphans(opts['grace_hours'])}")
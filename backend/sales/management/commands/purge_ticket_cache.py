@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from sales.services import tickets
+
+
+class Command(BaseCommand):
+    help = "Delete cached ticket PDFs and QR images older than N days"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30)
+
+    def handle(self, *args, **opts):
+        self.stdout.write(f"deleted={tickets.purge_older_than(opts['days'])}")
@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sales.services import inbound_search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of inbound emails (FTS5 or token table)"
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        n = inbound_search.rebuild()
+        self.stdout.write(f"{inbound_search.backend()}: indexed {n} emails in {time.perf_counter() - started:.1f}s")
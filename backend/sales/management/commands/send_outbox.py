@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sales.services import outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver queued partner emails (OutboundEmail) reusing one SMTP connection per batch"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=50, help="писем на одно SMTP-соединение")
+        parser.add_argument("--loop", action="store_true", help="работать постоянно (воркер)")
+        parser.add_argument("--interval", type=float, default=5.0, help="пауза между опросами очереди, сек")
+
+    def handle(self, *args, **opts):
+        limit = max(1, opts["limit"])
+        while True:
+            # выгребаем всё, что готово, пачками
+            total = {"sent": 0, "retried": 0, "failed": 0, "skipped": 0}
+            while True:
+                stats = outbox.deliver_pending(limit=limit)
+                for k, v in stats.items():
+                    total[k] += v
+                if sum(stats.values()) < limit:
+                    break
+
+            if any(total.values()) or not opts["loop"]:
+                self.stdout.write(
+                    f"sent={total['sent']} retried={total['retried']} failed={total['failed']} "
+                    f"skipped={total['skipped']} "
+                    f"pending={outbox.pending_count()}"
+                )
+            if not opts["loop"]:
+                return
+            time.sleep(opts["interval"])
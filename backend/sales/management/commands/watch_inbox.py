@@ -0,0 +1,44 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from sales.services import inbound_match, mail_push, mail_sync
+
+
+class Command(BaseCommand):
+    help = "Keep an IMAP IDLE connection and ingest new emails as they arrive (reconnects with backoff)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mailbox", default="INBOX")
+        parser.add_argument("--idle-seconds", type=float, default=mail_push.IDLE_SECONDS,
+                            help="через сколько секунд переоткрывать IDLE (и синхронизироваться в любом случае)")
+        parser.add_argument("--host", help="IMAP-хост вместо IMAP_HOST (например, локальный тестовый сервер)")
+        parser.add_argument("--port", type=int, help="IMAP-порт вместо IMAP_PORT")
+        parser.add_argument("--no-ssl", action="store_true",
+                            help="без TLS (только для локального тестового сервера: пароль уйдёт открытым текстом)")
+
+    def handle(self, *args, **opts):
+        config = mail_sync.imap_config()
+        if opts["host"]:
+            config["host"] = opts["host"]
+        if opts["port"]:
+            config["port"] = opts["port"]
+        if opts["no_ssl"]:
+            config["ssl"] = False
+
+        def report(stats):
+            if stats["created"]:
+                linked = inbound_match.reconcile_uids(stats["uids"])["linked"]
+                self.stdout.write(f"{opts['mailbox']}: {stats['created']} new, {linked} linked to bookings")
+
+        watcher = mail_push.IdleWatcher(
+            mailbox=opts["mailbox"], idle_seconds=opts["idle_seconds"], config=config, on_sync=report,
+        )
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        self.stdout.write(f"watch_inbox: {config['user'] or '-'}@{config['host']}:{config['port']}/{opts['mailbox']}")
+        try:
+            watcher.serve(stop=stop)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.25 on 2025-10-16 12:10
+
+from django.db import migrations, models
+
+
+# копия sales.services.requirements.SPECIAL_TITLES на момент миграции: живой код сюда не импортируем
+SPECIAL_TITLES = {
+    "granada":  ("granada", "гранада"),
+    "gibraltar":("gibraltar", "гибралтар"),
+    "tangier":  ("tanger", "tangier", "танжер"),
+    "seville":  ("seville", "севилья"),
+}
+
+
+def guess_special_key(title):
+    s = (title or "").lower()
+    for key, needles in SPECIAL_TITLES.items():
+        if any(n in s for n in needles):
+            return key
+    return None
+
+
+def fill_special_key(apps, schema_editor):
+    BookingSale = apps.get_model("sales", "BookingSale")
+    changed = []
+    for b in BookingSale.objects.only("id", "excursion_title").iterator():
+        key = guess_special_key(b.excursion_title)
+        if key:
+            b.special_key = key
+            changed.append(b)
+    BookingSale.objects.bulk_update(changed, ["special_key"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0013_bookingsale_travelers_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookingsale',
+            name='special_key',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.RunPython(fill_special_key, migrations.RunPython.noop),
+    ]
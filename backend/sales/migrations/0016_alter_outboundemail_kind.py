@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0015_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboundemail',
+            name='kind',
+            field=models.CharField(choices=[('RESERVATION', 'Reservation'), ('CANCELLATION', 'Cancellation'), ('DIGEST', 'Reservation digest')], max_length=16),
+        ),
+    ]
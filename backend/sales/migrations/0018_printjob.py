@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0017_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrintJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('printer', models.CharField(default='default', max_length=64)),
+                ('fmt', models.CharField(choices=[('cpcl', 'CPCL'), ('zpl', 'ZPL')], default='cpcl', max_length=8)),
+                ('payload', models.BinaryField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('DONE', 'Printed'), ('FAILED', 'Failed')], default='PENDING', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('printed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('booking', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='print_jobs', to='sales.bookingsale')),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['printer', 'status', 'next_attempt_at'], name='sales_print_printer_d69463_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0018_printjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailboxSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=255)),
+                ('mailbox', models.CharField(default='INBOX', max_length=255)),
+                ('uidvalidity', models.BigIntegerField(default=0)),
+                ('uidnext', models.BigIntegerField(default=1)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='mailboxsyncstate',
+            constraint=models.UniqueConstraint(fields=('account', 'mailbox'), name='uniq_mailbox_sync_state'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0019_mailboxsyncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboundemail',
+            name='in_reply_to',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='inboundemail',
+            name='references',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:05
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.utils import OperationalError
+from django.utils.html import strip_tags
+
+
+FTS_TABLE = "sales_inboundemail_fts"
+
+# копия токенизатора sales.services.inbound_search на момент миграции: живой код сюда не импортируем
+WEIGHTS = {"subject": 10, "from_email": 5, "to_email": 2, "body": 1}
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _fold_char(ch):
+    if not unicodedata.name(ch, "").startswith("LATIN"):
+        return ch
+    return "".join(c for c in unicodedata.normalize("NFD", ch) if not unicodedata.combining(c))
+
+
+def _tokens(text):
+    text = unicodedata.normalize("NFC", (text or "").lower())
+    if not text.isascii():
+        text = "".join(map(_fold_char, text))
+    return [w[:48] for w in _WORD_RE.findall(text) if len(w) > 1 or w.isdigit()]
+
+
+def fill_tokens(apps):
+    """Переносимый индекс (InboundEmailToken) для уже лежащих писем — когда FTS5 нет."""
+    InboundEmail = apps.get_model("sales", "InboundEmail")
+    InboundEmailToken = apps.get_model("sales", "InboundEmailToken")
+    rows = []
+    for e in InboundEmail.objects.order_by("pk").iterator(chunk_size=500):
+        doc = {
+            "subject": e.subject, "from_email": e.from_email, "to_email": e.to_email,
+            "body": (e.body_text or strip_tags(e.body_html or "") or e.snippet or "")[:20000],
+        }
+        weight = {}
+        for field, w in WEIGHTS.items():
+            for t in set(_tokens(doc[field])):
+                weight[t] = weight.get(t, 0) + w
+        rows += [InboundEmailToken(email_id=e.pk, token=t, weight=w) for t, w in weight.items()]
+        if len(rows) >= 5000:
+            InboundEmailToken.objects.bulk_create(rows, batch_size=1000)
+            rows = []
+    InboundEmailToken.objects.bulk_create(rows, batch_size=1000)
+
+
+def create_fts(apps, schema_editor):
+    """FTS5 только для SQLite и только если модуль собран; иначе работает InboundEmailToken."""
+    if schema_editor.connection.vendor != "sqlite":
+        fill_tokens(apps)
+        return
+    try:
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "subject, from_email, to_email, body, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    except OperationalError:
+        fill_tokens(apps)
+        return
+    # начальное наполнение; точная переиндексация (HTML-only письма) — manage.py rebuild_inbound_search
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE} (rowid, subject, from_email, to_email, body) "
+        "SELECT id, COALESCE(subject, ''), COALESCE(from_email, ''), COALESCE(to_email, ''), "
+        "substr(COALESCE(NULLIF(body_text, ''), snippet, ''), 1, 20000) FROM sales_inboundemail"
+    )
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0020_inboundemail_threading'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboundEmailToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=48)),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+                ('email', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='sales.inboundemail')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'email'], name='sales_inbou_token_41025a_idx')],
+            },
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,149 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:07
+
+import ast
+import gzip
+import hashlib
+from email import message_from_bytes
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+SKIP_HEADERS = {"content-type", "content-transfer-encoding", "mime-version"}
+CHUNK = 500     # строк в памяти за раз: тела писем не копим на весь ящик
+
+
+def _flush(model, rows: list, fields) -> None:
+    if rows:
+        model.objects.bulk_update(rows, fields, batch_size=CHUNK)
+        rows.clear()
+
+
+def _rebuild_message(row) -> bytes:
+    """Старые строки хранили разобранные части — собираем из них RFC822 обратно."""
+    text, html = row.body_text or "", row.body_html or ""
+    if html:
+        msg = MIMEMultipart("alternative")
+        msg.attach(MIMEText(text, "plain", "utf-8"))
+        msg.attach(MIMEText(html, "html", "utf-8"))
+    else:
+        msg = MIMEText(text, "plain", "utf-8")
+    try:
+        items = ast.literal_eval(row.raw_headers or "[]")
+    except Exception:
+        items = []
+    if not items:
+        items = [("Message-ID", row.message_id), ("Subject", row.subject), ("From", row.from_email), ("To", row.to_email)]
+    for k, v in items:
+        if k and v is not None and str(k).lower() not in SKIP_HEADERS:
+            msg[str(k)] = str(v)
+    return msg.as_bytes()
+
+
+def pack_raw(apps, schema_editor):
+    """Тела и заголовки → сжатые файлы mail/<hh>/<sha256>.eml.gz (как sales.services.raw_mail)."""
+    InboundEmail = apps.get_model("sales", "InboundEmail")
+    changed = []
+    for row in InboundEmail.objects.order_by("pk").iterator(chunk_size=CHUNK):
+        raw = _rebuild_message(row)
+        mid = (row.message_id or "").strip()
+        basis = f"mid:{mid}" if mid else "sha:" + hashlib.sha256(raw).hexdigest()
+        d = hashlib.sha256(basis.encode("utf-8", errors="replace")).hexdigest()
+        name = f"mail/{d[:2]}/{d}.eml.gz"
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(gzip.compress(raw, compresslevel=6, mtime=0)))
+        row.raw_key, row.raw_size = name, len(raw)
+
+        # треды — в колонки, чтобы матчеру не читать письма
+        if not row.in_reply_to and not row.references and row.raw_headers:
+            try:
+                headers = {str(k).lower(): str(v) for k, v in ast.literal_eval(row.raw_headers)}
+            except Exception:
+                headers = {}
+            row.in_reply_to = headers.get("in-reply-to", "").strip()[:255]
+            row.references = " ".join(headers.get("references", "").split())
+        changed.append(row)
+        if len(changed) >= CHUNK:
+            _flush(InboundEmail, changed, ["raw_key", "raw_size", "in_reply_to", "references"])
+    _flush(InboundEmail, changed, ["raw_key", "raw_size", "in_reply_to", "references"])
+
+
+def _load(name: str) -> bytes:
+    with default_storage.open(name, "rb") as f:
+        data = f.read()
+    if name.endswith(".zst"):
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data) if name.endswith(".gz") else data
+
+
+def _decode(part) -> str:
+    payload = part.get_payload(decode=True) or b""
+    try:
+        return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+    except LookupError:
+        return payload.decode("utf-8", errors="replace")
+
+
+def unpack_raw(apps, schema_editor):
+    """Обратно: тела и заголовки из файлов в колонки. Сами файлы не трогаем."""
+    InboundEmail = apps.get_model("sales", "InboundEmail")
+    changed = []
+    for row in InboundEmail.objects.exclude(raw_key="").order_by("pk").iterator(chunk_size=CHUNK):
+        try:
+            msg = message_from_bytes(_load(row.raw_key))
+        except FileNotFoundError:
+            continue
+        text, html = "", ""
+        for part in msg.walk():
+            ctype = part.get_content_type()
+            if part.is_multipart() or ctype not in ("text/plain", "text/html"):
+                continue
+            if "attachment" in str(part.get("Content-Disposition") or "").lower():
+                continue
+            if ctype == "text/plain":
+                text += _decode(part)
+            else:
+                html += _decode(part)
+        row.body_text, row.body_html = text.strip(), html.strip()
+        row.raw_headers = str([(k, str(v)) for k, v in msg.items()])
+        changed.append(row)
+        if len(changed) >= CHUNK:
+            _flush(InboundEmail, changed, ["body_text", "body_html", "raw_headers"])
+    _flush(InboundEmail, changed, ["body_text", "body_html", "raw_headers"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0021_inbound_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboundemail',
+            name='raw_key',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='inboundemail',
+            name='raw_size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(pack_raw, unpack_raw),
+        migrations.RemoveField(
+            model_name='inboundemail',
+            name='body_html',
+        ),
+        migrations.RemoveField(
+            model_name='inboundemail',
+            name='body_text',
+        ),
+        migrations.RemoveField(
+            model_name='inboundemail',
+            name='raw_headers',
+        ),
+    ]
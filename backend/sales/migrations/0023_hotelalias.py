@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0022_inboundemail_raw_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotelAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=255, unique=True)),
+                ('raw_name', models.CharField(max_length=255)),
+                ('hotel_id', models.IntegerField(blank=True, null=True)),
+                ('hotel_name', models.CharField(blank=True, max_length=255)),
+                ('region_name', models.CharField(blank=True, max_length=120)),
+                ('resolved_at', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['alias'],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:19
+
+from django.conf import settings
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('sales', '0023_hotelalias'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/%Y/%m/')),
+                ('original_name', models.CharField(blank=True, max_length=255)),
+                ('dry_run', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='PENDING', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('sheet', models.CharField(blank=True, max_length=120)),
+                ('rows_total', models.PositiveIntegerField(blank=True, null=True)),
+                ('rows_done', models.PositiveIntegerField(default=0)),
+                ('next_row', models.PositiveIntegerField(default=0)),
+                ('created_families', models.PositiveIntegerField(default=0)),
+                ('updated_families', models.PositiveIntegerField(default=0)),
+                ('created_travelers', models.PositiveIntegerField(default=0)),
+                ('skipped', models.PositiveIntegerField(default=0)),
+                ('column_mapping', models.JSONField(blank=True, default=dict)),
+                ('issues', models.JSONField(blank=True, default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='sales_impor_status_0f5ebe_idx')],
+            },
+        ),
+    ]
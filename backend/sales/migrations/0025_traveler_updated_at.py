@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0024_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='traveler',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0025_traveler_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboundemail',
+            name='match_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -2,6 +2,8 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
 import re
 import logging
 from functools import lru_cache
@@ -30,6 +32,18 @@ def _norm_name(s: str) -> str:
     s = re.sub(r"\s+", " ", s)
     return s.title()
 
+def _ids_from_csv(raw: str | None) -> list[int]:
+    """"12, 15;33" → [12, 15, 33] (мусор игнорируем)."""
+    raw = (raw or "").strip()
+    if not raw:
+        return []
+    return [int(x) for x in raw.replace(";", ",").split(",") if x.strip().isdigit()]
+
+def _names_snapshot(ids, names_by_id: dict) -> str:
+    """Снапшот ФИО в порядке id, как его хранит BookingSale.travelers_names."""
+    names = [names_by_id.get(i, "") for i in sorted(set(ids))]
+    return "\n".join(filter(None, names))
+
 # ───── Базовые цены НЕТТО ─────-───────────────────────────────────────────────
 # кэшируем вызовы к CSI, чтобы в админке не дёргать API по сто раз
 @lru_cache(maxsize=512)
@@ -137,6 +151,8 @@ class Traveler(models.Model):
     gender = models.CharField(max_length=1, choices=[('M','Male'),('F','Female')], null=True, blank=True)
     doc_type = models.CharField(max_length=16, choices=[('passport','Passport'),('dni','DNI')], null=True, blank=True)
     doc_expiry = models.DateField(null=True, blank=True)
+    # по нему кэши (проверки требований, тела писем) видят правку туриста в любом процессе
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = [("family", "last_name", "first_name", "dob")]
@@ -153,6 +169,26 @@ class Traveler(models.Model):
 
     def __str__(self): return f"{self.last_name} {self.first_name}"
 
+class HotelAlias(models.Model):
+    """
+    Написание отеля (из файлов туроператоров, из запросов) → отель CSI.
+    Ведётся sales.services.hotels: найденные соответствия постоянны,
+    промахи (hotel_id пуст) перепроверяются через HOTEL_ALIAS_MISS_TTL.
+    Ошибочное соответствие можно поправить руками в админке.
+    """
+    alias = models.CharField(max_length=255, unique=True)       # нормализованное написание
+    raw_name = models.CharField(max_length=255)
+    hotel_id = models.IntegerField(null=True, blank=True)
+    hotel_name = models.CharField(max_length=255, blank=True)
+    region_name = models.CharField(max_length=120, blank=True)
+    resolved_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["alias"]
+
+    def __str__(self):
+        return f"{self.raw_name} → {self.hotel_id or '—'}"
+
 # ───── Проданные экскурсии ────────────────────────────────────────────────────
 class BookingSale(models.Model):
     STATUS = [
@@ -201,6 +237,9 @@ class BookingSale(models.Model):
     sent_at = models.DateTimeField(null=True, blank=True)
     sent_to_email = models.EmailField(blank=True)
 
+    # ключ спец-требований (granada/tangier/...), считается из названия в save()
+    special_key = models.CharField(max_length=16, blank=True)
+
     # язык экскурсии, выбранный туристом
     excursion_language = models.CharField(max_length=5, choices=LANG_CHOICES, blank=True)
 
@@ -232,17 +271,68 @@ class BookingSale(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        obj = super().from_db(db, field_names, values)
+        # запоминаем состав «как в БД», чтобы сигнал видел реальные изменения
+        obj._loaded_travelers_csv = obj.__dict__.get("travelers_csv")
+        return obj
+
     def set_travelers_names_from_ids(self):
         ids_raw = (self.travelers_csv or "").strip()
         if not ids_raw:
             self.travelers_names = None
             return
-        from .models import Traveler
-        ids = [int(x) for x in ids_raw.replace(";", ",").split(",") if x.strip().isdigit()]
-        names = []
-        for t in Traveler.objects.filter(id__in=ids).order_by("id"):
-            names.append(f"{t.first_name} {t.last_name}".strip())
-        self.travelers_names = "\n".join(filter(None, names))
+        ids = _ids_from_csv(ids_raw)
+        names_by_id = {
+            t.id: f"{t.first_name} {t.last_name}".strip()
+            for t in Traveler.objects.filter(id__in=ids).only("id", "first_name", "last_name")
+        }
+        self.travelers_names = _names_snapshot(ids, names_by_id)
+
+    def travelers_snapshot_stale(self, update_fields=None) -> bool:
+        """
+        Нужно ли пересобирать travelers_names перед сохранением.
+        Сохранения вида update_fields=["status"] состав не трогают — пропускаем.
+        """
+        if update_fields is not None and "travelers_csv" not in update_fields:
+            return False
+        if self._state.adding:
+            return True
+        loaded = getattr(self, "_loaded_travelers_csv", None)
+        if loaded is None:
+            return True  # объект собран не из БД (или поле было отложено) — не знаем, что было
+        if (loaded or "") != (self.travelers_csv or ""):
+            return True
+        # старые записи до появления снапшота
+        return bool(self.travelers_csv) and self.travelers_names is None
+
+    @classmethod
+    def refresh_travelers_names(cls, bookings, *, batch_size: int = 500) -> int:
+        """
+        Пакетная пересборка снапшота имён: один запрос к Traveler на весь набор
+        и bulk_update только изменившихся строк. Возвращает число обновлённых броней.
+        """
+        bookings = list(bookings)
+        ids_by_booking = {b.pk: _ids_from_csv(b.travelers_csv) for b in bookings}
+        all_ids = {i for ids in ids_by_booking.values() for i in ids}
+
+        names_by_id = {}
+        if all_ids:
+            for t in Traveler.objects.filter(id__in=all_ids).only("id", "first_name", "last_name"):
+                names_by_id[t.id] = f"{t.first_name} {t.last_name}".strip()
+
+        changed = []
+        for b in bookings:
+            ids = ids_by_booking[b.pk]
+            names = _names_snapshot(ids, names_by_id) if ids else None
+            if names != b.travelers_names:
+                b.travelers_names = names
+                changed.append(b)
+
+        if changed:
+            cls.objects.bulk_update(changed, ["travelers_names"], batch_size=batch_size)
+        return len(changed)
 
     @property
     def travelers_names_list(self):
@@ -387,8 +477,22 @@ class BookingSale(models.Model):
 
     # ---------- СИСТЕМНАЯ ЛОГИКА ---------------------------------------------
     def save(self, *args, **kwargs):
+        from .services.requirements import guess_special_key
+
         self.ensure_region_name()  # гарантируем автозаполнение
+        self.special_key = guess_special_key(self.excursion_title) or ""
+        # производные поля пишем вместе с исходными, даже при частичном сохранении
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            extra = []
+            if "travelers_csv" in update_fields and "travelers_names" not in update_fields:
+                extra.append("travelers_names")
+            if "excursion_title" in update_fields and "special_key" not in update_fields:
+                extra.append("special_key")
+            if extra:
+                kwargs["update_fields"] = [*update_fields, *extra]
         super().save(*args, **kwargs)
+        self._loaded_travelers_csv = self.travelers_csv
 
     class Meta:
         indexes = [
@@ -412,13 +516,21 @@ class InboundEmail(models.Model):
     date = models.DateTimeField(blank=True, null=True)
 
     snippet = models.TextField(blank=True, null=True)
-    body_text = models.TextField(blank=True, null=True)
-    body_html = models.TextField(blank=True, null=True)
 
-    raw_headers = models.TextField(blank=True, null=True)
+    # треды: по ним письмо привязывается к брони через OutboundEmail.message_id
+    in_reply_to = models.CharField(max_length=255, blank=True, default="")
+    references = models.TextField(blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # сырое письмо — сжатым файлом в хранилище (sales.services.raw_mail), общим для дублей по Message-ID
+    raw_key = models.CharField(max_length=255, blank=True, default="")
+    raw_size = models.PositiveIntegerField(default=0)
+
     booking = models.ForeignKey("BookingSale", null=True, blank=True, on_delete=models.SET_NULL)
+    # когда письмо последний раз сверялось с бронями (sales.services.inbound_match)
+    match_checked_at = models.DateTimeField(null=True, blank=True)
+
+    _parsed = None
 
     class Meta:
         ordering = ["-date", "-id"]
@@ -426,6 +538,221 @@ class InboundEmail(models.Model):
     def __str__(self):
         return f"{self.subject or '(без темы)'} — {self.from_email}"
 
+    @property
+    def parsed(self):
+        """Разобранное письмо (message, text, html): читается из хранилища при первом обращении."""
+        if self._parsed is None and self.raw_key:
+            from sales.services import raw_mail
+            self._parsed = raw_mail.parse(self.raw_key)
+        return self._parsed
+
+    @property
+    def body_text(self) -> str:
+        return self.parsed.text if self.parsed else ""
+
+    @property
+    def body_html(self) -> str:
+        return self.parsed.html if self.parsed else ""
+
+    @property
+    def raw_headers(self) -> str:
+        return str(self.parsed.message.items()) if self.parsed else ""
+
+
+class InboundEmailToken(models.Model):
+    """
+    Переносимый поисковый индекс по входящим (когда нет SQLite FTS5):
+    нормализованные слова темы/адресов/текста с весом поля.
+    См. sales.services.inbound_search.
+    """
+    email = models.ForeignKey(InboundEmail, on_delete=models.CASCADE, related_name="search_tokens")
+    token = models.CharField(max_length=48)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["token", "email"]),
+        ]
+
+
+class MailboxSyncState(models.Model):
+    """
+    Курсор инкрементальной IMAP-синхронизации (manage.py fetch_gmail):
+    UIDVALIDITY ящика и первый ещё не забранный UID. Смена UIDVALIDITY
+    сервером означает перенумерацию — синхронизация начинается заново.
+    """
+    account = models.CharField(max_length=255)
+    mailbox = models.CharField(max_length=255, default="INBOX")
+    uidvalidity = models.BigIntegerField(default=0)
+    uidnext = models.BigIntegerField(default=1)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["account", "mailbox"], name="uniq_mailbox_sync_state"),
+        ]
+
+    def __str__(self):
+        return f"{self.account}/{self.mailbox} uidvalidity={self.uidvalidity} next={self.uidnext}"
+
+# ───── Исходящие письма (outbox) ─────────────────────────────────────────────
+class OutboundEmail(models.Model):
+    """
+    Очередь писем партнёрам. Строка пишется в той же транзакции, что и смена
+    статуса брони; рендер и SMTP делает воркер `manage.py send_outbox`.
+    """
+    KIND = [
+        ("RESERVATION", "Reservation"),
+        ("CANCELLATION", "Cancellation"),
+        ("DIGEST", "Reservation digest"),   # одно письмо на несколько броней (payload.booking_ids)
+    ]
+    STATUS = [
+        ("PENDING", "PENDING"),
+        ("SENT", "SENT"),
+        ("FAILED", "FAILED"),
+    ]
+
+    kind = models.CharField(max_length=16, choices=KIND)
+    booking = models.ForeignKey("BookingSale", null=True, blank=True, on_delete=models.SET_NULL,
+                                related_name="outbound_emails")
+    payload = models.JSONField(default=dict, blank=True)  # доп. контекст шаблона: reason и т.п.
+
+    status = models.CharField(max_length=10, choices=STATUS, default="PENDING")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    # заполняются при доставке
+    to_email = models.CharField(max_length=255, blank=True)
+    subject = models.CharField(max_length=512, blank=True)
+    message_id = models.CharField(max_length=255, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+        ordering = ["-created_at", "-id"]
+
+    def __str__(self):
+        return f"{self.kind} #{self.booking_id or '—'} [{self.status}]"
+
+# ───── Очередь печати на Zebra (CPCL/ZPL) ────────────────────────────────────
+class PrintJob(models.Model):
+    """
+    Задание для спулера `manage.py print_spooler`: готовые байты CPCL/ZPL.
+    Спулер держит порт открытым и печатает пачку заданий за одну сессию.
+    """
+    FORMAT_CHOICES = [("cpcl", "CPCL"), ("zpl", "ZPL")]
+    STATUS_CHOICES = [
+        ("PENDING", "Pending"),
+        ("DONE", "Printed"),
+        ("FAILED", "Failed"),
+    ]
+
+    booking = models.ForeignKey(
+        "BookingSale", on_delete=models.SET_NULL, null=True, blank=True, related_name="print_jobs",
+    )
+    printer = models.CharField(max_length=64, default="default")
+    fmt = models.CharField(max_length=8, choices=FORMAT_CHOICES, default="cpcl")
+    payload = models.BinaryField()
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="PENDING")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+
+    printed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at", "-id"]
+        indexes = [models.Index(fields=["printer", "status", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"#{self.id} {self.fmt} → {self.printer} [{self.status}]"
+
+# ───── Фоновый импорт туристов ────────────────────────────────────────────────
+class ImportJob(models.Model):
+    """
+    Задание для `manage.py import_worker`: файл туристов в default_storage.
+    После каждой записанной пачки строк здесь фиксируются счётчики,
+    замечания и next_row (в той же транзакции) — упавший воркер
+    продолжает с последней зафиксированной пачки.
+    """
+    STATUS_CHOICES = [
+        ("PENDING", "Pending"),
+        ("RUNNING", "Running"),
+        ("DONE", "Done"),
+        ("FAILED", "Failed"),
+    ]
+
+    file = models.FileField(upload_to="imports/%Y/%m/")
+    original_name = models.CharField(max_length=255, blank=True)
+    dry_run = models.BooleanField(default=False)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="import_jobs")
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="PENDING")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)   # для RUNNING — конец аренды
+    last_error = models.TextField(blank=True, default="")
+
+    sheet = models.CharField(max_length=120, blank=True)
+    rows_total = models.PositiveIntegerField(null=True, blank=True)
+    rows_done = models.PositiveIntegerField(default=0)
+    next_row = models.PositiveIntegerField(default=0)
+    created_families = models.PositiveIntegerField(default=0)
+    updated_families = models.PositiveIntegerField(default=0)
+    created_travelers = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    column_mapping = models.JSONField(default=dict, blank=True)
+    issues = models.JSONField(default=list, blank=True, encoder=DjangoJSONEncoder)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at", "-id"]
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"#{self.id} {self.original_name} [{self.status}]"
+
+    @property
+    def progress(self):
+        """Доля обработанных строк 0..1 (None, если размер листа неизвестен)."""
+        if self.status == "DONE":
+            return 1.0
+        if not self.rows_total:
+            return None
+        return min(1.0, self.rows_done / self.rows_total)
+
+# ───── Idempotency-Key для повторных POST с мобильных ──────────────────────────
+class IdempotencyKey(models.Model):
+    """
+    Сохранённый ответ на POST с заголовком Idempotency-Key.
+    Повтор с тем же ключом получает этот ответ без побочных эффектов.
+    """
+    scope = models.CharField(max_length=128)          # эндпоинт + пользователь + pk
+    key = models.CharField(max_length=128)
+    request_hash = models.CharField(max_length=64)    # sha256 тела — ловим переиспользование ключа
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["scope", "key"], name="uniq_idempotency_scope_key"),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} / {self.key}"
+
 # ───── ПРОКСИ-модель для админки «Аннулированные брони» ──────────────────────
 class CancelledBookingSale(BookingSale):
     class Meta:
@@ -389,13 +389,53 @@ class BookingSaleCreateSerializer(serializers.ModelSerializer):
 
 
 # Для списков/деталей брони
+def load_travelers_by_id(bookings, fields=None) -> dict:
+    """
+    Участники всех броней одним запросом: {traveler_id: Traveler}.
+    fields — ограничить набор колонок (для списка хватает имён).
+    """
+    from .services.requirements import parse_travelers_csv
+    ids = set()
+    for b in bookings:
+        ids.update(parse_travelers_csv(getattr(b, "travelers_csv", "")))
+    if not ids:
+        return {}
+    qs = Traveler.objects.filter(id__in=ids)
+    if fields:
+        qs = qs.only(*fields)
+    return {t.id: t for t in qs}
+
+
+def _traveler_display_name(t) -> str:
+    # у модели нет поля full_name — собираем сами
+    fn = (t.first_name or "").strip()
+    ln = (t.last_name or "").strip()
+    return f"{ln} {fn}".strip() or f"Traveler #{t.id}"
+
+
+class BookingSaleListSerializerMany(serializers.ListSerializer):
+    """
+    many=True: собираем id участников со всей страницы и грузим их одним
+    запросом, результат кладём в context["travelers_by_id"].
+    """
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, "all") else data)
+        if "travelers_by_id" not in self._context:
+            self._context["travelers_by_id"] = load_travelers_by_id(items, fields=self.child.traveler_fields)
+        return super().to_representation(items)
+
+
 class BookingSaleListSerializer(serializers.ModelSerializer):
     company = CompanySerializer(read_only=True)
     maps_url = serializers.SerializerMethodField()
     travelers_names = serializers.SerializerMethodField()
 
+    # какие поля Traveler нужны сериализатору (None — все)
+    traveler_fields = ("id", "first_name", "last_name")
+
     class Meta:
         model = BookingSale
+        list_serializer_class = BookingSaleListSerializerMany
         fields = [
             "id", "booking_code", "status", "date",
             "excursion_id", "excursion_title",
@@ -426,103 +466,39 @@ class BookingSaleListSerializer(serializers.ModelSerializer):
         except Exception:
             return f"https://maps.google.com/?q={name}"
 
-    def get_travelers_names(self, obj):
+    def _travelers_of(self, obj) -> list:
         """
-        Возвращаем список имён участников.
-        1) Если есть M2M booking.travelers — берём оттуда (full_name -> first+last).
-        2) Иначе читаем travelers_csv (id через запятую) и подтягиваем из Traveler,
-           сохраняя порядок id. Пустые имена заменяем на 'Traveler #<id>'.
+        Участники брони в порядке travelers_csv (отсутствующие id пропускаем).
+        В списке берём из context (заполняет BookingSaleListSerializerMany),
+        для одиночного объекта — один запрос, результат запоминаем в context.
         """
-        # 1) M2M, если есть
-        if hasattr(obj, "travelers"):
-            try:
-                people = list(obj.travelers.all())
-                if people:
-                    out = []
-                    for t in people:
-                        # у модели нет поля full_name — собираем сами
-                        fn = (getattr(t, "first_name", "") or "").strip()
-                        ln = (getattr(t, "last_name", "") or "").strip()
-                        full = (f"{ln} {fn}").strip()
-                        if not full:
-                            full = f"Traveler #{getattr(t, 'id', '')}".strip()
-                        out.append(full)
-                    if out:
-                        return out
-            except Exception:
-                # упадём на CSV-флоу ниже
-                pass
-
-        # 2) CSV fallback
-        csv_raw = (getattr(obj, "travelers_csv", "") or "").strip()
-        if not csv_raw:
-            return []
-
-        try:
-            ids = [int(p.strip()) for p in csv_raw.split(",") if p.strip().isdigit()]
-        except Exception:
-            ids = []
+        from .services.requirements import parse_travelers_csv
+        ids = parse_travelers_csv(getattr(obj, "travelers_csv", ""))
         if not ids:
             return []
+        by_id = self.context.get("travelers_by_id")
+        if by_id is None:
+            by_id = load_travelers_by_id([obj], fields=self.traveler_fields)
+            if self.root is self:
+                self.context["travelers_by_id"] = by_id
+        return [by_id[i] for i in ids if i in by_id]
 
-        # ВАЖНО: НЕ запрашиваем несуществующее поле full_name
-        rows = Traveler.objects.filter(id__in=ids).values("id", "first_name", "last_name")
-        by_id = {}
-        for r in rows:
-            fn = (r.get("first_name") or "").strip()
-            ln = (r.get("last_name") or "").strip()
-            name = (f"{ln} {fn}").strip()
-            if not name:
-                name = f"Traveler #{r['id']}"
-            by_id[r["id"]] = name
-
-        # сохранить порядок CSV и выкинуть пустые/отсутствующие
-        return [by_id[i] for i in ids if by_id.get(i)]
-
-
+    def get_travelers_names(self, obj):
+        """Имена участников «Фамилия Имя»; пустые — 'Traveler #<id>'."""
+        return [_traveler_display_name(t) for t in self._travelers_of(obj)]
 
 
 class BookingSaleDetailSerializer(BookingSaleListSerializer):
     """
     Детальная версия брони: всё то же, что в списке, + полный набор полей каждого туриста.
-    Поддерживает оба варианта хранения участников: M2M booking.travelers или CSV id в travelers_csv.
     """
     travelers_full = serializers.SerializerMethodField()
 
+    traveler_fields = None
+
     class Meta(BookingSaleListSerializer.Meta):
         fields = BookingSaleListSerializer.Meta.fields + ["travelers_full"]
 
     def get_travelers_full(self, obj):
-        # 1) Если есть M2M — берём оттуда и сортируем по id
-        if hasattr(obj, "travelers"):
-            try:
-                qs = list(obj.travelers.all().order_by("id"))
-                if qs:
-                    return [
-                        TravelerMiniSerializer(t).data
-                        for t in qs
-                    ]
-            except Exception:
-                pass
-
-        # 2) Фолбэк по CSV (сохраняем порядок из CSV)
-        csv_raw = (getattr(obj, "travelers_csv", "") or "").strip()
-        if not csv_raw:
-            return []
-
-        try:
-            ids = [int(p.strip()) for p in csv_raw.split(",") if p.strip().isdigit()]
-        except Exception:
-            ids = []
-        if not ids:
-            return []
-
-        Traveler = apps.get_model("sales", "Traveler")
-        rows = Traveler.objects.filter(id__in=ids)
-        by_id = {t.id: t for t in rows}
-        out = []
-        for tid in ids:
-            t = by_id.get(tid)
-            if t:
-                out.append(TravelerMiniSerializer(t).data)
-        return out
+        # порядок — как в travelers_csv
+        return [TravelerMiniSerializer(t).data for t in self._travelers_of(obj)]
@@ -211,7 +211,12 @@ def _get(
 
 # ==== Конкретные «обёртки» под текущие эндпоинты CostaSolinfo ====
 
-def search_hotels(q: str, limit: int = 10):
+def search_hotels(q: str, limit: int = 10, *, raise_errors: bool = False):
+    """
+    Поиск отелей. По умолчанию ошибка CSI = пустой результат (на 60 с);
+    raise_errors=True — исключение пробрасывается и не кэшируется, чтобы
+    вызывающий отличал «CSI недоступен» от «не найдено».
+    """
     safe_q = quote_plus(q or "")
     cache_key = f"hotels:{safe_q}:{limit}"
     cached = cache.get(cache_key)
@@ -224,6 +229,8 @@ def search_hotels(q: str, limit: int = 10):
         resp.raise_for_status()
         data = resp.json()
     except requests.RequestException:
+        if raise_errors:
+            raise
         log.exception("CSI search_hotels failed")
         data = {"items": []}
 
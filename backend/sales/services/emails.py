@@ -1,21 +1,28 @@
 # sales/services/emails.py
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
 import re
 from functools import lru_cache
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+from django.template.loader import get_template, render_to_string
 from django.utils.html import strip_tags
+from django.utils.translation import get_language
 
+from sales.services import requirements
 from sales.services.titles import compose_bilingual_title, spanish_excursion_name
 
 log = logging.getLogger(__name__)
 
+RENDER_CACHE_SECONDS = getattr(settings, "EMAIL_RENDER_CACHE_SECONDS", 24 * 3600)
+
 # ---------------------------------------------------------------------------
 # Модели по ленивому доступу (чтобы не ломать импорт, если порядок app'ов меняется)
 Traveler = apps.get_model("sales", "Traveler")
@@ -196,46 +203,98 @@ def _special_key(title: Optional[str]) -> Optional[str]:
 def _parse_travelers_csv(csv: str) -> List[int]:
     return [int(p) for p in str(csv or "").split(",") if p.strip().isdigit()]
 
+def _traveler_row(i: int, r: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": i,
+        "first_name": r.get("first_name") or "",
+        "last_name":  r.get("last_name")  or "",
+        "passport":   r.get("passport")   or "",
+        "nationality":r.get("nationality")or "",
+        "dob":            (r["dob"].isoformat() if r.get("dob") else ""),
+        "gender":         r.get("gender") or "",
+        "doc_type":       r.get("doc_type") or "",
+        "doc_expiry":     (r["doc_expiry"].isoformat() if r.get("doc_expiry") else ""),
+        "passport_expiry":(r["passport_expiry"].isoformat() if r.get("passport_expiry") else ""),
+    }
+
+def _collect_travelers_many(bookings) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Пассажиры для пачки броней одним запросом: {booking.pk: [traveler, ...]},
+    порядок внутри брони — как в travelers_csv.
+    """
+    ids_by_booking = {b.pk: _parse_travelers_csv(getattr(b, "travelers_csv", "")) for b in bookings}
+    all_ids = {i for ids in ids_by_booking.values() for i in ids}
+    by_id = {}
+    if all_ids:
+        rows = (
+            Traveler.objects
+            .filter(id__in=all_ids)
+            .values(
+                "id", "first_name", "last_name",
+                "passport", "nationality",
+                "dob", "gender", "doc_type", "doc_expiry", "passport_expiry",
+            )
+        )
+        by_id = {r["id"]: r for r in rows}
+    return {
+        pk: [_traveler_row(i, by_id[i]) for i in ids if i in by_id]
+        for pk, ids in ids_by_booking.items()
+    }
+
 def _collect_travelers(booking) -> List[Dict[str, Any]]:
     """Вытягиваем пассажиров из CSV id → список словарей, сохраняя исходный порядок."""
-    ids = _parse_travelers_csv(getattr(booking, "travelers_csv", ""))
+    return _collect_travelers_many([booking]).get(booking.pk, [])
+
+def _core_titles_by_csi_id(excursion_ids) -> Dict[int, str]:
+    """
+    Первый шаг spanish_excursion_name (core.Excursion по csi_id) сразу для
+    всех экскурсий пачки — одним запросом вместо запроса на каждую.
+    """
+    ids = {i for i in excursion_ids if i}
     if not ids:
-        return []
-    rows = (
-        Traveler.objects
-        .filter(id__in=ids)
-        .values(
-            "id", "first_name", "last_name",
-            "passport", "nationality",
-            "dob", "gender", "doc_type", "doc_expiry", "passport_expiry",
-        )
-    )
-    by_id = {r["id"]: r for r in rows}
-    out: List[Dict[str, Any]] = []
-    for i in ids:
-        r = by_id.get(i)
-        if not r:
-            continue
-        out.append({
-            "id": i,
-            "first_name": r.get("first_name") or "",
-            "last_name":  r.get("last_name")  or "",
-            "passport":   r.get("passport")   or "",
-            "nationality":r.get("nationality")or "",
-            "dob":            (r["dob"].isoformat() if r.get("dob") else ""),
-            "gender":         r.get("gender") or "",
-            "doc_type":       r.get("doc_type") or "",
-            "doc_expiry":     (r["doc_expiry"].isoformat() if r.get("doc_expiry") else ""),
-            "passport_expiry":(r["passport_expiry"].isoformat() if r.get("passport_expiry") else ""),
-        })
+        return {}
+    try:
+        CoreExcursion = apps.get_model("core", "Excursion")
+    except Exception:
+        return {}
+    out: Dict[int, str] = {}
+    try:
+        rows = CoreExcursion.objects.filter(csi_id__in=ids).order_by("pk").values_list("csi_id", "name")
+        for csi_id, name in rows:
+            if name and csi_id not in out:
+                out[csi_id] = str(name).strip()
+    except Exception:
+        log.warning("emails: batch core title lookup failed", exc_info=True)
     return out
 
-def _build_common_ctx(booking) -> Dict[str, Any]:
-    """Единая сборка контекста для шаблонов брони/аннуляции."""
-    title_es = spanish_excursion_name(
-        int(getattr(booking, "excursion_id", 0) or 0),
-        getattr(booking, "excursion_title", "") or ""
-    )
+def _resolve_titles(bookings) -> Dict[tuple, str]:
+    """
+    Испанские названия для пачки: каждая пара (excursion_id, RU-название)
+    разрешается один раз, core — одним запросом, остальное — обычным путём.
+    """
+    pairs = {
+        (int(getattr(b, "excursion_id", 0) or 0), getattr(b, "excursion_title", "") or "")
+        for b in bookings
+    }
+    core = _core_titles_by_csi_id(exc_id for exc_id, _ in pairs)
+    return {
+        (exc_id, ru): core.get(exc_id) or spanish_excursion_name(exc_id, ru)
+        for exc_id, ru in pairs
+    }
+
+def _build_common_ctx(booking, *, title_es: Optional[str] = None,
+                      travelers: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Единая сборка контекста для шаблонов брони/аннуляции.
+    title_es/travelers можно передать готовыми (см. build_contexts).
+    """
+    if title_es is None:
+        title_es = spanish_excursion_name(
+            int(getattr(booking, "excursion_id", 0) or 0),
+            getattr(booking, "excursion_title", "") or ""
+        )
+    if travelers is None:
+        travelers = _collect_travelers(booking)
 
     title_bi_html  = compose_bilingual_title(getattr(booking, "excursion_title", ""), title_es, html=True)
     title_bi_plain = compose_bilingual_title(getattr(booking, "excursion_title", ""), title_es, html=False)
@@ -262,19 +321,118 @@ def _build_common_ctx(booking) -> Dict[str, Any]:
             "pickup_lng":         getattr(booking, "pickup_lng", None),
             "maps_url":           _maps_url_for(booking),
         },
-        "travelers":  _collect_travelers(booking),
+        "travelers":  travelers,
         "special_key":_special_key(getattr(booking, "excursion_title", "")),
     }
 
+def build_contexts(bookings) -> Dict[int, Dict[str, Any]]:
+    """
+    Контексты для пачки броней с общими запросами: один запрос к Traveler,
+    одно разрешение испанского названия на экскурсию. {booking.pk: ctx}
+    """
+    bookings = list(bookings)
+    titles = _resolve_titles(bookings)
+    travelers = _collect_travelers_many(bookings)
+    return {
+        b.pk: _build_common_ctx(
+            b,
+            title_es=titles[(int(getattr(b, "excursion_id", 0) or 0), getattr(b, "excursion_title", "") or "")],
+            travelers=travelers.get(b.pk, []),
+        )
+        for b in bookings
+    }
+
+
+class ContextBatch:
+    """
+    Ленивый набор контекстов для пачки писем (воркер outbox): строится
+    целиком через build_contexts при первом промахе кэша рендера;
+    если все письма уже отрендерены — только один запрос за отметками туристов.
+    """
+
+    def __init__(self, bookings):
+        self._bookings = [b for b in bookings if b is not None]
+        self._ctx: Optional[Dict[int, Dict[str, Any]]] = None
+        self._stamps: Optional[Dict[int, str]] = None
+
+    def stamp(self, booking) -> str:
+        if self._stamps is None:
+            self._stamps = traveler_stamps(self._bookings)
+        stamp = self._stamps.get(booking.pk)
+        return stamp if stamp is not None else traveler_stamps([booking])[booking.pk]
+
+    def get(self, booking) -> Dict[str, Any]:
+        if self._ctx is None:
+            self._ctx = build_contexts(self._bookings)
+        ctx = self._ctx.get(booking.pk)
+        # копия: вызывающий дописывает свои ключи (reason и т.п.)
+        return dict(ctx) if ctx is not None else _build_common_ctx(booking)
+
 # ---------------------------------------------------------------------------
-# Отправка писем
+# Кэш отрендеренных писем: (версия брони, шаблон, язык) → (html, text)
+
+# поля брони, от которых зависит тело письма
+_RENDER_FIELDS = (
+    "excursion_id", "excursion_title", "excursion_language", "date", "booking_code",
+    "hotel_name", "room_number", "adults", "children", "infants",
+    "pickup_point_name", "pickup_time_str", "pickup_address", "pickup_lat", "pickup_lng",
+    "travelers_csv",
+)
+
+@lru_cache(maxsize=8)
+def _template_digest(template_name: str) -> str:
+    tpl = get_template(template_name)
+    source = getattr(getattr(tpl, "template", None), "source", "") or ""
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+def traveler_stamps(bookings) -> Dict[Any, str]:
+    """
+    {booking.pk: "id@updated_at,..."} — состояние туристов броней по БД,
+    одним запросом на все брони. Правка туриста в любом процессе (или
+    импортом) меняет отметку; удалённый турист помечается "-".
+    """
+    ids_by_booking = {b.pk: requirements.parse_travelers_csv(getattr(b, "travelers_csv", "")) for b in bookings}
+    all_ids = set().union(*ids_by_booking.values())
+    seen = dict(Traveler.objects.filter(id__in=all_ids).values_list("id", "updated_at")) if all_ids else {}
+    return {
+        pk: ",".join(f"{i}@{seen[i].isoformat() if i in seen else '-'}" for i in ids)
+        for pk, ids in ids_by_booking.items()
+    }
 
-def send_booking_email(booking, *, subject_prefix: str = "[SalesPortal]") -> bool:
+def booking_version(booking, stamp: Optional[str] = None) -> str:
     """
-    Письмо-заявка/бронирование в офис партнёра.
-    Возвращает True, если письмо успешно передано SMTP-бэкенду.
+    Версия брони для кэша писем: значения полей шаблона + компания +
+    отметка туристов (traveler_stamps; если не передана — запрос на эту бронь).
+    """
+    if stamp is None:
+        stamp = traveler_stamps([booking])[booking.pk]
+    company = getattr(booking, "company", None)
+    payload = [getattr(booking, f, None) for f in _RENDER_FIELDS]
+    payload += [getattr(company, "pk", None), getattr(company, "name", None), stamp]
+    raw = json.dumps(payload, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _render_cached(template_name: str, version: str, make_ctx) -> Tuple[str, str, str]:
     """
-    # Кому шлём
+    (html, text, title_es) из кэша или через render_to_string(make_ctx()).
+    make_ctx вызывается только при промахе.
+    """
+    key = "sales:email:{}:{}:{}:{}".format(
+        template_name.rsplit("/", 1)[-1], get_language() or "", _template_digest(template_name), version,
+    )
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+    ctx = make_ctx()
+    html = render_to_string(template_name, ctx)
+    out = (html, strip_tags(html), (ctx.get("booking") or {}).get("title_es") or "")
+    cache.set(key, out, RENDER_CACHE_SECONDS)
+    return out
+
+# ---------------------------------------------------------------------------
+# Сборка писем (без отправки) — их же использует outbox-воркер
+
+def _recipients_for(booking) -> List[str]:
     to: List[str] = []
     company = getattr(booking, "company", None)
     comp_email = getattr(company, "email_for_orders", None)
@@ -284,15 +442,34 @@ def send_booking_email(booking, *, subject_prefix: str = "[SalesPortal]") -> boo
     fallback_to = getattr(settings, "BOOKINGS_FALLBACK_EMAIL", None)
     if not to and fallback_to:
         to.append(fallback_to)
+    return to
+
+
+def _ctx_maker(booking, contexts: Optional[ContextBatch]):
+    if contexts is not None:
+        return lambda: contexts.get(booking)
+    return lambda: _build_common_ctx(booking)
+
+
+def build_booking_message(booking, *, subject_prefix: str = "[SalesPortal]",
+                          contexts: Optional[ContextBatch] = None) -> Optional[EmailMultiAlternatives]:
+    """
+    Письмо-заявка/бронирование в офис партнёра.
+    None — если получателей нет (не ошибка: просто некуда отправлять).
+    contexts — общий ContextBatch пачки (воркер outbox).
+    """
+    to = _recipients_for(booking)
     if not to:
         log.warning("send_booking_email: no recipients for booking_code=%s", getattr(booking, "booking_code", ""))
-        return True  # не считаем ошибкой: просто некуда отправлять
+        return None
 
-    ctx = _build_common_ctx(booking)
-    html = render_to_string("sales/email_reservation.html", ctx)
-    text = strip_tags(html)
+    html, text, title_es = _render_cached(
+        "sales/email_reservation.html",
+        booking_version(booking, contexts.stamp(booking) if contexts is not None else None),
+        _ctx_maker(booking, contexts),
+    )
 
-    title_es = ctx["booking"].get("title_es") or ctx["booking"].get("excursion_title") or ""
+    title_es = title_es or getattr(booking, "excursion_title", "") or ""
     when = _fmt_date(getattr(booking, "date", None))
     who = (getattr(getattr(booking, "company", None), "name", "")
            or getattr(getattr(booking, "guide", None), "get_full_name", lambda: "")()
@@ -304,36 +481,76 @@ def send_booking_email(booking, *, subject_prefix: str = "[SalesPortal]") -> boo
     from_email = getattr(settings, "DEFAULT_FROM_EMAIL", "no-reply@example.com")
     msg = EmailMultiAlternatives(subject=subject, body=text, from_email=from_email, to=to)
     msg.attach_alternative(html, "text/html")
-
-    try:
-        sent = msg.send(fail_silently=False)
-        return bool(sent)
-    except Exception:
-        log.exception("send_booking_email failed for booking_code=%s", getattr(booking, "booking_code", ""))
-        return False
+    return msg
 
 
-def send_cancellation_email(booking, reason: str = "", *, subject_prefix: str = "[SalesPortal]") -> bool:
+def build_digest_message(bookings, batch_code: str = "", *, subject_prefix: str = "[SalesPortal]") -> Optional[EmailMultiAlternatives]:
     """
-    Письмо-Аннуляция в офис партнёра.
+    Одно письмо партнёру на несколько броней (батч-отправка в режиме digest).
+    Получатели берутся из первой брони — группировку по адресу делает вызывающий.
     """
-    to: List[str] = []
-    company = getattr(booking, "company", None)
-    comp_email = getattr(company, "email_for_orders", None)
-    if comp_email:
-        to.append(comp_email)
+    bookings = list(bookings)
+    if not bookings:
+        return None
+    to = _recipients_for(bookings[0])
+    if not to:
+        log.warning("send_digest_email: no recipients for batch_code=%s", batch_code)
+        return None
+
+    company = getattr(bookings[0], "company", None)
+
+    def make_ctx():
+        ctxs = build_contexts(bookings)
+        return {
+            "items": [ctxs[b.pk] for b in bookings],
+            "batch_code": batch_code,
+            "company": company,
+        }
+
+    # версия дайджеста = версии всех броней в порядке письма + код пачки
+    stamps = traveler_stamps(bookings)
+    version = hashlib.sha256(
+        "|".join([batch_code] + [booking_version(b, stamps[b.pk]) for b in bookings]).encode("utf-8")
+    ).hexdigest()
+    html, text, _ = _render_cached("sales/email_reservation_digest.html", version, make_ctx)
+
+    dates = sorted({_fmt_date(getattr(b, "date", None)) for b in bookings} - {""})
+    when = dates[0] if len(dates) == 1 else (f"{dates[0]}…{dates[-1]}" if dates else "")
+    who = (getattr(company, "name", "")
+           or getattr(getattr(bookings[0], "guide", None), "get_full_name", lambda: "")()
+           or "").strip() or "—"
 
-    fallback_to = getattr(settings, "BOOKINGS_FALLBACK_EMAIL", None)
-    if not to and fallback_to:
-        to.append(fallback_to)
+    subject = f"{subject_prefix} Reservas de {who} — {len(bookings)} reservas — {when} — {batch_code}"
+    subject = re.sub(r"\s+", " ", subject).strip()
+
+    from_email = getattr(settings, "DEFAULT_FROM_EMAIL", "no-reply@example.com")
+    msg = EmailMultiAlternatives(subject=subject, body=text, from_email=from_email, to=to)
+    msg.attach_alternative(html, "text/html")
+    return msg
+
+
+def build_cancellation_message(booking, reason: str = "", *, subject_prefix: str = "[SalesPortal]",
+                               contexts: Optional[ContextBatch] = None) -> Optional[EmailMultiAlternatives]:
+    """
+    Письмо-Аннуляция в офис партнёра. None — если получателей нет.
+    """
+    to = _recipients_for(booking)
     if not to:
         log.warning("send_cancellation_email: no recipients for booking_code=%s", getattr(booking, "booking_code", ""))
-        return True
+        return None
 
-    ctx = _build_common_ctx(booking)
-    ctx["reason"] = reason or ""
+    base_ctx = _ctx_maker(booking, contexts)
 
-    title_es = ctx["booking"].get("title_es") or ctx["booking"].get("excursion_title") or ""
+    def make_ctx():
+        ctx = base_ctx()
+        ctx["reason"] = reason or ""
+        return ctx
+
+    stamp = contexts.stamp(booking) if contexts is not None else None
+    version = hashlib.sha256(f"{booking_version(booking, stamp)}|{reason or ''}".encode("utf-8")).hexdigest()
+    html, text, title_es = _render_cached("sales/email_cancellation.html", version, make_ctx)
+
+    title_es = title_es or getattr(booking, "excursion_title", "") or ""
     when = _fmt_date(getattr(booking, "date", None))
     comp_or_guide = (getattr(getattr(booking, "company", None), "name", None)
                      or getattr(getattr(booking, "guide", None), "get_full_name", lambda: "")()
@@ -342,12 +559,40 @@ def send_cancellation_email(booking, reason: str = "", *, subject_prefix: str =
     subject = f"{subject_prefix} Cancelación — Reserva de {comp_or_guide}: {title_es} · {when} · {getattr(booking, 'booking_code', '')}"
     subject = re.sub(r"\s+", " ", subject).strip()
 
-    html = render_to_string("sales/email_cancellation.html", ctx)
-    text = strip_tags(html)
     from_email = getattr(settings, "DEFAULT_FROM_EMAIL", "no-reply@example.com")
 
     msg = EmailMultiAlternatives(subject=subject, body=text, from_email=from_email, to=to)
     msg.attach_alternative(html, "text/html")
+    return msg
+
+# ---------------------------------------------------------------------------
+# Синхронная отправка (для фоновой — sales.services.outbox)
+
+def send_booking_email(booking, *, subject_prefix: str = "[SalesPortal]") -> bool:
+    """
+    Письмо-заявка/бронирование в офис партнёра.
+    Возвращает True, если письмо успешно передано SMTP-бэкенду.
+    """
+    msg = build_booking_message(booking, subject_prefix=subject_prefix)
+    if msg is None:
+        return True  # не считаем ошибкой: просто некуда отправлять
+
+    try:
+        sent = msg.send(fail_silently=False)
+        return bool(sent)
+    except Exception:
+        log.exception("send_booking_email failed for booking_code=%s", getattr(booking, "booking_code", ""))
+        return False
+
+
+def send_cancellation_email(booking, reason: str = "", *, subject_prefix: str = "[SalesPortal]") -> bool:
+    """
+    Письмо-Аннуляция в офис партнёра.
+    """
+    msg = build_cancellation_message(booking, reason, subject_prefix=subject_prefix)
+    if msg is None:
+        return True
+
     try:
         return bool(msg.send(fail_silently=False))
     except Exception:
@@ -0,0 +1,140 @@
+# sales/services/hotels.py
+"""
+Название отеля → отель CSI через постоянную таблицу HotelAlias.
+
+csi.search_hotels кэширует ответ лишь на 60 с, а импорт туристов искал
+отель на каждую строку — тысячи HTTP-запросов на файл. Теперь:
+
+  * названия нормализуются и схлопываются до уникальных;
+  * уже известные берутся из HotelAlias одним запросом;
+  * остальные ищутся в CSI параллельно, не больше HOTEL_RESOLVE_WORKERS
+    запросов одновременно, и записываются в HotelAlias.
+
+Найденные соответствия постоянны (поправить — в админке), промахи
+(CSI ответил, но отеля нет) перепроверяются через HOTEL_ALIAS_MISS_TTL.
+Ошибки CSI (недоступен, 5xx) не записываются вовсе — следующий вызов
+спросит снова.
+Той же таблицей пользуются pickups/quote, когда вместо hotel_id пришло название.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from sales.models import HotelAlias
+from sales.services import costasolinfo as csi
+
+log = logging.getLogger(__name__)
+
+WORKERS = getattr(settings, "HOTEL_RESOLVE_WORKERS", 8)
+MISS_TTL = getattr(settings, "HOTEL_ALIAS_MISS_TTL", 3600)
+SEARCH_LIMIT = 10
+CHUNK = 500
+
+
+class Hotel(NamedTuple):
+    id: Optional[int]
+    name: str
+    region: str
+
+
+def alias_key(name) -> str:
+    """Нижний регистр, схлопнутые пробелы — ключ HotelAlias."""
+    return re.sub(r"\s+", " ", str(name or "").strip().lower())[:255]
+
+
+def _region_of(item: dict) -> str:
+    reg = item.get("region") or item.get("region_name") or ""
+    if isinstance(reg, dict):
+        reg = reg.get("name") or reg.get("slug") or ""
+    return str(reg)[:120]
+
+
+def _pick(items: List[dict], name: str) -> Optional[dict]:
+    """Приоритет: точное совпадение → начинается с → первый результат."""
+    target = alias_key(name)
+    named = [(alias_key(it.get("name") or it.get("title") or ""), it) for it in items if it.get("id")]
+    for n, it in named:
+        if n == target:
+            return it
+    for n, it in named:
+        if n and (n.startswith(target) or target.startswith(n)):
+            return it
+    return named[0][1] if named else None
+
+
+def lookup(name: str) -> Optional[Hotel]:
+    """
+    Один поиск в CSI, мимо таблицы алиасов. Hotel(None, ...) — CSI ответил,
+    но отеля нет; None — CSI недоступен (такое не кэшируется).
+    """
+    try:
+        res = csi.search_hotels(name, limit=SEARCH_LIMIT, raise_errors=True) or []
+        items = res if isinstance(res, list) else (res.get("items") or [])
+        it = _pick(items, name)
+        if it:
+            return Hotel(int(it["id"]), it.get("name") or it.get("title") or name, _region_of(it))
+    except Exception:
+        log.exception("CSI hotel lookup failed: %s", name)
+        return None
+    return Hotel(None, name, "")
+
+
+def _save(found: Dict[str, Hotel], raw_by_key: Dict[str, str]) -> None:
+    now = timezone.now()
+    rows = [
+        HotelAlias(alias=k, raw_name=raw_by_key[k][:255], hotel_id=h.id,
+                   hotel_name=(h.name or "")[:255] if h.id else "", region_name=h.region, resolved_at=now)
+        for k, h in found.items()
+    ]
+    HotelAlias.objects.bulk_create(
+        rows, batch_size=CHUNK, update_conflicts=True, unique_fields=["alias"],
+        update_fields=["raw_name", "hotel_id", "hotel_name", "region_name", "resolved_at"],
+    )
+
+
+def resolve_many(names: Iterable[str], *, workers: int = WORKERS) -> Dict[str, Hotel]:
+    """
+    {название: Hotel} для набора названий. Каждое уникальное написание
+    ищется в CSI не больше одного раза; не найденные — Hotel(None, название, "").
+    """
+    names = [str(n) for n in names]
+    raw_by_key: Dict[str, str] = {}
+    for n in names:
+        k = alias_key(n)
+        if k:
+            raw_by_key.setdefault(k, n.strip())
+
+    known: Dict[str, Hotel] = {}
+    stale = timezone.now() - timedelta(seconds=MISS_TTL)
+    keys = list(raw_by_key)
+    for i in range(0, len(keys), CHUNK):
+        for a in HotelAlias.objects.filter(alias__in=keys[i:i + CHUNK]):
+            if a.hotel_id or a.resolved_at >= stale:
+                known[a.alias] = Hotel(a.hotel_id, a.hotel_name or a.raw_name, a.region_name)
+
+    todo = [k for k in keys if k not in known]
+    if todo:
+        # в потоках — только HTTP; база — здесь, в вызывающем потоке
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo)))) as pool:
+            found = dict(zip(todo, pool.map(lambda k: lookup(raw_by_key[k]), todo)))
+        # ошибки CSI не сохраняем: иначе сбой на час превратился бы в «не найдено»
+        found = {k: h for k, h in found.items() if h is not None}
+        _save(found, raw_by_key)
+        known.update(found)
+
+    out = {}
+    for n in names:
+        h = known.get(alias_key(n))
+        out[n] = Hotel(h.id, h.name if h.id else n.strip(), h.region) if h else Hotel(None, n.strip(), "")
+    return out
+
+
+def resolve(name: str) -> Hotel:
+    return resolve_many([name])[str(name)]
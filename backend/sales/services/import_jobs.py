@@ -0,0 +1,193 @@
+# sales/services/import_jobs.py
+"""
+Фоновый импорт туристов: страница импорта и админка только сохраняют файл
+в ImportJob, а `manage.py import_worker` разбирает очередь.
+
+Аренда — как у спулера печати: задание забирается условным update по
+next_attempt_at и продлевается после каждой пачки тем же условным update —
+если аренду за это время забрал другой воркер, пачка откатывается и этот
+воркер задание бросает. RUNNING с истёкшей арендой (воркер упал или был
+убит) забирается снова и продолжается с job.next_row: счётчики, замечания
+и next_row фиксируются в одной транзакции с пачкой, поэтому уже записанные
+строки повторно не обрабатываются.
+
+Сухой прогон ничего не фиксирует и при повторе начинается сначала.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from sales.models import ImportJob
+
+log = logging.getLogger(__name__)
+
+LEASE_SECONDS = getattr(settings, "IMPORT_JOB_LEASE_SECONDS", 300)
+MAX_ATTEMPTS = getattr(settings, "IMPORT_JOB_MAX_ATTEMPTS", 3)
+MAX_ISSUES = getattr(settings, "IMPORT_JOB_MAX_ISSUES", 2000)   # отчёт дальше не растёт, skipped считается всё равно
+BACKOFF_SECONDS = 60
+
+COUNTERS = ("created_families", "updated_families", "created_travelers", "skipped")
+PROGRESS_FIELDS = [*COUNTERS, "issues", "rows_done", "rows_total", "next_row", "sheet", "next_attempt_at"]
+RESULT_FIELDS = [*PROGRESS_FIELDS, "column_mapping", "status", "finished_at", "last_error"]
+
+
+class LeaseLost(Exception):
+    """Аренда истекла и задание забрал другой воркер — этот прекращает работу."""
+
+
+def _save_leased(job: ImportJob, lease, fields) -> bool:
+    """Записать поля, только если задание всё ещё под нашей арендой (next_attempt_at == lease)."""
+    return bool(ImportJob.objects.filter(pk=job.pk, next_attempt_at=lease).update(**{f: getattr(job, f) for f in fields}))
+
+
+def submit(up_file, *, dry_run: bool = False, user=None) -> ImportJob:
+    """Поставить загруженный файл в очередь."""
+    return ImportJob.objects.create(
+        file=up_file,
+        original_name=os.path.basename(str(getattr(up_file, "name", "") or ""))[:255],
+        dry_run=dry_run,
+        created_by=user if getattr(user, "is_authenticated", False) else None,
+    )
+
+
+def visible_to(user):
+    """Задания, которые пользователь может смотреть: сотрудники офиса — все, остальные — свои."""
+    qs = ImportJob.objects.all()
+    if not getattr(user, "is_authenticated", False):
+        return qs.none()
+    return qs if user.is_staff else qs.filter(created_by=user)
+
+
+def _claim(now) -> Optional[ImportJob]:
+    candidates = list(
+        ImportJob.objects
+        .filter(status__in=("PENDING", "RUNNING"), next_attempt_at__lte=now)
+        .order_by("id")
+        .values_list("id", "next_attempt_at")[:5]
+    )
+    lease_until = now + timedelta(seconds=LEASE_SECONDS)
+    for pk, nxt in candidates:
+        if ImportJob.objects.filter(pk=pk, next_attempt_at=nxt).update(
+            status="RUNNING", next_attempt_at=lease_until, attempts=F("attempts") + 1,
+        ):
+            return ImportJob.objects.get(pk=pk)
+    return None
+
+
+def run(job: ImportJob) -> ImportJob:
+    """Выполнить (или продолжить) задание. Ошибки не пробрасываются — они в job."""
+    from sales.importers import tourists_excel   # pandas/openpyxl — только в воркере
+
+    if job.dry_run or not job.next_row:
+        job.next_row, job.rows_done, job.issues = 0, 0, []
+        for c in COUNTERS:
+            setattr(job, c, 0)
+    if job.started_at is None:
+        job.started_at = timezone.now()
+        job.save(update_fields=["started_at"])
+
+    lease = job.next_attempt_at       # выставлен в _claim; по нему проверяем, что задание ещё наше
+    base = {c: getattr(job, c) for c in COUNTERS}
+    base_rows, base_issues = job.rows_done, list(job.issues)
+
+    def sync(report, expected=None):
+        for c in COUNTERS:
+            setattr(job, c, base[c] + getattr(report, c))
+        issues = report.issues[:max(0, MAX_ISSUES - len(base_issues))]
+        job.issues = base_issues + [i.__dict__ for i in issues]
+        job.rows_done = base_rows + report.total_rows
+        if expected is not None:
+            job.rows_total = expected
+        job.next_row = max(job.next_row, report.next_row)
+        job.sheet = report.sheet[:120]
+
+    def progress(report, expected):
+        nonlocal lease
+        sync(report, expected)
+        job.next_attempt_at = timezone.now() + timedelta(seconds=LEASE_SECONDS)   # продлеваем аренду
+        # внутри транзакции пачки: исключение откатит и её данные
+        if not _save_leased(job, lease, PROGRESS_FIELDS):
+            raise LeaseLost(f"import job #{job.pk}: lease lost")
+        lease = job.next_attempt_at
+
+    try:
+        with job.file.open("rb") as f:
+            result = tourists_excel.import_tourists_excel(
+                f, dry_run=job.dry_run, start_row=job.next_row, on_progress=progress,
+            )
+    except LeaseLost:
+        log.warning("import job #%s was taken over by another worker, abandoning", job.pk)
+        job.refresh_from_db()
+        return job
+    except Exception as e:
+        log.exception("import job #%s failed", job.pk)
+        job.refresh_from_db()       # в памяти могут быть счётчики незафиксированной пачки
+        if job.next_attempt_at != lease:
+            log.warning("import job #%s was taken over by another worker, not recording the error", job.pk)
+            return job
+        job.last_error = f"{type(e).__name__}: {e}"[:2000]
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status, job.finished_at = "FAILED", timezone.now()
+        else:
+            job.status, job.next_attempt_at = "PENDING", timezone.now() + timedelta(seconds=BACKOFF_SECONDS)
+        _save_leased(job, lease, ["last_error", "status", "finished_at", "next_attempt_at"])
+        return job
+
+    # итог: в т.ч. замечания, не попавшие в пачки («нет обязательных колонок»)
+    report = tourists_excel.ImportReport(sheet=result["sheet"], next_row=result["next_row"], total_rows=result["total_rows"],
+                                         **{c: result[c] for c in COUNTERS})
+    report.issues = [tourists_excel.RowIssue(**i) for i in result["issues"]]
+    sync(report)
+    if job.rows_total is None or job.rows_total < job.rows_done:
+        job.rows_total = job.rows_done
+    job.column_mapping = result.get("column_mapping") or {}
+    job.status, job.finished_at, job.last_error = "DONE", timezone.now(), ""
+    if not _save_leased(job, lease, RESULT_FIELDS):
+        log.warning("import job #%s was taken over by another worker before it finished", job.pk)
+        job.refresh_from_db()
+    return job
+
+
+def run_once() -> Optional[ImportJob]:
+    job = _claim(timezone.now())
+    return run(job) if job else None
+
+
+def serve(*, interval: float = 2.0, stop: Optional[threading.Event] = None) -> None:
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        if run_once() is None:
+            stop.wait(interval)
+
+
+def status(job: ImportJob) -> Dict[str, Any]:
+    """Состояние задания для API и страницы импорта."""
+    return {
+        "id": job.id,
+        "file": job.original_name,
+        "dry_run": job.dry_run,
+        "status": job.status,
+        "progress": job.progress,
+        "sheet": job.sheet,
+        "rows_done": job.rows_done,
+        "rows_total": job.rows_total,
+        "created_families": job.created_families,
+        "updated_families": job.updated_families,
+        "created_travelers": job.created_travelers,
+        "skipped": job.skipped,
+        "column_mapping": job.column_mapping,
+        "issues": job.issues,
+        "attempts": job.attempts,
+        "last_error": job.last_error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
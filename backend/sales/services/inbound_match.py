@@ -0,0 +1,158 @@
+# sales/services/inbound_match.py
+"""
+Привязка входящих писем (InboundEmail) к броням.
+
+Два признака, по убыванию надёжности:
+  1) код брони в теме, затем в тексте. Коды — 10 символов A-Z0-9
+     (BookingSaleCreateSerializer._make_code). Текст режется на токены
+     одним регулярным выражением, каждый токен проверяется в множестве
+     кодов — без запроса к БД и без перебора кодов на письмо;
+  2) тред: In-Reply-To/References письма совпадает с Message-ID нашего
+     отправленного письма (OutboundEmail.message_id).
+
+Индексы строятся один раз на прогон, результат пишется bulk_update —
+тысячи писем сверяются за секунды. Сверенное письмо помечается
+(match_checked_at): плановый прогон берёт только новые письма и
+непривязанные за последние RECHECK_DAYS — коды броней, заведённых
+позже, обычно приходят в свежей переписке. Старую почту целиком
+пересчитывает relink=True.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from sales.models import BookingSale, InboundEmail, OutboundEmail
+
+log = logging.getLogger(__name__)
+
+ACTIVE_DAYS = getattr(settings, "INBOUND_MATCH_ACTIVE_DAYS", 365)   # брони старше не ищем
+RECHECK_DAYS = getattr(settings, "INBOUND_MATCH_RECHECK_DAYS", 14)  # непривязанные моложе — сверяем снова
+CHUNK = 2000
+
+_TOKEN_RE = re.compile(r"[A-Z0-9](?:[A-Z0-9-]*[A-Z0-9])?")
+_MSGID_RE = re.compile(r"<[^<>\s]+>")
+
+
+# ---------------------------------------------------------------------------
+# Индексы
+
+class CodeIndex:
+    """Множество кодов активных броней: code → booking_id."""
+
+    def __init__(self, codes: Dict[str, int]):
+        self.codes = {c.upper(): pk for c, pk in codes.items() if c}
+        self.lengths = {len(c) for c in self.codes}
+
+    @classmethod
+    def active(cls, *, days: int = ACTIVE_DAYS) -> "CodeIndex":
+        since = timezone.localdate() - timedelta(days=days)
+        rows = BookingSale.objects.filter(date__gte=since).values_list("booking_code", "id")
+        return cls(dict(rows))
+
+    def find(self, text: str) -> List[int]:
+        """booking_id всех кодов в тексте, в порядке появления, без повторов."""
+        if not text or not self.codes:
+            return []
+        out: List[int] = []
+        for token in _TOKEN_RE.findall(text.upper()):
+            # "REF-ABCD123456" → проверяем и весь токен, и части через дефис
+            for cand in (token, *token.split("-")) if "-" in token else (token,):
+                if len(cand) in self.lengths:
+                    pk = self.codes.get(cand)
+                    if pk is not None and pk not in out:
+                        out.append(pk)
+        return out
+
+
+def thread_index() -> Dict[str, int]:
+    """Message-ID наших отправленных писем → booking_id."""
+    rows = (
+        OutboundEmail.objects
+        .filter(status="SENT", booking__isnull=False)
+        .exclude(message_id="")
+        .values_list("message_id", "booking_id")
+    )
+    return {mid.strip(): pk for mid, pk in rows}
+
+
+# ---------------------------------------------------------------------------
+# Сопоставление
+
+MATCH_FIELDS = ("id", "subject", "snippet", "in_reply_to", "references", "raw_key", "booking_id")
+
+
+def match(email_obj, codes: CodeIndex, threads: Dict[str, int]) -> Optional[int]:
+    """booking_id для письма или None."""
+    hit = codes.find(email_obj.subject or "")
+    if hit:
+        return hit[0]
+
+    # тред — до поиска в теле: в цитате ответа бывают коды соседних броней из дайджеста
+    refs = f"{email_obj.in_reply_to or ''} {email_obj.references or ''}".strip()
+    # In-Reply-To — самый близкий предок, в References он последний
+    for mid in [email_obj.in_reply_to or ""] + list(reversed(_MSGID_RE.findall(refs))):
+        pk = threads.get(mid.strip()) if mid else None
+        if pk is not None:
+            return pk
+
+    # тело читается из хранилища только здесь — когда тема и тред ничего не дали
+    body = email_obj.body_text or strip_tags(email_obj.body_html or "") or email_obj.snippet or ""
+    hit = codes.find(body)
+    return hit[0] if hit else None
+
+
+def pending(*, recheck_days: int = RECHECK_DAYS) -> QuerySet:
+    """Непривязанные письма, которые ещё не сверялись или пришли недавно."""
+    since = timezone.now() - timedelta(days=recheck_days)
+    return InboundEmail.objects.filter(booking__isnull=True).filter(
+        Q(match_checked_at__isnull=True) | Q(created_at__gte=since)
+    )
+
+
+def reconcile(queryset: Optional[QuerySet] = None, *, relink: bool = False,
+              codes: Optional[CodeIndex] = None, threads: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """
+    Привязать письма к броням. Без queryset — только pending();
+    relink=True пересчитывает все письма, и уже привязанные (например, после импорта броней).
+    Возвращает {"scanned", "linked"}.
+    """
+    if queryset is None:
+        qs = InboundEmail.objects.all() if relink else pending()
+    else:
+        qs = queryset if relink else queryset.filter(booking__isnull=True)
+    codes = codes or CodeIndex.active()
+    threads = threads if threads is not None else thread_index()
+
+    stats = {"scanned": 0, "linked": 0}
+    # пишем после чтения: SQLite не изолирует iterator() от update той же таблицы
+    changed: List[InboundEmail] = []
+    scanned: List[int] = []
+    for e in qs.order_by().only(*MATCH_FIELDS).iterator(chunk_size=CHUNK):
+        scanned.append(e.id)
+        pk = match(e, codes, threads)
+        if pk is not None and pk != e.booking_id:
+            changed.append(InboundEmail(id=e.id, booking_id=pk))
+
+    for i in range(0, len(changed), CHUNK):
+        InboundEmail.objects.bulk_update(changed[i:i + CHUNK], ["booking"], batch_size=500)
+    now = timezone.now()
+    for i in range(0, len(scanned), 500):
+        InboundEmail.objects.filter(id__in=scanned[i:i + 500]).update(match_checked_at=now)
+    stats["scanned"], stats["linked"] = len(scanned), len(changed)
+    return stats
+
+
+def reconcile_uids(uids: Iterable[str]) -> Dict[str, int]:
+    """Привязка только что принятых писем (после mail_sync)."""
+    uids = list(uids)
+    if not uids:
+        return {"scanned": 0, "linked": 0}
+    return reconcile(InboundEmail.objects.filter(uid__in=uids))
@@ -0,0 +1,240 @@
+# sales/services/inbound_search.py
+"""
+Полнотекстовый поиск по входящим письмам.
+
+Раньше админка искала icontains по body_text/snippet — полный проход по
+телам писем на каждый запрос. Теперь индекс ведётся при приёме письма
+(mail_sync) и при сохранении через ORM (сигналы):
+
+  * SQLite с FTS5 — виртуальная таблица sales_inboundemail_fts
+    (subject, from_email, to_email, body), ранжирование bm25 с весами полей;
+  * иначе (другая БД или SQLite без FTS5) — таблица InboundEmailToken:
+    нормализованные слова с весом поля, индекс по token.
+
+Запрос: слова через пробел, все обязательны, последнее — префикс
+(поиск «по мере набора»). Тело индексируется не длиннее
+INBOUND_SEARCH_BODY_CHARS символов — длинные цитаты в ответах не нужны.
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.utils.html import strip_tags
+
+from sales.models import InboundEmail, InboundEmailToken
+
+FTS_TABLE = "sales_inboundemail_fts"
+BODY_CHARS = getattr(settings, "INBOUND_SEARCH_BODY_CHARS", 20000)
+MAX_TERMS = 8
+
+# веса полей: тема важнее адресов, адреса важнее текста
+WEIGHTS = {"subject": 10, "from_email": 5, "to_email": 2, "body": 1}
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+INDEX_FIELDS = ("id", "subject", "from_email", "to_email", "snippet", "raw_key")
+
+
+# ---------------------------------------------------------------------------
+# Документ
+
+@lru_cache(maxsize=4096)
+def _fold_char(ch: str) -> str:
+    # как unicode61 remove_diacritics 2 в FTS5: диакритика снимается только с латиницы,
+    # й/ё и прочая кириллица остаются как есть (иначе «Андрей» в индексе и «андреи» в запросе)
+    if not unicodedata.name(ch, "").startswith("LATIN"):
+        return ch
+    return "".join(c for c in unicodedata.normalize("NFD", ch) if not unicodedata.combining(c))
+
+
+def _fold(text: str) -> str:
+    """Нижний регистр без латинской диакритики: «Cancelación» → «cancelacion», «Ёжик» → «ёжик»."""
+    text = unicodedata.normalize("NFC", (text or "").lower())
+    return text if text.isascii() else "".join(map(_fold_char, text))
+
+
+def tokens(text: str) -> List[str]:
+    return [w[:48] for w in _WORD_RE.findall(_fold(text)) if len(w) > 1 or w.isdigit()]
+
+
+def document(e) -> Dict[str, str]:
+    body = e.body_text or strip_tags(e.body_html or "") or e.snippet or ""
+    return {
+        "subject": e.subject or "",
+        "from_email": e.from_email or "",
+        "to_email": e.to_email or "",
+        "body": body[:BODY_CHARS],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Бэкенд
+
+@lru_cache(maxsize=1)
+def _fts_available() -> bool:
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cur:
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cur.fetchone() is not None
+
+
+def backend() -> str:
+    return "fts5" if _fts_available() else "tokens"
+
+
+# ---------------------------------------------------------------------------
+# Ведение индекса
+
+def index_emails(emails: Iterable) -> int:
+    """(Пере)индексировать письма. Принимает объекты или queryset."""
+    if hasattr(emails, "only"):
+        emails = emails.only(*INDEX_FIELDS)
+    docs = [(e.pk, document(e)) for e in emails]
+    if not docs:
+        return 0
+    ids = [pk for pk, _ in docs]
+    if _fts_available():
+        with connection.cursor() as cur:
+            cur.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({','.join(['%s'] * len(ids))})", ids)
+            cur.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, subject, from_email, to_email, body) VALUES (%s, %s, %s, %s, %s)",
+                [(pk, d["subject"], d["from_email"], d["to_email"], d["body"]) for pk, d in docs],
+            )
+    else:
+        InboundEmailToken.objects.filter(email_id__in=ids).delete()
+        rows = []
+        for pk, d in docs:
+            weight: Dict[str, int] = {}
+            for field, w in WEIGHTS.items():
+                for t in set(tokens(d[field])):
+                    weight[t] = weight.get(t, 0) + w
+            rows += [InboundEmailToken(email_id=pk, token=t, weight=w) for t, w in weight.items()]
+        InboundEmailToken.objects.bulk_create(rows, batch_size=1000)
+    return len(docs)
+
+
+def remove(ids: Iterable[int]) -> None:
+    ids = list(ids)
+    if ids and _fts_available():
+        with connection.cursor() as cur:
+            cur.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({','.join(['%s'] * len(ids))})", ids)
+    # InboundEmailToken удаляются каскадом вместе с письмом
+
+
+def rebuild(*, chunk: int = 1000) -> int:
+    """Полная переиндексация (после миграции или смены бэкенда)."""
+    if _fts_available():
+        with connection.cursor() as cur:
+            cur.execute(f"DELETE FROM {FTS_TABLE}")
+    else:
+        InboundEmailToken.objects.all().delete()
+    total, last = 0, 0
+    while True:
+        batch = list(InboundEmail.objects.filter(pk__gt=last).order_by("pk").only(*INDEX_FIELDS)[:chunk])
+        if not batch:
+            return total
+        total += index_emails(batch)
+        last = batch[-1].pk
+
+
+# ---------------------------------------------------------------------------
+# Поиск
+
+def _terms(query: str) -> List[str]:
+    return tokens(query)[:MAX_TERMS]
+
+
+def _fts_match(terms: List[str]) -> str:
+    # каждое слово — в кавычках (никакого синтаксиса FTS из пользовательского ввода), последнее — префикс
+    parts = ['"' + t.replace('"', '""') + '"' for t in terms]
+    parts[-1] += "*"
+    return " ".join(parts)
+
+
+def search(query: str, *, page: int = 1, page_size: int = 20) -> Tuple[int, List[Tuple[int, float, str]]]:
+    """
+    (всего найдено, [(email_id, score, snippet), ...]) для страницы, по убыванию релевантности.
+    snippet — фрагмент текста с [выделением] (только FTS5, иначе пустая строка).
+    """
+    terms = _terms(query)
+    if not terms:
+        return 0, []
+    page, page_size = max(1, page), max(1, page_size)
+    offset = (page - 1) * page_size
+
+    if _fts_available():
+        match = _fts_match(terms)
+        w = WEIGHTS
+        with connection.cursor() as cur:
+            cur.execute(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+            total = cur.fetchone()[0]
+            cur.execute(
+                f"SELECT rowid, bm25({FTS_TABLE}, %s, %s, %s, %s) AS score, "
+                f"snippet({FTS_TABLE}, 3, '[', ']', '…', 12) "
+                f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY score LIMIT %s OFFSET %s",
+                [w["subject"], w["from_email"], w["to_email"], w["body"], match, page_size, offset],
+            )
+            # bm25 тем лучше, чем меньше (отрицательный) — отдаём «больше = лучше»
+            return total, [(pk, -score, snip or "") for pk, score, snip in cur.fetchall()]
+
+    # переносимый вариант: пересечение по словам, ранг — сумма весов совпавших слов
+    ids: Optional[set] = None
+    for i, t in enumerate(terms):
+        qs = InboundEmailToken.objects.filter(**({"token__startswith": t} if i == len(terms) - 1 else {"token": t}))
+        found = set(qs.values_list("email_id", flat=True))
+        ids = found if ids is None else ids & found
+        if not ids:
+            return 0, []
+    ranked = list(
+        InboundEmailToken.objects
+        .filter(email_id__in=ids, token__in=terms[:-1])
+        .values("email_id").annotate(score=Sum("weight")).values_list("email_id", "score")
+    )
+    prefix = dict(
+        InboundEmailToken.objects
+        .filter(email_id__in=ids, token__startswith=terms[-1])
+        .values("email_id").annotate(score=Sum("weight")).values_list("email_id", "score")
+    )
+    scores = {pk: float(prefix.get(pk, 0)) for pk in ids}
+    for pk, score in ranked:
+        scores[pk] += score
+    ordered = sorted(scores.items(), key=lambda kv: (-kv[1], -kv[0]))
+    return len(ordered), [(pk, score, "") for pk, score in ordered[offset:offset + page_size]]
+
+
+def filter_queryset(queryset, query: str):
+    """
+    Только совпавшие письма, с аннотацией search_rank (больше = лучше) —
+    для админки: сортировка по рангу и постраничный вывод делаются в SQL,
+    без выборки всех id в память.
+    """
+    terms = _terms(query)
+    if not terms:
+        return queryset.none()
+    if _fts_available():
+        w = WEIGHTS
+        table = queryset.model._meta.db_table
+        return queryset.extra(
+            select={"search_rank": f"-bm25({FTS_TABLE}, %s, %s, %s, %s)"},
+            select_params=[w["subject"], w["from_email"], w["to_email"], w["body"]],
+            tables=[FTS_TABLE],
+            where=[f"{FTS_TABLE}.rowid = {table}.id", f"{FTS_TABLE} MATCH %s"],
+            params=[_fts_match(terms)],
+        )
+
+    for i, t in enumerate(terms):
+        lookup = {"token__startswith": t} if i == len(terms) - 1 else {"token": t}
+        queryset = queryset.filter(pk__in=InboundEmailToken.objects.filter(**lookup).values("email_id"))
+    score = (
+        InboundEmailToken.objects
+        .filter(Q(token__in=terms[:-1]) | Q(token__startswith=terms[-1]), email_id=OuterRef("pk"))
+        .values("email_id").annotate(score=Sum("weight")).values("score")
+    )
+    return queryset.annotate(search_rank=Subquery(score))
@@ -0,0 +1,345 @@
+# sales/services/mail_push.py
+"""
+Push-приём входящих через IMAP IDLE (демон `manage.py watch_inbox`).
+
+Держим одно соединение: синхронизация (mail_sync.MailboxSync) → IDLE →
+сервер сообщает EXISTS → DONE → снова синхронизация. Подтверждения
+партнёров появляются в БД через секунды, без опроса по расписанию и без
+кнопки в админке, блокирующей запрос. IDLE переоткрывается каждые
+IMAP_IDLE_SECONDS (RFC 2177: не дольше 29 минут) — заодно это страховка
+от пропущенного уведомления. Обрыв соединения — переподключение с
+экспоненциальной паузой.
+
+FakeImapServer — минимальный IMAP-сервер в памяти для проверки без Gmail.
+"""
+from __future__ import annotations
+
+import email
+import imaplib
+import itertools
+import logging
+import re
+import select
+import socketserver
+import ssl
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from sales.services import mail_sync
+
+log = logging.getLogger(__name__)
+
+IDLE_SECONDS = getattr(settings, "IMAP_IDLE_SECONDS", 300)
+BACKOFF_BASE = getattr(settings, "IMAP_IDLE_BACKOFF_SECONDS", 5)
+BACKOFF_MAX = getattr(settings, "IMAP_IDLE_BACKOFF_MAX_SECONDS", 300)
+
+_EXISTS_RE = re.compile(rb"^\* \d+ (EXISTS|RECENT)", re.I)
+_tags = itertools.count(1)
+
+
+# ---------------------------------------------------------------------------
+# IDLE (в imaplib до Python 3.14 его нет)
+
+def _buffered(conn: imaplib.IMAP4) -> bool:
+    """
+    Есть ли непрочитанные данные в буфере conn.file. Сервер часто шлёт
+    «+ idling» и «* N EXISTS» одним пакетом: readline забирает оба в буфер,
+    и select по сокету их уже не увидит.
+    """
+    f, sock = getattr(conn, "file", None), conn.sock
+    if f is None or not hasattr(f, "peek"):
+        return False
+    timeout = sock.gettimeout()
+    sock.setblocking(False)           # peek при пустом буфере читает сокет — не ждём
+    try:
+        return bool(f.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def _readable(conn: imaplib.IMAP4, timeout: float) -> bool:
+    if _buffered(conn):
+        return True
+    sock = conn.sock
+    pending = getattr(sock, "pending", None)      # SSL: уже расшифрованные байты select не увидит
+    if pending and pending():
+        return True
+    r, _, _ = select.select([sock], [], [], timeout)
+    return bool(r)
+
+
+def _readline(conn: imaplib.IMAP4) -> bytes:
+    line = conn.readline()
+    if not line:
+        raise imaplib.IMAP4.abort("connection closed during IDLE")
+    return line
+
+
+def idle(conn: imaplib.IMAP4, seconds: float = IDLE_SECONDS, *, stop: Optional[threading.Event] = None) -> bool:
+    """
+    IDLE на выбранном ящике до уведомления о новом письме, истечения
+    `seconds` или stop. True — сервер сообщил о новых письмах.
+    """
+    tag = b"IDLE%d" % next(_tags)
+    conn.send(tag + b" IDLE\r\n")
+    line = _readline(conn)
+    if not line.startswith(b"+"):
+        raise imaplib.IMAP4.error(f"IDLE refused: {line!r}")
+
+    got = False
+    deadline = time.monotonic() + seconds
+    while not got and not (stop and stop.is_set()):
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+        # короткие ожидания — чтобы вовремя заметить stop
+        if not _readable(conn, min(left, 1.0)):
+            continue
+        line = _readline(conn)
+        if line.startswith(b"* BYE"):
+            raise imaplib.IMAP4.abort(f"server closed IDLE: {line!r}")
+        if _EXISTS_RE.match(line):
+            got = True
+
+    conn.send(b"DONE\r\n")
+    while True:
+        line = _readline(conn)
+        if line.startswith(tag + b" "):
+            if not line[len(tag) + 1:].upper().startswith(b"OK"):
+                raise imaplib.IMAP4.error(f"IDLE failed: {line!r}")
+            return got
+        if _EXISTS_RE.match(line):
+            got = True
+
+
+# ---------------------------------------------------------------------------
+# Демон
+
+class IdleWatcher:
+    """
+    Цикл «sync → IDLE» с переподключением. on_sync(stats) вызывается после
+    каждой синхронизации (логирование, привязка писем к броням и т.п.).
+    Серверы без IDLE опрашиваются раз в idle_seconds.
+    """
+
+    def __init__(self, *, mailbox: str = "INBOX", idle_seconds: float = IDLE_SECONDS,
+                 config: Optional[dict] = None,
+                 on_sync: Optional[Callable[[dict], None]] = None):
+        self.mailbox = mailbox
+        self.idle_seconds = idle_seconds
+        self.config = config or mail_sync.imap_config()
+        self.on_sync = on_sync
+        self.connects = 0          # сколько раз подключались (для статистики/тестов)
+
+    def _backoff(self, failures: int) -> float:
+        return min(BACKOFF_BASE * (2 ** max(failures - 1, 0)), BACKOFF_MAX)
+
+    def _session(self, stop: threading.Event) -> None:
+        conn = mail_sync.connect(self.config)
+        self.connects += 1
+        try:
+            sync = mail_sync.MailboxSync(conn, account=self.config["user"], mailbox=self.mailbox)
+            can_idle = "IDLE" in getattr(conn, "capabilities", ())
+            while not stop.is_set():
+                close_old_connections()   # демон живёт долго — не держим протухшее соединение с БД
+                stats = sync.run()
+                if stats["created"]:
+                    log.info("watch_inbox: %s new in %s", stats["created"], self.mailbox)
+                if self.on_sync:
+                    self.on_sync(stats)
+                if can_idle:
+                    idle(conn, self.idle_seconds, stop=stop)
+                else:
+                    stop.wait(self.idle_seconds)
+                    conn.noop()
+        finally:
+            try:
+                conn.logout()
+            except Exception:
+                pass
+
+    def serve(self, *, stop: Optional[threading.Event] = None) -> None:
+        stop = stop or threading.Event()
+        failures = 0
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                self._session(stop)
+            except Exception as e:
+                # сессия проработала долго — это обычный обрыв, а не серия отказов
+                failures = 1 if time.monotonic() - started > BACKOFF_MAX else failures + 1
+                delay = self._backoff(failures)
+                if isinstance(e, (imaplib.IMAP4.error, OSError)):
+                    log.warning("watch_inbox: %s (%s), reconnect in %.0fs", e.__class__.__name__, e, delay)
+                else:
+                    # ошибка БД, разбора письма, on_sync — демон не должен молча умереть
+                    log.exception("watch_inbox: unexpected error, reconnect in %.0fs", delay)
+                    close_old_connections()
+                stop.wait(delay)
+
+
+# ---------------------------------------------------------------------------
+# IMAP-сервер для тестов
+
+class _FakeImapHandler(socketserver.StreamRequestHandler):
+    def send_line(self, data):
+        self.wfile.write(data.encode() if isinstance(data, str) else data)
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            self._serve_commands()
+        except OSError:
+            pass    # клиент оборвал соединение (или drop_connections)
+
+    def _serve_commands(self):
+        box: FakeImapServer = self.server
+        self.send_line("* OK fake IMAP ready\r\n")
+        reported = 0        # сколько писем клиент уже видел (EXISTS)
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode().rstrip("\r\n")
+            box.commands.append(line)
+            tag, _, rest = line.partition(" ")
+            cmd, _, args = rest.partition(" ")
+            cmd = cmd.upper()
+            if cmd == "CAPABILITY":
+                self.send_line(f"* CAPABILITY IMAP4rev1 {'IDLE' if box.supports_idle else ''}\r\n{tag} OK done\r\n")
+            elif cmd == "LOGIN":
+                self.send_line(f"{tag} OK logged in\r\n")
+            elif cmd in ("SELECT", "EXAMINE"):
+                count, uidnext = box.counters()
+                reported = count
+                self.send_line(
+                    f"* {count} EXISTS\r\n* OK [UIDVALIDITY {box.uidvalidity}] ok\r\n"
+                    f"* OK [UIDNEXT {uidnext}] ok\r\n{tag} OK [READ-ONLY] done\r\n"
+                )
+            elif cmd == "NOOP":
+                self.send_line(f"{tag} OK noop\r\n")
+            elif cmd == "IDLE":
+                count, _ = box.counters()
+                # как настоящие серверы: о письмах, пришедших до IDLE, — сразу, тем же пакетом
+                self.send_line("+ idling\r\n" + (f"* {count} EXISTS\r\n" if count > reported else ""))
+                reported = count
+                with box.lock:
+                    box.idlers.append(self)
+                try:
+                    self.rfile.readline()      # DONE
+                finally:
+                    with box.lock:
+                        box.idlers.remove(self)
+                self.send_line(f"{tag} OK idle done\r\n")
+            elif cmd == "LOGOUT":
+                self.send_line(f"* BYE\r\n{tag} OK bye\r\n")
+                return
+            elif cmd == "UID":
+                self._uid(tag, args, box)
+            else:
+                self.send_line(f"{tag} BAD unknown command\r\n")
+
+    def _uid(self, tag: str, args: str, box: "FakeImapServer"):
+        sub, _, rest = args.partition(" ")
+        messages = box.snapshot()
+        uids = sorted(messages)
+        if sub.upper() == "SEARCH":
+            tokens = rest.split()
+            found = _uid_range(tokens[1], uids) if len(tokens) > 1 and tokens[0].upper() == "UID" else uids
+            self.send_line(f"* SEARCH {' '.join(map(str, found))}\r\n{tag} OK search done\r\n")
+        elif sub.upper() == "FETCH":
+            spec, _, items = rest.partition(" ")
+            fields = re.search(r"HEADER\.FIELDS \(([^)]*)\)", items)
+            for uid in _uid_range(spec, uids):
+                raw = messages[uid]
+                if fields:
+                    wanted = set(fields.group(1).upper().split())
+                    msg = email.message_from_bytes(raw)
+                    literal = b"".join(f"{k}: {v}\r\n".encode() for k, v in msg.items() if k.upper() in wanted) + b"\r\n"
+                    name = f"BODY[HEADER.FIELDS ({fields.group(1)})]"
+                else:
+                    literal, name = raw, "BODY[]"
+                head = f"* {uids.index(uid) + 1} FETCH (UID {uid} RFC822.SIZE {len(raw)} {name} {{{len(literal)}}}\r\n"
+                self.send_line(head.encode() + literal + b")\r\n")
+            self.send_line(f"{tag} OK fetch done\r\n")
+        else:
+            self.send_line(f"{tag} BAD unsupported UID command\r\n")
+
+
+def _uid_range(spec: str, uids: List[int]) -> List[int]:
+    top = max(uids) if uids else 0
+    out = set()
+    for part in spec.split(","):
+        lo, _, hi = part.partition(":")
+        lo = top if lo == "*" else int(lo)
+        hi = lo if not hi else (top if hi == "*" else int(hi))
+        lo, hi = min(lo, hi), max(lo, hi)
+        out.update(u for u in uids if lo <= u <= hi)
+    return sorted(out)
+
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    """
+    IMAP в памяти на 127.0.0.1: SELECT/EXAMINE, UID SEARCH/FETCH, IDLE, NOOP.
+    deliver(raw) кладёт письмо и будит всех, кто в IDLE.
+    config — словарь для mail_sync.connect / IdleWatcher(config=...).
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *, uidvalidity: int = 1, supports_idle: bool = True):
+        super().__init__(("127.0.0.1", 0), _FakeImapHandler)
+        self.uidvalidity = uidvalidity
+        self.supports_idle = supports_idle
+        self.lock = threading.Lock()
+        self.messages: Dict[int, bytes] = {}
+        self.next_uid = 1
+        self.idlers: List[_FakeImapHandler] = []
+        self.commands: List[str] = []
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def config(self) -> dict:
+        return {"host": "127.0.0.1", "port": self.server_address[1], "user": "fake", "password": "fake", "ssl": False}
+
+    def counters(self) -> Tuple[int, int]:
+        with self.lock:
+            return len(self.messages), self.next_uid
+
+    def snapshot(self) -> Dict[int, bytes]:
+        with self.lock:
+            return dict(self.messages)
+
+    def deliver(self, raw: bytes) -> int:
+        with self.lock:
+            uid = self.next_uid
+            self.messages[uid] = raw
+            self.next_uid += 1
+            count, idlers = len(self.messages), list(self.idlers)
+        for handler in idlers:
+            try:
+                handler.send_line(f"* {count} EXISTS\r\n")
+            except OSError:
+                pass
+        return uid
+
+    def drop_connections(self) -> None:
+        """Оборвать все IDLE-сессии (проверка переподключения)."""
+        with self.lock:
+            idlers = list(self.idlers)
+        for handler in idlers:
+            try:
+                handler.connection.shutdown(2)
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        self.shutdown()
+        self.server_close()
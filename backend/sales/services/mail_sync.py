@@ -0,0 +1,341 @@
+# sales/services/mail_sync.py
+"""
+Инкрементальная синхронизация входящих писем по IMAP UID.
+
+Раньше fetch_gmail искал UNSEEN, тянул полный RFC822 по одному письму,
+проверял exists() на каждое и полагался на флаг \\Seen (его меняет любой,
+кто открыл письмо в Gmail). Теперь:
+  * на ящик хранится курсор MailboxSyncState (UIDVALIDITY + следующий UID);
+  * новые UID забираются диапазонами по batch_size — сначала только
+    заголовки (BODY.PEEK, флаги не трогаем), тело — только для писем,
+    которых ещё нет в БД;
+  * дубликаты отсекаются по заранее загруженному множеству uid,
+    вставка — bulk_create пачками; курсор двигается в той же транзакции.
+
+uid в InboundEmail хранится как "<mailbox>:<uidvalidity>:<uid>": после
+перенумерации ящика сервером старые и новые письма не пересекаются.
+"""
+from __future__ import annotations
+
+import email
+import email.utils
+import imaplib
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+from django.utils.timezone import make_aware
+
+from sales.models import InboundEmail, MailboxSyncState
+from sales.services import inbound_search, raw_mail
+from sales.services.raw_mail import decode_header_value
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, "IMAP_SYNC_BATCH_SIZE", 200)
+INSERT_CHUNK = getattr(settings, "IMAP_SYNC_INSERT_CHUNK", 500)
+MAX_BODY_BYTES = getattr(settings, "IMAP_SYNC_MAX_BODY_BYTES", 10 * 1024 * 1024)
+INITIAL_DAYS = getattr(settings, "IMAP_SYNC_INITIAL_DAYS", 30)   # первая синхронизация: за сколько дней брать
+
+HEADER_FIELDS = "MESSAGE-ID SUBJECT FROM TO DATE IN-REPLY-TO REFERENCES"
+
+_UID_RE = re.compile(rb"UID (\d+)")
+_SIZE_RE = re.compile(rb"RFC822\.SIZE (\d+)")
+
+
+# ---------------------------------------------------------------------------
+# Соединение
+
+def imap_config() -> dict:
+    return {
+        "host": os.environ.get("IMAP_HOST", "imap.gmail.com"),
+        "port": int(os.environ.get("IMAP_PORT", "993")),
+        "user": os.environ.get("IMAP_USERNAME") or "",
+        "password": os.environ.get("IMAP_PASSWORD") or "",
+        "ssl": os.environ.get("IMAP_USE_SSL", "true").lower() == "true",
+    }
+
+
+def connect(cfg: Optional[dict] = None, *, timeout: Optional[float] = 60) -> imaplib.IMAP4:
+    cfg = cfg or imap_config()
+    cls = imaplib.IMAP4_SSL if cfg["ssl"] else imaplib.IMAP4
+    conn = cls(cfg["host"], cfg["port"], timeout=timeout)
+    conn.login(cfg["user"], cfg["password"])
+    return conn
+
+
+def _quote(mailbox: str) -> str:
+    return '"' + mailbox.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def uid_set(uids: Iterable[int]) -> str:
+    """[1,2,3,7,9,10] → "1:3,7,9:10" — компактный UID-set для FETCH."""
+    out, run = [], []
+    for u in sorted(set(uids)):
+        if run and u == run[-1] + 1:
+            run.append(u)
+            continue
+        if run:
+            out.append(f"{run[0]}:{run[-1]}" if len(run) > 1 else str(run[0]))
+        run = [u]
+    if run:
+        out.append(f"{run[0]}:{run[-1]}" if len(run) > 1 else str(run[0]))
+    return ",".join(out)
+
+
+def _parse_fetch(data) -> Dict[int, Tuple[int, bytes]]:
+    """
+    Ответ imaplib на UID FETCH → {uid: (RFC822.SIZE, literal)}.
+    UID может прийти и до литерала, и после него (отдельной строкой).
+    """
+    out: Dict[int, Tuple[int, bytes]] = {}
+    items = list(data or [])
+    for i, item in enumerate(items):
+        if not isinstance(item, tuple):
+            continue
+        meta = item[0] or b""
+        if i + 1 < len(items) and isinstance(items[i + 1], bytes):
+            meta += b" " + items[i + 1]
+        m = _UID_RE.search(meta)
+        if not m:
+            continue
+        size = _SIZE_RE.search(meta)
+        out[int(m.group(1))] = (int(size.group(1)) if size else 0, item[1] or b"")
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Разбор писем
+
+def _parse_date(value):
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+        if dt and dt.tzinfo is None:
+            dt = make_aware(dt)
+        return dt
+    except Exception:
+        return datetime.now(dt_timezone.utc)
+
+
+def build_inbound(uid_key: str, header_bytes: bytes, raw: Optional[bytes]) -> InboundEmail:
+    """
+    Строка InboundEmail (только сводные колонки) + сырое письмо в raw_mail.
+    Без тела (raw=None) сохраняются только заголовки.
+    """
+    parsed = raw_mail.parse_bytes(raw if raw is not None else header_bytes)
+    msg = parsed.message
+    text, html = (parsed.text, parsed.html) if raw is not None else ("", "")
+    message_id = (msg.get("Message-ID") or "").strip()[:255]
+    blob = raw if raw is not None else header_bytes
+    e = InboundEmail(
+        uid=uid_key,
+        message_id=message_id or None,
+        subject=decode_header_value(msg.get("Subject"))[:512],
+        from_email=decode_header_value(msg.get("From"))[:255],
+        to_email=decode_header_value(msg.get("To"))[:255],
+        date=_parse_date(msg.get("Date")),
+        snippet=re.sub(r"\s+", " ", text or html).strip()[:400],
+        in_reply_to=(msg.get("In-Reply-To") or "").strip()[:255],
+        references=" ".join((msg.get("References") or "").split()),
+        raw_key=raw_mail.store(blob, message_id, headers_only=raw is None),
+        raw_size=len(blob),
+    )
+    # уже разобрано — индексу поиска и матчеру не нужно читать хранилище
+    e._parsed = raw_mail.Parsed(msg, text, html)
+    return e
+
+
+# ---------------------------------------------------------------------------
+# Синхронизация
+
+def _default_want_body(size: int, header_bytes: bytes) -> bool:
+    return not MAX_BODY_BYTES or size <= MAX_BODY_BYTES
+
+
+class MailboxSync:
+    """
+    Одна синхронизация ящика поверх уже залогиненного соединения.
+    want_body(size, header_bytes) решает, качать ли тело нового письма
+    (по умолчанию — всё, что не больше IMAP_SYNC_MAX_BODY_BYTES).
+    """
+
+    def __init__(self, conn: imaplib.IMAP4, *, account: str = "", mailbox: str = "INBOX",
+                 batch_size: int = BATCH_SIZE, initial_days: Optional[int] = INITIAL_DAYS,
+                 want_body: Callable[[int, bytes], bool] = _default_want_body):
+        self.conn = conn
+        self.account = account
+        self.mailbox = mailbox
+        self.batch_size = max(1, int(batch_size))
+        self.initial_days = initial_days
+        self.want_body = want_body
+
+    # --- IMAP -------------------------------------------------------------
+
+    def _check(self, typ, data, what: str):
+        if typ != "OK":
+            raise imaplib.IMAP4.error(f"{what} failed: {data!r}")
+        return data
+
+    def select(self) -> Tuple[int, Optional[int]]:
+        """SELECT (read-only) → (UIDVALIDITY, UIDNEXT или None, если сервер не сообщил)."""
+        self._check(*self.conn.select(_quote(self.mailbox), readonly=True), f"SELECT {self.mailbox}")
+        _, validity = self.conn.response("UIDVALIDITY")
+        _, uidnext = self.conn.response("UIDNEXT")
+        validity = int(validity[-1]) if validity and validity[-1] else 0
+        uidnext = int(uidnext[-1]) if uidnext and uidnext[-1] else None
+        return validity, uidnext
+
+    def _search_uids(self, *criteria: str) -> List[int]:
+        data = self._check(*self.conn.uid("SEARCH", None, *criteria), "UID SEARCH")
+        return [int(x) for x in (data[0] or b"").split()]
+
+    def _initial_uid(self) -> int:
+        if not self.initial_days:
+            return 1
+        since = (timezone.now() - timedelta(days=self.initial_days)).strftime("%d-%b-%Y")
+        uids = self._search_uids("SINCE", since)
+        return min(uids) if uids else 1
+
+    def _server_uidnext(self, reported: Optional[int], start: int) -> int:
+        if reported:
+            return reported
+        # нет UIDNEXT в ответе SELECT — ищем последний UID; "n:*" всегда возвращает хотя бы последний
+        uids = [u for u in self._search_uids("UID", f"{start}:*") if u >= start]
+        return (max(uids) + 1) if uids else start
+
+    def fetch_headers(self, lo: int, hi: int) -> Dict[int, Tuple[int, bytes]]:
+        data = self._check(
+            *self.conn.uid("FETCH", f"{lo}:{hi}", f"(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])"),
+            "UID FETCH headers",
+        )
+        # сервер может вернуть UID вне диапазона (например, для "n:*") — отбрасываем
+        return {u: v for u, v in _parse_fetch(data).items() if lo <= u <= hi}
+
+    def fetch_bodies(self, uids: List[int]) -> Dict[int, bytes]:
+        if not uids:
+            return {}
+        data = self._check(*self.conn.uid("FETCH", uid_set(uids), "(UID BODY.PEEK[])"), "UID FETCH bodies")
+        return {u: raw for u, (_, raw) in _parse_fetch(data).items()}
+
+    # --- БД ---------------------------------------------------------------
+
+    def uid_key(self, validity: int, uid: int) -> str:
+        return f"{self.mailbox}:{validity}:{uid}"
+
+    def known_uids(self, validity: int) -> Set[int]:
+        """UID этого ящика/UIDVALIDITY, уже лежащие в БД — один запрос на всю синхронизацию."""
+        prefix = f"{self.mailbox}:{validity}:"
+        known = {
+            int(k[len(prefix):])
+            for k in InboundEmail.objects.filter(uid__startswith=prefix).values_list("uid", flat=True)
+            if k[len(prefix):].isdigit()
+        }
+        return known
+
+    def adopt_legacy(self, validity: int) -> int:
+        """
+        Письма старого fetch_gmail (uid без префикса) — это INBOX с текущим
+        UIDVALIDITY. Переименовываются в "INBOX:<validity>:<uid>" один раз,
+        при первой синхронизации ящика: после смены UIDVALIDITY старый номер
+        уже ничего не значит, и новое письмо с тем же UID пропало бы.
+        """
+        if self.mailbox != "INBOX":
+            return 0
+        return InboundEmail.objects.filter(uid__regex=r"^[0-9]+$").update(
+            uid=Concat(Value(f"{self.mailbox}:{validity}:"), F("uid")),
+        )
+
+    def _insert(self, rows: List[InboundEmail]) -> List[InboundEmail]:
+        """Вставить новые строки; возвращает только реально вставленные (уже лежащие в БД пропускаются)."""
+        created: List[InboundEmail] = []
+        for i in range(0, len(rows), INSERT_CHUNK):
+            chunk = rows[i:i + INSERT_CHUNK]
+            existing = set(InboundEmail.objects.filter(uid__in=[r.uid for r in chunk]).values_list("uid", flat=True))
+            fresh = [r for r in chunk if r.uid not in existing]
+            if not fresh:
+                continue
+            # ignore_conflicts — на случай параллельной синхронизации того же ящика
+            InboundEmail.objects.bulk_create(fresh, ignore_conflicts=True)
+            # bulk_create не шлёт сигналов (и с ignore_conflicts не возвращает pk) — индексируем сами,
+            # из уже разобранных объектов, без повторного чтения писем из хранилища
+            pks = dict(InboundEmail.objects.filter(uid__in=[r.uid for r in fresh]).values_list("uid", "pk"))
+            for r in fresh:
+                r.pk = pks.get(r.uid)
+            fresh = [r for r in fresh if r.pk is not None]
+            inbound_search.index_emails(fresh)
+            created += fresh
+        return created
+
+    # --- основной цикл ----------------------------------------------------
+
+    def run(self, *, reset: bool = False) -> Dict[str, object]:
+        """
+        Забрать всё новое с момента прошлой синхронизации.
+        Возвращает {"fetched", "created", "batches", "uids": [uid_key новых писем]}.
+        """
+        stats: Dict[str, object] = {"fetched": 0, "created": 0, "batches": 0, "uids": []}
+        validity, reported_next = self.select()
+
+        state, _ = MailboxSyncState.objects.get_or_create(account=self.account, mailbox=self.mailbox)
+        if not state.uidvalidity:
+            adopted = self.adopt_legacy(validity)
+            if adopted:
+                log.info("mail_sync: %s legacy uids moved under UIDVALIDITY %s", adopted, validity)
+        if reset or state.uidvalidity != validity:
+            if state.uidvalidity and state.uidvalidity != validity:
+                log.warning("mail_sync: %s UIDVALIDITY changed %s → %s, resyncing",
+                            self.mailbox, state.uidvalidity, validity)
+            state.uidvalidity = validity
+            state.uidnext = self._initial_uid()
+
+        server_next = self._server_uidnext(reported_next, state.uidnext)
+        known = self.known_uids(validity) if state.uidnext < server_next else set()
+
+        lo = state.uidnext
+        while lo < server_next:
+            hi = min(lo + self.batch_size - 1, server_next - 1)
+            headers = self.fetch_headers(lo, hi)
+            new = [u for u in sorted(headers) if u not in known]
+            bodies = self.fetch_bodies([u for u in new if self.want_body(*headers[u])])
+            rows = [build_inbound(self.uid_key(validity, u), headers[u][1], bodies.get(u)) for u in new]
+
+            with transaction.atomic():
+                created = self._insert(rows)
+                state.uidnext = hi + 1
+                state.last_synced_at = timezone.now()
+                state.save()
+
+            known.update(new)
+            stats["fetched"] += len(headers)
+            stats["batches"] += 1
+            stats["created"] += len(created)
+            stats["uids"] += [r.uid for r in created]
+            lo = hi + 1
+
+        if not stats["batches"]:
+            state.last_synced_at = timezone.now()
+            state.save()
+        return stats
+
+
+def sync_mailbox(*, mailbox: str = "INBOX", batch_size: int = BATCH_SIZE, reset: bool = False,
+                 conn: Optional[imaplib.IMAP4] = None) -> Dict[str, object]:
+    """Подключиться (если соединение не передано), синхронизировать ящик, отключиться."""
+    cfg = imap_config()
+    own = conn is None
+    conn = conn or connect(cfg)
+    try:
+        return MailboxSync(conn, account=cfg["user"], mailbox=mailbox, batch_size=batch_size).run(reset=reset)
+    finally:
+        if own:
+            try:
+                conn.logout()
+            except Exception:
+                pass
@@ -0,0 +1,231 @@
+# sales/services/outbox.py
+"""
+Надёжная отправка писем через таблицу OutboundEmail.
+
+API-вьюхи только ставят письма в очередь (в своей транзакции), а воркер
+`manage.py send_outbox` забирает пачку, открывает ОДНО SMTP-соединение
+на пачку, отправляет и помечает строки доставленными. Ошибки SMTP не
+теряют письма: строка уходит на повтор с экспоненциальной паузой.
+
+Аренда берётся на пачку, но перед каждым письмом продлевается условным
+update: если пачка шла дольше LEASE_SECONDS и строку уже забрал другой
+воркер, письмо пропускается, а не уходит второй раз.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, List
+
+from django.conf import settings
+from django.core.mail import get_connection, make_msgid
+from django.utils import timezone
+
+from sales.models import BookingSale, OutboundEmail
+from sales.services import emails
+
+log = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, "OUTBOX_MAX_ATTEMPTS", 8)
+BACKOFF_BASE = getattr(settings, "OUTBOX_BACKOFF_SECONDS", 30)         # 30s, 60s, 2m, 4m, ...
+BACKOFF_MAX = getattr(settings, "OUTBOX_BACKOFF_MAX_SECONDS", 3600)
+LEASE_SECONDS = getattr(settings, "OUTBOX_LEASE_SECONDS", 300)         # сколько строка «занята» воркером
+
+
+# ---------------------------------------------------------------------------
+# Постановка в очередь (вызывать внутри transaction.atomic вместе со сменой статуса)
+
+def queue_emails(kind: str, bookings: Iterable[BookingSale], **payload) -> List[OutboundEmail]:
+    rows = [OutboundEmail(kind=kind, booking=b, payload=dict(payload)) for b in bookings]
+    return OutboundEmail.objects.bulk_create(rows) if rows else []
+
+
+def queue_booking_email(booking: BookingSale) -> OutboundEmail:
+    return queue_emails("RESERVATION", [booking])[0]
+
+
+def queue_cancellation_email(booking: BookingSale, reason: str = "") -> OutboundEmail:
+    return queue_emails("CANCELLATION", [booking], reason=reason or "")[0]
+
+
+def make_batch_code() -> str:
+    from django.utils.crypto import get_random_string
+    return "B-" + get_random_string(8).upper()
+
+
+def queue_digest_emails(bookings: Iterable[BookingSale]) -> Dict[str, List[int]]:
+    """
+    Режим digest: группируем брони по компании и адресу партнёра
+    (company.email_for_orders, иначе общий фолбэк) и ставим ОДНО письмо на
+    группу. Компания — часть ключа: на общий фолбэк-адрес брони разных
+    компаний уходят разными письмами, шапка дайджеста берётся от своей.
+    Каждой группе присваивается batch_code. Группы из одной брони уходят
+    обычным письмом. Возвращает {batch_code: [booking_id, ...]}.
+    """
+    groups: Dict[tuple, List[BookingSale]] = {}
+    for b in bookings:
+        key = (b.company_id, *sorted(a.strip().lower() for a in emails._recipients_for(b)))
+        groups.setdefault(key, []).append(b)
+
+    rows, out = [], {}
+    for members in groups.values():
+        code = make_batch_code()
+        ids = [b.id for b in members]
+        out[code] = ids
+        BookingSale.objects.filter(id__in=ids).update(batch_code=code)
+        if len(members) == 1:
+            rows.append(OutboundEmail(kind="RESERVATION", booking=members[0], payload={"batch_code": code}))
+        else:
+            rows.append(OutboundEmail(kind="DIGEST", booking=members[0],
+                                      payload={"batch_code": code, "booking_ids": ids}))
+    if rows:
+        OutboundEmail.objects.bulk_create(rows)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Доставка
+
+def _digest_bookings(row: OutboundEmail) -> List[BookingSale]:
+    ids = [int(i) for i in (row.payload or {}).get("booking_ids") or []]
+    by_id = BookingSale.objects.select_related("company", "guide").in_bulk(ids)
+    return [by_id[i] for i in ids if i in by_id]
+
+def _build_message(row: OutboundEmail, contexts: emails.ContextBatch | None = None):
+    b = row.booking
+    if b is None:
+        raise ValueError("booking was deleted")
+    if row.kind == "RESERVATION":
+        return emails.build_booking_message(b, contexts=contexts)
+    if row.kind == "CANCELLATION":
+        return emails.build_cancellation_message(b, (row.payload or {}).get("reason", ""), contexts=contexts)
+    if row.kind == "DIGEST":
+        return emails.build_digest_message(_digest_bookings(row), (row.payload or {}).get("batch_code", ""))
+    raise ValueError(f"unknown kind {row.kind!r}")
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX))
+
+
+def _schedule_retry(row: OutboundEmail, error: Exception | str, now) -> str:
+    row.attempts += 1
+    row.last_error = str(error)[:2000]
+    if row.attempts >= MAX_ATTEMPTS:
+        row.status = "FAILED"
+        log.error("outbox: giving up on #%s (%s) after %s attempts: %s", row.id, row.kind, row.attempts, error)
+    else:
+        row.next_attempt_at = now + _backoff(row.attempts)
+        log.warning("outbox: #%s (%s) attempt %s failed: %s", row.id, row.kind, row.attempts, error)
+    row.save(update_fields=["attempts", "last_error", "status", "next_attempt_at"])
+    return "failed" if row.status == "FAILED" else "retried"
+
+
+def _claim(limit: int, now) -> List[OutboundEmail]:
+    """
+    Берём пачку готовых к отправке строк и «арендуем» их, сдвигая next_attempt_at.
+    Если воркер упадёт, аренда истечёт и строки вернутся в очередь.
+    """
+    candidates = list(
+        OutboundEmail.objects
+        .filter(status="PENDING", next_attempt_at__lte=now)
+        .order_by("next_attempt_at", "id")
+        .values_list("id", "next_attempt_at")[:limit]
+    )
+    lease_until = now + timedelta(seconds=LEASE_SECONDS)
+    claimed = [
+        pk for pk, nxt in candidates
+        if OutboundEmail.objects.filter(pk=pk, next_attempt_at=nxt).update(next_attempt_at=lease_until)
+    ]
+    if not claimed:
+        return []
+    return list(
+        OutboundEmail.objects
+        .filter(pk__in=claimed)
+        .select_related("booking", "booking__company", "booking__guide")
+        .order_by("id")
+    )
+
+
+def _renew(row: OutboundEmail) -> bool:
+    """Продлить аренду строки перед отправкой; False — строка уже не наша."""
+    lease_until = timezone.now() + timedelta(seconds=LEASE_SECONDS)
+    if not OutboundEmail.objects.filter(pk=row.pk, status="PENDING", next_attempt_at=row.next_attempt_at).update(
+        next_attempt_at=lease_until,
+    ):
+        return False
+    row.next_attempt_at = lease_until
+    return True
+
+
+def deliver_pending(*, limit: int = 50, connection=None) -> Dict[str, int]:
+    """
+    Одна итерация воркера: до `limit` писем через одно SMTP-соединение.
+    Возвращает счётчики {"sent", "retried", "failed", "skipped"}
+    (skipped — аренду строки за время пачки перехватил другой воркер).
+    """
+    stats = {"sent": 0, "retried": 0, "failed": 0, "skipped": 0}
+    now = timezone.now()
+    rows = _claim(limit, now)
+    if not rows:
+        return stats
+
+    conn = connection or get_connection(fail_silently=False)
+    try:
+        conn.open()
+    except Exception as e:
+        # SMTP недоступен — вся пачка уходит на повтор
+        for row in rows:
+            stats[_schedule_retry(row, e, now)] += 1
+        return stats
+
+    domain = getattr(settings, "OUTBOX_MESSAGE_ID_DOMAIN", None)
+    # контексты писем пачки строятся разом (общие запросы) — только если что-то не в кэше рендера
+    contexts = emails.ContextBatch(row.booking for row in rows if row.kind != "DIGEST")
+    try:
+        for row in rows:
+            if not _renew(row):
+                log.warning("outbox: #%s lease expired and was taken over, skipping", row.id)
+                stats["skipped"] += 1
+                continue
+            try:
+                msg = _build_message(row, contexts)
+                if msg is not None:
+                    msg.connection = conn
+                    msg.extra_headers.setdefault("Message-ID", make_msgid(domain=domain))
+                    msg.send(fail_silently=False)
+            except Exception as e:
+                stats[_schedule_retry(row, e, now)] += 1
+                continue
+
+            sent_at = timezone.now()
+            row.status = "SENT"
+            row.attempts += 1
+            row.sent_at = sent_at
+            row.last_error = "" if msg is not None else "no recipients"
+            if msg is not None:
+                row.to_email = ", ".join(msg.to)[:255]
+                row.subject = msg.subject[:512]
+                row.message_id = msg.extra_headers["Message-ID"][:255]
+            row.save(update_fields=["status", "attempts", "sent_at", "last_error", "to_email", "subject", "message_id"])
+
+            if row.kind in ("RESERVATION", "DIGEST") and msg is not None:
+                ids = (row.payload or {}).get("booking_ids") or [row.booking_id]
+                BookingSale.objects.filter(pk__in=ids).update(sent_at=sent_at, sent_to_email=msg.to[0])
+            stats["sent"] += 1
+    finally:
+        if connection is None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+    return stats
+
+
+def pending_count() -> int:
+    return OutboundEmail.objects.filter(status="PENDING").count()
+
+
+def retry_now(queryset) -> int:
+    """Вернуть строки в очередь немедленно (для админки)."""
+    return queryset.exclude(status="SENT").update(status="PENDING", next_attempt_at=timezone.now())
@@ -0,0 +1,119 @@
+# sales/services/pdf_assets.py
+"""
+url_fetcher для WeasyPrint без сетевых запросов.
+
+/static/... и /media/... читаются прямо с диска (STATIC_ROOT, STATICFILES_DIRS,
+static/ приложений, MEDIA_ROOT) и держатся в памяти процесса; data: URI
+разбираются локально; любые другие URL отклоняются. Раньше логотип
+запрашивался по HTTP у нашего же сервера — в однопоточном воркере это
+блокировало рендер на самом себе.
+"""
+from __future__ import annotations
+
+import mimetypes
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+
+# базовый URL для относительных ссылок в HTML билета; хост не важен — fetcher смотрит только на path
+ASSET_BASE_URL = getattr(settings, "PDF_ASSET_BASE_URL", "http://assets.local/")
+
+
+class AssetNotFound(ValueError):
+    pass
+
+
+class LocalAssetFetcher:
+    """
+    Вызываемый объект с сигнатурой url_fetcher(url) -> dict.
+    Хранит только пути, поэтому его можно передавать в другие процессы.
+    """
+
+    def __init__(self, mounts: List[Tuple[str, List[str]]]):
+        # [(url_prefix, [root_dir, ...]), ...]
+        self.mounts = [(prefix, [str(Path(r).resolve()) for r in roots]) for prefix, roots in mounts]
+        self._cache: Dict[str, Tuple[float, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"mounts": self.mounts}
+
+    def __setstate__(self, state):
+        self.mounts = state["mounts"]
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, path: str) -> str | None:
+        for prefix, roots in self.mounts:
+            if not path.startswith(prefix):
+                continue
+            rel = unquote(path[len(prefix):]).lstrip("/")
+            for root in roots:
+                full = os.path.realpath(os.path.join(root, rel))
+                # не выпускаем за пределы корня (../)
+                if full.startswith(root + os.sep) and os.path.isfile(full):
+                    return full
+        return None
+
+    def read(self, full: str) -> bytes:
+        mtime = os.stat(full).st_mtime
+        hit = self._cache.get(full)
+        if hit and hit[0] == mtime:
+            return hit[1]
+        with open(full, "rb") as f:
+            data = f.read()
+        with self._lock:
+            self._cache[full] = (mtime, data)
+        return data
+
+    def __call__(self, url: str, timeout=None, ssl_context=None) -> dict:
+        if url.startswith("data:"):
+            from weasyprint import default_url_fetcher
+            return default_url_fetcher(url)
+
+        parts = urlsplit(url)
+        if parts.scheme == "file":
+            raise AssetNotFound(f"file URLs are not allowed in tickets: {url}")
+        full = self._resolve(parts.path)
+        if not full:
+            raise AssetNotFound(f"asset not found locally (network disabled): {url}")
+        return {
+            "string": self.read(full),
+            "mime_type": mimetypes.guess_type(full)[0] or "application/octet-stream",
+            "redirected_url": url,
+            "filename": os.path.basename(full),
+        }
+
+
+def _static_roots() -> List[str]:
+    roots = []
+    if getattr(settings, "STATIC_ROOT", None):
+        roots.append(str(settings.STATIC_ROOT))
+    for entry in getattr(settings, "STATICFILES_DIRS", []):
+        # допускаем форму (prefix, path) — prefix здесь не поддерживаем, берём путь
+        roots.append(str(entry[1] if isinstance(entry, (list, tuple)) else entry))
+    from django.apps import apps
+    for app in apps.get_app_configs():
+        roots.append(os.path.join(app.path, "static"))
+    return [r for r in roots if os.path.isdir(r)]
+
+
+_fetcher: LocalAssetFetcher | None = None
+
+
+def get_url_fetcher() -> LocalAssetFetcher:
+    """Общий на процесс fetcher (кэш ассетов живёт вместе с ним)."""
+    global _fetcher
+    if _fetcher is None:
+        mounts = []
+        if settings.STATIC_URL:
+            mounts.append((urlsplit(settings.STATIC_URL).path, _static_roots()))
+        if getattr(settings, "MEDIA_URL", None) and getattr(settings, "MEDIA_ROOT", None):
+            mounts.append((urlsplit(settings.MEDIA_URL).path, [str(settings.MEDIA_ROOT)]))
+        _fetcher = LocalAssetFetcher(mounts)
+    return _fetcher
+
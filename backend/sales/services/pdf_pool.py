@@ -0,0 +1,254 @@
+# sales/services/pdf_pool.py
+"""
+Пул процессов для рендера PDF (WeasyPrint).
+
+WeasyPrint грузит CPU и держит GIL, поэтому рендер в потоке веб-воркера
+тормозит все остальные запросы этого воркера. Здесь HTML уходит в
+отдельные процессы: каждый при старте импортирует WeasyPrint, поднимает
+fontconfig пробным рендером со стилями билета (_ticket_style.html) и держит
+url_fetcher с кэшем ассетов (логотип). wsgi.py поднимает пул в фоне при
+старте веб-воркера (warm_in_background) — первый билет не ждёт WeasyPrint.
+
+По умолчанию воркеров — половина ядер (settings.PDF_RENDER_WORKERS);
+0 — рендер прямо в процессе Django (как раньше, для dev).
+Очередь ограничена PDF_RENDER_QUEUE_LIMIT: сверх лимита — RenderBusy (→ 503),
+ожидание дольше PDF_RENDER_TIMEOUT — RenderTimeout. Тот же срок уходит
+в процесс вместе с задачей: задача, чей вызывающий уже не ждёт, не
+рендерится, а затянувшийся рендер прерывается таймером (SIGALRM) —
+воркер освобождается для следующих билетов, а не дорабатывает впустую.
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from sales.services import pdf_assets
+
+log = logging.getLogger(__name__)
+
+WORKERS = getattr(settings, "PDF_RENDER_WORKERS", 0)
+QUEUE_LIMIT = getattr(settings, "PDF_RENDER_QUEUE_LIMIT", 16)   # ждущих задач сверх занятых воркеров
+TIMEOUT = getattr(settings, "PDF_RENDER_TIMEOUT", 20)           # секунд на одну задачу
+
+
+class RenderBusy(RuntimeError):
+    """Очередь рендера переполнена."""
+
+
+class RenderTimeout(RuntimeError):
+    """Рендер не уложился в PDF_RENDER_TIMEOUT."""
+
+
+# ---------------------------------------------------------------------------
+# Код, который выполняется внутри процессов пула
+
+_WARM_HTML = (
+    "<html><head><style>@page{size:72mm 100mm;margin:6mm}"
+    "body{font-family:'DejaVu Sans',sans-serif}.m{font-family:'DejaVu Sans Mono',monospace}</style></head>"
+    "<body><h1>Warm</h1><b>bold</b> <i>italic</i> <span class='m'>0123</span></body></html>"
+)
+
+_worker_state: dict = {}
+_weasy_ready = False
+
+
+def load_weasyprint():
+    """
+    Импорт WeasyPrint по первому требованию (не при старте воркера Django)
+    + совместимость со старым pydyf, чей PDF() не принимает аргументов.
+    """
+    global _weasy_ready
+    if not _weasy_ready:
+        import inspect
+        import pydyf
+
+        if len(inspect.signature(pydyf.PDF.__init__).parameters) == 1:  # только (self)
+            _orig_init = pydyf.PDF.__init__
+
+            def _patched_init(self, version='1.7', identifier=None, *args, **kwargs):
+                # старый pydyf не ждет аргументы -> просто вызываем оригинал
+                _orig_init(self)
+                # WeasyPrint ожидает, что у PDF есть .version (bytes) и .identifier
+                try:
+                    self.version = (
+                        version if isinstance(version, (bytes, bytearray))
+                        else str(version).encode('ascii')
+                    )
+                except Exception:
+                    self.version = b'1.7'
+                self.identifier = identifier
+
+            pydyf.PDF.__init__ = _patched_init
+        _weasy_ready = True
+
+    from weasyprint import HTML
+    return HTML
+
+
+def _init_worker(fetcher, base_url: str, warm_html: str = _WARM_HTML) -> None:
+    HTML = load_weasyprint()
+
+    _worker_state["fetcher"] = fetcher
+    _worker_state["base_url"] = base_url
+    try:
+        # первый рендер поднимает шрифты/pango и разбирает CSS билета; логотип сразу попадает в кэш fetcher-а
+        HTML(string=warm_html + '<img src="/static/sales/logo.png">', base_url=base_url,
+             url_fetcher=fetcher).write_pdf()
+    except Exception:
+        pass
+
+
+def _expired(signum, frame):
+    raise RenderTimeout("PDF render deadline exceeded in worker")
+
+
+@contextmanager
+def _deadline(deadline: float | None):
+    """Прервать блок по сроку deadline (time.time()); в процессе пула — главный поток, сигналы доступны."""
+    if deadline is None or not hasattr(signal, "setitimer"):
+        yield
+        return
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise RenderTimeout("PDF render deadline passed while queued")
+    previous = signal.signal(signal.SIGALRM, _expired)
+    signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _render_in_worker(html: str, deadline: float | None = None) -> bytes:
+    HTML = load_weasyprint()
+
+    with _deadline(deadline):
+        return HTML(
+            string=html,
+            base_url=_worker_state["base_url"],
+            url_fetcher=_worker_state["fetcher"],
+        ).write_pdf()
+
+
+def render_inline(html: str) -> bytes:
+    HTML = load_weasyprint()
+
+    return HTML(
+        string=html,
+        base_url=pdf_assets.ASSET_BASE_URL,
+        url_fetcher=pdf_assets.get_url_fetcher(),
+    ).write_pdf()
+
+
+# ---------------------------------------------------------------------------
+# Сторона Django
+
+_pool: ProcessPoolExecutor | None = None
+_pool_pid: int | None = None
+_slots: threading.BoundedSemaphore | None = None
+_pool_lock = threading.Lock()
+
+
+def _warm_html() -> str:
+    """Пробный документ со стилями настоящего билета (рендерится шаблоном в процессе Django)."""
+    from django.template.loader import render_to_string
+
+    try:
+        style = render_to_string("sales/_ticket_style.html", {"page_h_mm": 100})
+    except Exception:
+        return _WARM_HTML
+    return f"<html><head>{style}</head><body><div class='ticket'><h1>Warm</h1>{_WARM_HTML}</div></body></html>"
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool, _pool_pid, _slots
+    with _pool_lock:
+        if _pool is not None and _pool_pid != os.getpid():
+            # пул создан до fork (gunicorn --preload): его процессы и потоки принадлежат родителю
+            _pool = None
+        if _pool is None:
+            # spawn: не форкаем веб-процесс с его потоками и открытыми соединениями
+            ctx = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(
+                max_workers=WORKERS,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(pdf_assets.get_url_fetcher(), pdf_assets.ASSET_BASE_URL, _warm_html()),
+            )
+            _pool_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(WORKERS + QUEUE_LIMIT)
+        return _pool
+
+
+def _reset_pool() -> None:
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool, _slots = None, None
+
+
+def warm() -> None:
+    """
+    Поднять процессы заранее (например, из post_worker_init gunicorn),
+    чтобы первый билет не ждал старта WeasyPrint.
+    """
+    if WORKERS <= 0:
+        return
+    pool = _get_pool()
+    for f in [pool.submit(len, "") for _ in range(WORKERS)]:
+        f.result()
+
+
+def warm_in_background() -> None:
+    """warm() в фоновом потоке: старт веб-воркера не ждёт запуска процессов."""
+    def run():
+        try:
+            warm()
+        except Exception:
+            log.exception("pdf_pool: warm-up failed, workers will start on first render")
+
+    if WORKERS > 0:
+        threading.Thread(target=run, name="pdf-pool-warm", daemon=True).start()
+
+
+def render(html: str, *, timeout: float | None = None) -> bytes:
+    """HTML → PDF bytes через пул (или inline при PDF_RENDER_WORKERS = 0)."""
+    if WORKERS <= 0:
+        return render_inline(html)
+
+    timeout = timeout or TIMEOUT
+    pool = _get_pool()
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        raise RenderBusy("PDF render queue is full")
+    try:
+        future = pool.submit(_render_in_worker, html, time.time() + timeout)
+    except BrokenProcessPool:
+        slots.release()
+        _reset_pool()
+        raise
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _f: slots.release())
+
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        future.cancel()     # ещё в очереди — не начнётся; уже в воркере — его прервёт _deadline
+        raise RenderTimeout(f"PDF render took longer than {timeout}s")
+    except BrokenProcessPool:
+        log.error("pdf_pool: worker died, recreating pool")
+        _reset_pool()
+        raise
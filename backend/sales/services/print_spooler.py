@@ -0,0 +1,225 @@
+# sales/services/print_spooler.py
+"""
+Спулер печати для мобильных Zebra (iMZ320) по последовательному порту / Bluetooth SPP.
+
+Скрипты из zebra/ на каждое задание открывают порт, пишут и закрывают его
+с фиксированным sleep. Здесь API только ставит PrintJob в очередь, а демон
+`manage.py print_spooler` держит порт открытым, забирает все готовые задания
+принтера и отправляет их за одну сессию (10 билетов семьи — одна сессия).
+Каждое задание пишется отдельно и отмечается напечатанным сразу после своей
+записи: если порт отвалился посреди пачки, на повтор уходят только
+неотправленные билеты, а уже напечатанные второй раз не выйдут.
+Перед первой записью после простоя принтер «будится» CRLF и короткой паузой;
+ошибка порта закрывает его, задания уходят на повтор с экспоненциальной паузой.
+
+FakePrinter — принтер на псевдотерминале (pty) для проверки без железа.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from sales.models import BookingSale, PrintJob
+from sales.services import thermal
+
+log = logging.getLogger(__name__)
+
+PORT = getattr(settings, "PRINT_SPOOLER_PORT", "")
+BAUD = getattr(settings, "PRINT_SPOOLER_BAUD", 19200)
+MAX_ATTEMPTS = getattr(settings, "PRINT_SPOOLER_MAX_ATTEMPTS", 10)
+BACKOFF_BASE = getattr(settings, "PRINT_SPOOLER_BACKOFF_SECONDS", 5)
+BACKOFF_MAX = getattr(settings, "PRINT_SPOOLER_BACKOFF_MAX_SECONDS", 300)
+LEASE_SECONDS = 120
+WAKE_IDLE_SECONDS = 30      # после такого простоя принтер мог уснуть — будим
+WAKE_PAUSE = 0.15           # как в zebra/test_cpcl_strict.py
+
+
+# ---------------------------------------------------------------------------
+# Постановка в очередь (из API)
+
+def queue_tickets(bookings: Iterable[BookingSale], *, fmt: str = "cpcl", printer: str = "default") -> List[PrintJob]:
+    if fmt not in thermal.RENDERERS:
+        raise ValueError(f"unknown format {fmt!r}")
+    rows = [
+        PrintJob(booking=b, printer=printer, fmt=fmt, payload=thermal.render_booking(b, fmt))
+        for b in bookings
+    ]
+    return PrintJob.objects.bulk_create(rows) if rows else []
+
+
+# ---------------------------------------------------------------------------
+# Порт
+
+class SerialPrinter:
+    """Долгоживущее соединение с принтером; открывается лениво и после ошибок."""
+
+    def __init__(self, port: str, baud: int = BAUD, *, write_timeout: float = 5.0):
+        self.port = port
+        self.baud = baud
+        self.write_timeout = write_timeout
+        self._serial = None
+        self._last_write = 0.0
+        self.sessions = 0           # сколько раз порт открывался (для статистики/тестов)
+
+    def open(self):
+        if self._serial is None:
+            import serial   # pyserial — нужен только демону печати
+
+            self._serial = serial.Serial(
+                self.port, baudrate=self.baud, timeout=1, write_timeout=self.write_timeout,
+                rtscts=False, dsrdtr=False, xonxoff=False,
+            )
+            self._last_write = 0.0
+            self.sessions += 1
+        return self._serial
+
+    def close(self):
+        if self._serial is not None:
+            try:
+                self._serial.close()
+            except Exception:
+                pass
+            self._serial = None
+
+    def wake(self):
+        s = self.open()
+        s.write(b"\r\n")
+        s.flush()
+        time.sleep(WAKE_PAUSE)
+
+    def write(self, data: bytes):
+        s = self.open()
+        if time.monotonic() - self._last_write > WAKE_IDLE_SECONDS:
+            self.wake()
+        s.write(data)
+        s.flush()
+        self._last_write = time.monotonic()
+
+
+# ---------------------------------------------------------------------------
+# Спулер
+
+def _claim(printer: str, limit: int, now) -> List[PrintJob]:
+    """Аренда пачки заданий, как в outbox: сдвигаем next_attempt_at условным update."""
+    candidates = list(
+        PrintJob.objects
+        .filter(printer=printer, status="PENDING", next_attempt_at__lte=now)
+        .order_by("id")
+        .values_list("id", "next_attempt_at")[:limit]
+    )
+    lease_until = now + timedelta(seconds=LEASE_SECONDS)
+    claimed = [
+        pk for pk, nxt in candidates
+        if PrintJob.objects.filter(pk=pk, next_attempt_at=nxt).update(next_attempt_at=lease_until)
+    ]
+    return list(PrintJob.objects.filter(pk__in=claimed).order_by("id")) if claimed else []
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX))
+
+
+class Spooler:
+    def __init__(self, device: SerialPrinter, *, printer: str = "default", batch_size: int = 20):
+        self.device = device
+        self.printer = printer
+        self.batch_size = batch_size
+
+    def run_once(self) -> Dict[str, int]:
+        """Одна итерация: все готовые задания принтера за одну сессию порта."""
+        stats = {"printed": 0, "retried": 0, "failed": 0}
+        now = timezone.now()
+        jobs = _claim(self.printer, self.batch_size, now)
+        if not jobs:
+            return stats
+
+        for i, job in enumerate(jobs):
+            try:
+                self.device.write(bytes(job.payload))
+            except Exception as e:
+                self._retry(jobs[i:], e, now, stats)
+                return stats
+            # отмечаем сразу: повтор пачки после обрыва не напечатает этот билет снова
+            PrintJob.objects.filter(pk=job.pk).update(
+                status="DONE", printed_at=timezone.now(), last_error="", attempts=F("attempts") + 1,
+            )
+            stats["printed"] += 1
+        return stats
+
+    def _retry(self, jobs: List[PrintJob], error: Exception, now, stats: Dict[str, int]) -> None:
+        # принтер выключен/вне зоны Bluetooth — закрываем порт, откроем заново при повторе
+        self.device.close()
+        for j in jobs:
+            j.attempts += 1
+            j.last_error = str(error)[:2000]
+            if j.attempts >= MAX_ATTEMPTS:
+                j.status = "FAILED"
+                stats["failed"] += 1
+            else:
+                j.next_attempt_at = now + _backoff(j.attempts)
+                stats["retried"] += 1
+            j.save(update_fields=["attempts", "last_error", "status", "next_attempt_at"])
+        log.warning("print_spooler: %s jobs not printed on %s: %s", len(jobs), self.printer, error)
+
+    def serve(self, *, interval: float = 1.0, stop: Optional[threading.Event] = None):
+        stop = stop or threading.Event()
+        try:
+            while not stop.is_set():
+                stats = self.run_once()
+                if not any(stats.values()):
+                    stop.wait(interval)
+        finally:
+            self.device.close()
+
+
+# ---------------------------------------------------------------------------
+# Фейковый принтер для тестов
+
+class FakePrinter:
+    """
+    Псевдотерминал: `port` открывается как обычный serial-порт,
+    всё записанное копится в `received`.
+    """
+
+    def __init__(self):
+        import tty
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self.received = bytearray()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._pump, daemon=True)
+        self._thread.start()
+
+    def _pump(self):
+        import select
+
+        while not self._stop.is_set():
+            r, _, _ = select.select([self._master], [], [], 0.05)
+            if r:
+                try:
+                    self.received += os.read(self._master, 65536)
+                except OSError:
+                    break
+
+    def jobs_printed(self) -> int:
+        data = bytes(self.received)
+        return data.count(b"\r\nPRINT\r\n") + data.count(b"^XZ")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
@@ -0,0 +1,68 @@
+# sales/services/qr.py
+"""
+Кэш QR-картинок (PNG) по (данные, размер).
+
+QR точки сбора одинаков для всех броней с одним пикапом, QR сайта — для
+повторных рендеров одной брони. Два уровня: LRU в памяти процесса и файлы
+в default_storage (qr/<hh>/<sha256>.png), общие для всех воркеров.
+Растровый QR нужен только PDF-билетам — они берут отсюда готовые
+байты/data: URI. Данные QR (сайт, точка сбора) у всех рендереров одни —
+tickets.ticket_fields, — но термопринтер рисует QR своей командой
+(BARCODE QR / ^BQ: сотня байт вместо картинки по Bluetooth), а письма
+партнёрам дают ссылку на карту: Gmail и Outlook режут data:-картинки.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+MEMORY_ITEMS = getattr(settings, "QR_CACHE_MEMORY_ITEMS", 512)
+CACHE_PREFIX = "qr"
+
+
+def _cache_name(data: str, size: int) -> str:
+    digest = hashlib.sha256(f"{size}|{data}".encode("utf-8")).hexdigest()
+    return f"{CACHE_PREFIX}/{digest[:2]}/{digest}.png"
+
+
+def _generate(data: str, size: int) -> bytes:
+    import qrcode
+    from PIL import Image
+
+    img = qrcode.make(data)              # PIL.Image
+    if size:
+        img = img.resize((size, size), Image.NEAREST)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@lru_cache(maxsize=MEMORY_ITEMS)
+def qr_png(data: str, size: int = 100) -> bytes:
+    """PNG QR-кода: память → диск → генерация (с сохранением на диск)."""
+    name = _cache_name(data, size)
+    try:
+        if default_storage.exists(name):
+            with default_storage.open(name, "rb") as f:
+                return f.read()
+    except Exception:
+        pass
+
+    png = _generate(data, size)
+    try:
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(png))
+    except Exception:
+        pass   # диск — только ускоритель
+    return png
+
+
+@lru_cache(maxsize=MEMORY_ITEMS)
+def qr_data_uri(data: str, size: int = 100) -> str:
+    return "data:image/png;base64," + base64.b64encode(qr_png(data, size)).decode("ascii")
@@ -0,0 +1,198 @@
+# sales/services/raw_mail.py
+"""
+Хранилище сырых входящих писем (RFC822).
+
+В таблице InboundEmail остаются только сводные колонки (тема, адреса,
+дата, сниппет, треды, привязка к брони) — по ним строятся списки и поиск.
+Само письмо лежит один раз в default_storage:
+
+    mail/<hh>/<sha256(Message-ID)>.eml.zst   (zstandard, если установлен)
+    mail/<hh>/<sha256(Message-ID)>.eml.gz    (иначе gzip)
+
+Ключ — хэш Message-ID: одно письмо, пришедшее в два ящика или заново
+после смены UIDVALIDITY, хранится один раз. Писем без Message-ID
+адресуются хэшем содержимого. Для писем, чьё тело не скачивали (больше
+IMAP_SYNC_MAX_BODY_BYTES), храним только заголовки под отдельным ключом —
+полная версия потом не будет спутана с урезанной.
+
+Текст и HTML разбираются по требованию (InboundEmail.parsed).
+
+Файл может быть общим для нескольких строк, поэтому при удалении
+InboundEmail он остаётся; осиротевшие файлы убирает purge_orphans()
+(команда purge_raw_mail, по расписанию — как purge_ticket_cache).
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+from email import message_from_bytes
+from email.header import decode_header
+from email.message import Message
+from functools import lru_cache
+from datetime import timedelta
+from typing import NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+PREFIX = "mail"
+COMPRESSION = getattr(settings, "INBOUND_RAW_COMPRESSION", "auto")   # auto | zstd | gzip
+ZSTD_LEVEL = 10
+GZIP_LEVEL = 6
+# файл пишется до строки InboundEmail — свежие без ссылок ещё могут понадобиться
+ORPHAN_GRACE_HOURS = getattr(settings, "INBOUND_RAW_ORPHAN_GRACE_HOURS", 24)
+
+
+class Parsed(NamedTuple):
+    message: Message
+    text: str
+    html: str
+
+
+# ---------------------------------------------------------------------------
+# Разбор
+
+def decode_header_value(value) -> str:
+    """Заголовок письма (RFC 2047) → строка; битые кодировки не роняют разбор."""
+    if not value: return ""
+    parts = decode_header(value)
+    decoded = ""
+    for text, enc in parts:
+        if isinstance(text, bytes):
+            try:
+                decoded += text.decode(enc or "utf-8", errors="replace")
+            except LookupError:      # "unknown-8bit": 8-битный заголовок без кодировки
+                decoded += text.decode("utf-8", errors="replace")
+        else:
+            decoded += text
+    return decoded
+
+def _get_body(msg):
+    text, html = "", ""
+    if msg.is_multipart():
+        for part in msg.walk():
+            ctype = part.get_content_type()
+            disp = str(part.get("Content-Disposition") or "")
+            if ctype in ("text/plain","text/html") and "attachment" not in disp.lower():
+                payload = part.get_payload(decode=True) or b""
+                try:
+                    decoded = payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+                except Exception:
+                    decoded = payload.decode("utf-8", errors="replace")
+                if ctype == "text/plain":
+                    text += decoded
+                else:
+                    html += decoded
+    else:
+        payload = msg.get_payload(decode=True) or b""
+        try:
+            text = payload.decode(msg.get_content_charset() or "utf-8", errors="replace")
+        except LookupError:
+            text = payload.decode("utf-8", errors="replace")
+    return text.strip(), html.strip()
+
+
+def parse_bytes(raw: bytes) -> Parsed:
+    msg = message_from_bytes(raw)
+    text, html = _get_body(msg)
+    return Parsed(msg, text, html)
+
+
+# ---------------------------------------------------------------------------
+# Сжатие
+
+def _zstd():
+    if COMPRESSION == "gzip":
+        return None
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        if COMPRESSION == "zstd":
+            raise
+        return None
+
+
+def _compress(raw: bytes) -> Tuple[bytes, str]:
+    zstd = _zstd()
+    if zstd is not None:
+        return zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(raw), ".eml.zst"
+    return gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0), ".eml.gz"
+
+
+def _decompress(name: str, data: bytes) -> bytes:
+    if name.endswith(".zst"):
+        import zstandard   # письмо сжато zstd — без пакета его не прочитать
+        return zstandard.ZstdDecompressor().decompress(data)
+    if name.endswith(".gz"):
+        return gzip.decompress(data)
+    return data
+
+
+# ---------------------------------------------------------------------------
+# Хранилище
+
+def digest(raw: bytes, message_id: Optional[str], *, headers_only: bool = False) -> str:
+    mid = (message_id or "").strip()
+    basis = f"mid:{mid}" if mid else "sha:" + hashlib.sha256(raw).hexdigest()
+    if headers_only:
+        basis += "|headers"
+    return hashlib.sha256(basis.encode("utf-8", errors="replace")).hexdigest()
+
+
+def _existing(d: str) -> Optional[str]:
+    for ext in (".eml.zst", ".eml.gz"):
+        name = f"{PREFIX}/{d[:2]}/{d}{ext}"
+        if default_storage.exists(name):
+            return name
+    return None
+
+
+def store(raw: bytes, message_id: Optional[str] = None, *, headers_only: bool = False) -> str:
+    """Сохранить письмо (если его ещё нет) и вернуть имя в хранилище."""
+    d = digest(raw, message_id, headers_only=headers_only)
+    name = _existing(d)
+    if name:
+        return name
+    data, ext = _compress(raw)
+    return default_storage.save(f"{PREFIX}/{d[:2]}/{d}{ext}", ContentFile(data))
+
+
+def load(name: str) -> bytes:
+    with default_storage.open(name, "rb") as f:
+        return _decompress(name, f.read())
+
+
+@lru_cache(maxsize=64)
+def parse(name: str) -> Optional[Parsed]:
+    """Разобранное письмо по имени в хранилище; нет файла — None."""
+    try:
+        return parse_bytes(load(name))
+    except FileNotFoundError:
+        return None
+
+
+def purge_orphans(grace_hours: Optional[int] = None) -> int:
+    """Удалить файлы писем, на которые не ссылается ни одна строка InboundEmail."""
+    from sales.models import InboundEmail
+
+    grace = ORPHAN_GRACE_HOURS if grace_hours is None else grace_hours
+    cutoff = timezone.now() - timedelta(hours=grace)
+    try:
+        buckets, _ = default_storage.listdir(PREFIX)
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for bucket in buckets:
+        folder = f"{PREFIX}/{bucket}"
+        _, files = default_storage.listdir(folder)
+        names = {f"{folder}/{fn}" for fn in files}
+        used = set(InboundEmail.objects.filter(raw_key__in=names).values_list("raw_key", flat=True))
+        for name in sorted(names - used):
+            if default_storage.get_modified_time(name) < cutoff:
+                default_storage.delete(name)
+                removed += 1
+    parse.cache_clear()
+    return removed
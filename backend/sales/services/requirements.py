@@ -0,0 +1,149 @@
+# sales/services/requirements.py
+"""
+Проверка спец-требований экскурсий (Гранада, Танжер, ...) пачкой:
+один запрос к Traveler на весь набор броней + кэш результата,
+чтобы preview → send не делали одну и ту же работу дважды.
+
+Ключ кэша включает отметку туристов из БД (число и последний updated_at),
+поэтому правка туриста видна сразу во всех процессах, даже с LocMemCache.
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import Dict, Iterable, List, Optional
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+SPECIAL_MAP = {
+    # требования «на каждого участника»
+    "granada":   {"all": ["first_name", "last_name", "passport", "nationality"]},
+    "gibraltar": {"all": ["nationality"]},
+    "tangier":   {"all": ["first_name", "last_name", "passport", "nationality", "gender", "dob", "doc_type", "doc_expiry"]},
+    "seville":   {"all": ["first_name", "last_name", "passport", "nationality", "dob"]},  # возраст считаем из dob
+}
+
+SPECIAL_TITLES = {
+    "granada":  ("granada", "гранада"),
+    "gibraltar":("gibraltar", "гибралтар"),
+    "tangier":  ("tanger", "tangier", "танжер"),
+    "seville":  ("seville", "севилья"),
+}
+
+# поля Traveler, которые реально нужны правилам
+TRAVELER_FIELDS = ["id", "first_name", "last_name", "passport", "nationality", "dob", "gender", "doc_type", "doc_expiry", "passport_expiry"]
+
+CACHE_TIMEOUT = 300          # preview → send обычно укладываются в пару минут
+
+
+def guess_special_key(title: str | None) -> str | None:
+    s = (title or "").lower()
+    for key, needles in SPECIAL_TITLES.items():
+        if any(n in s for n in needles):
+            return key
+    return None
+
+
+def parse_travelers_csv(csv: str) -> list[int]:
+    """"12, 15;33" → [12, 15, 33] — как models._ids_from_csv."""
+    return [int(x) for x in str(csv or "").replace(";", ",").split(",") if x.strip().isdigit()]
+
+
+def travelers_stamp(ids: Iterable[int]) -> str:
+    """
+    Отметка состояния туристов в БД: меняется при правке (updated_at, в т.ч.
+    из импорта) и при удалении (число строк). Один агрегатный запрос.
+    """
+    from sales.models import Traveler
+
+    ids = sorted(set(ids))
+    if not ids:
+        return "-"
+    agg = Traveler.objects.filter(id__in=ids).aggregate(n=Count("id"), last=Max("updated_at"))
+    return f"{agg['n']}:{agg['last'].isoformat() if agg['last'] else ''}"
+
+
+def _special_key_of(b) -> Optional[str]:
+    # ключ хранится в брони; для несохранённых объектов — считаем на лету
+    if getattr(b, "pk", None) is not None:
+        return getattr(b, "special_key", "") or None
+    return guess_special_key(getattr(b, "excursion_title", ""))
+
+
+def _cache_key(bookings: List) -> str:
+    special = [b for b in bookings if _special_key_of(b)]
+    sig = "|".join(
+        f"{b.id}:{getattr(b, 'travelers_csv', '') or ''}:{_special_key_of(b) or ''}"
+        for b in sorted(bookings, key=lambda x: x.id)
+    )
+    stamp = travelers_stamp(i for b in special for i in parse_travelers_csv(getattr(b, "travelers_csv", "")))
+    digest = hashlib.sha1(f"{sig}#{stamp}".encode("utf-8")).hexdigest()
+    return f"sales:reqcheck:{digest}"
+
+
+# ---------------------------------------------------------------------------
+# Движок
+
+def evaluate(bookings: Iterable) -> Dict[int, List[dict]]:
+    """
+    Проверяет набор броней на спец-требования.
+    Возвращает {booking_id: [problem, ...]} только для броней с проблемами, где
+      problem = {"booking_id": int, "traveler_id": int|None, "missing": [field,...]}
+    """
+    from sales.models import Traveler
+
+    plan = []            # [(booking, need, trav_ids)]
+    all_ids = set()
+    for b in bookings:
+        key = _special_key_of(b)
+        if not key:
+            continue  # не спецэкскурсия
+        need = SPECIAL_MAP.get(key, {}).get("all", [])
+        trav_ids = parse_travelers_csv(getattr(b, "travelers_csv", ""))
+        plan.append((b, need, trav_ids))
+        all_ids.update(trav_ids)
+
+    travelers = {}
+    if all_ids:
+        travelers = {t.id: t for t in Traveler.objects.filter(id__in=all_ids).only(*TRAVELER_FIELDS)}
+
+    out: Dict[int, List[dict]] = {}
+    for b, need, trav_ids in plan:
+        problems = []
+        if not trav_ids:
+            problems.append({"booking_id": b.id, "traveler_id": None, "missing": ["participants"]})
+        for tid in trav_ids:
+            t = travelers.get(tid)
+            if not t:
+                problems.append({"booking_id": b.id, "traveler_id": tid, "missing": ["not_found"]})
+                continue
+            miss = []
+            for f in need:
+                val = getattr(t, f, None)
+                if not val:
+                    # допускаем подмену doc_expiry на паспортный срок, если он есть
+                    if f == "doc_expiry" and getattr(t, "passport_expiry", None):
+                        continue
+                    miss.append(f)
+            if miss:
+                problems.append({"booking_id": b.id, "traveler_id": tid, "missing": miss})
+        if problems:
+            out[b.id] = problems
+    return out
+
+
+def validate_bookings(bookings: Iterable) -> Dict[int, List[dict]]:
+    """
+    То же, что evaluate(), но с кэшем по (набор броней + их состав, отметка туристов).
+    Принимает queryset или список; queryset материализуется один раз.
+    """
+    bookings = list(bookings)
+    if not bookings:
+        return {}
+    key = _cache_key(bookings)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    result = evaluate(bookings)
+    cache.set(key, result, timeout=CACHE_TIMEOUT)
+    return result
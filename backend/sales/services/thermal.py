@@ -0,0 +1,145 @@
+# sales/services/thermal.py
+"""
+Билет в родных командах Zebra (CPCL / ZPL) для мобильных принтеров iMZ320.
+
+Содержимое — то же, что в ticket.html (services.tickets.ticket_fields),
+но вместо PDF — текстовые команды принтера и встроенный QR-штрихкод.
+Пара сотен байт печатается за секунду по Bluetooth, без растеризации.
+Формат команд проверен скриптами из zebra/ (CRLF, 203 dpi, лента 72 мм).
+"""
+from __future__ import annotations
+
+import textwrap
+import unicodedata
+from typing import List, Tuple
+
+from sales.services import tickets
+
+PAPER_DOTS = 576          # 72 мм при 203 dpi
+MARGIN = 20
+QR_MAG = 4                # модуль QR в точках: ~45 модулей * 4 ≈ 180 точек
+QR_BLOCK = 210            # высота блока QR + подпись
+
+# (высота строки в точках, символов в строке) для крупного и обычного шрифта
+BIG = (48, 22)
+NORMAL = (30, 44)
+
+FOOTER = ("Show this ticket to the guide", "Thank you for choosing CostaSolinfo!")
+
+
+# кириллица латиницей как в загранпаспорте (ICAO 9303): так имена туристов совпадут с документами
+_CYRILLIC = dict(zip(
+    "абвгдеёжзийклмнопрстуфхцчшщъыьэюяіїєґ",
+    "a b v g d e e zh z i i k l m n o p r s t u f kh ts ch sh shch ie y _ e iu ia i i ie g".split(),
+))
+_TRANSLIT = {ord(k): v.replace("_", "") for k, v in _CYRILLIC.items()}
+_TRANSLIT.update({ord(k.upper()): v.replace("_", "").capitalize() for k, v in _CYRILLIC.items()})
+
+
+def _fold(s) -> str:
+    """ASCII для CPCL: кодовую страницу мобильного принтера не угадываем — кириллицу транслитерируем, акценты снимаем."""
+    s = unicodedata.normalize("NFKD", str(s or "").translate(_TRANSLIT))
+    return s.encode("ascii", "ignore").decode("ascii").replace("\r", " ").replace("\n", " ").strip()
+
+
+def _layout(fields: dict) -> Tuple[List[tuple], int]:
+    """
+    Общая раскладка для обоих языков: список элементов
+      ("text", y, big: bool, center: bool, text) | ("line", y) | ("qr", y, x, url, caption)
+    и итоговая высота этикетки в точках.
+    """
+    items: List[tuple] = []
+    y = 10
+
+    def text(s, big=False, center=False):
+        nonlocal y
+        height, width = BIG if big else NORMAL
+        for chunk in textwrap.wrap(str(s), width) or [""]:
+            items.append(("text", y, big, center, chunk))
+            y += height
+
+    text(fields["title_en"] or "Excursion", big=True, center=True)
+    text(f"Booking No: {fields['booking_code']}", big=True, center=True)
+    y += 6
+    text(f"Date: {fields['date_en']}")
+    text(f"Language: {fields['excursion_language']}")
+    text(f"Company: {fields['company_name']}")
+    text(f"Hotel: {fields['hotel_name']}")
+    text(f"Pickup: {fields['pickup_time_str']}")
+    text(f"Adults: {fields['adults']}  Children: {fields['children']}  Infants: {fields['infants']}")
+
+    if fields["travelers"]:
+        items.append(("line", y + 6)); y += 16
+        text("Guests:")
+        for name in fields["travelers"]:
+            text(name, big=True)
+
+    y += 10
+    half = PAPER_DOTS // 2
+    items.append(("qr", y, 40, fields["qr_site_url"], "Website"))
+    items.append(("qr", y, half + 30, fields["qr_maps_url"], "Pickup point"))
+    y += QR_BLOCK
+
+    items.append(("line", y)); y += 12
+    for line in FOOTER:
+        text(line, center=True)
+    return items, y + 20
+
+
+def render_cpcl(fields: dict) -> bytes:
+    items, height = _layout(fields)
+    out = [f"! 0 200 200 {height} 1", f"PW {PAPER_DOTS}", "SPEED 3", "TONE 0"]
+    align = None
+    for it in items:
+        if it[0] == "text":
+            _, y, big, center, s = it
+            want = "CENTER" if center else "LEFT"
+            if want != align:
+                out.append(want)
+                align = want
+            font = "4 0" if big else "7 0"
+            out.append(f"TEXT {font} {0 if center else MARGIN} {y} {_fold(s)}")
+        elif it[0] == "line":
+            out.append(f"LINE {MARGIN} {it[1]} {PAPER_DOTS - MARGIN} {it[1]} 2")
+        elif it[0] == "qr":
+            _, y, x, url, caption = it
+            if align != "LEFT":
+                out.append("LEFT")
+                align = "LEFT"
+            out += [f"BARCODE QR {x} {y} M 2 U {QR_MAG}", f"MA,{_fold(url)}", "ENDQR",
+                    f"TEXT 7 0 {x + 20} {y + QR_BLOCK - 30} {caption}"]
+    out.append("PRINT")
+    return ("\r\n".join(out) + "\r\n").encode("ascii", "replace")
+
+
+def _zpl_safe(s) -> str:
+    # ^ и ~ — управляющие символы ZPL
+    return str(s or "").replace("^", " ").replace("~", " ").replace("\r", " ").replace("\n", " ").strip()
+
+
+def render_zpl(fields: dict) -> bytes:
+    items, height = _layout(fields)
+    out = ["^XA", "^CI28", f"^PW{PAPER_DOTS}", f"^LL{height}"]   # ^CI28 — UTF-8
+    for it in items:
+        if it[0] == "text":
+            _, y, big, center, s = it
+            size = 40 if big else 26
+            if center:
+                out.append(f"^FO0,{y}^FB{PAPER_DOTS},1,0,C^A0N,{size},{size}^FD{_zpl_safe(s)}^FS")
+            else:
+                out.append(f"^FO{MARGIN},{y}^A0N,{size},{size}^FD{_zpl_safe(s)}^FS")
+        elif it[0] == "line":
+            out.append(f"^FO{MARGIN},{it[1]}^GB{PAPER_DOTS - 2 * MARGIN},2,2^FS")
+        elif it[0] == "qr":
+            _, y, x, url, caption = it
+            out.append(f"^FO{x},{y}^BQN,2,{QR_MAG}^FDMA,{_zpl_safe(url)}^FS")
+            out.append(f"^FO{x + 20},{y + QR_BLOCK - 30}^A0N,22,22^FD{caption}^FS")
+    out.append("^XZ")
+    return ("\r\n".join(out) + "\r\n").encode("utf-8")
+
+
+RENDERERS = {"cpcl": render_cpcl, "zpl": render_zpl}
+
+
+def render_booking(b, fmt: str) -> bytes:
+    return RENDERERS[fmt](tickets.ticket_fields(b))
@@ -0,0 +1,278 @@
+# sales/services/tickets.py
+"""
+Билеты (sales/ticket.html → PDF) с кэшем по содержимому.
+
+Готовый PDF лежит в default_storage под именем tickets/<hh>/<hash>.pdf,
+где hash — sha256 от всех полей брони, которые попадают в шаблон, плюс
+версия шаблона. Изменилась бронь — изменился hash, старый файл больше
+не используется; BookingDetailView дополнительно удаляет его сразу.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional, Tuple
+from urllib.parse import quote_plus
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template.loader import get_template, render_to_string
+from django.templatetags.static import static
+from django.utils import timezone
+
+from sales.services import pdf_pool, qr
+
+TEMPLATE = "sales/ticket.html"
+MULTI_TEMPLATE = "sales/tickets.html"
+# всё, из чего собирается билет: хэш этих исходников входит в ключ кэша
+TEMPLATE_PARTS = ("sales/ticket.html", "sales/tickets.html", "sales/_ticket_style.html", "sales/_ticket_body.html")
+# поднимать вручную, если меняется логика рендера (не сам шаблон — его хэш учитывается сам)
+TEMPLATE_VERSION = getattr(settings, "TICKET_TEMPLATE_VERSION", "1")
+CACHE_PREFIX = "tickets"
+QR_SIZE = 100
+
+
+def pick_title_en(title: str, max_words: int = 3) -> str:
+    """Короткое английское название экскурсии для шапки билета."""
+    if not title:
+        return ""
+    # 1) сперва ищем английский сегмент после разделителей
+    parts = re.split(r"\s*[\/\|\-–—]\s*", title)
+    for part in parts:
+        words = re.findall(r"[A-Za-z][A-Za-z'’\-]*", part)
+        if words:
+            return " ".join(words[:max_words])
+    # 2) иначе любые английские слова из всей строки
+    words = re.findall(r"[A-Za-z][A-Za-z'’\-]*", title)
+    if words:
+        return " ".join(words[:max_words])
+    # 3) фолбэк — первое слово исходного названия
+    return (title.strip().split() or [""])[0]
+
+
+def ticket_travelers(b) -> list[str]:
+    """Имена гостей: снапшот travelers_names, иначе — по travelers_csv."""
+    from sales.models import Traveler
+
+    travelers = []
+    if getattr(b, "travelers_names", None):
+        travelers = [x.strip() for x in b.travelers_names.splitlines() if x.strip()]
+    if not travelers:
+        ids_raw = (getattr(b, "travelers_csv", "") or "").strip()
+        if ids_raw:
+            ids = [int(x) for x in ids_raw.replace(";", ",").split(",") if x.strip().isdigit()]
+            qs = Traveler.objects.filter(id__in=ids).order_by("id")
+            travelers = [f"{t.first_name} {t.last_name}".strip() for t in qs]
+    return travelers
+
+
+def ticket_fields(b) -> dict:
+    """
+    Все данные брони, которые видит шаблон билета, в виде примитивов.
+    Это же — основа ключа кэша, поэтому сюда попадает ровно то, что печатается.
+    """
+    d = getattr(b, "date", None) or timezone.localdate()
+    try:
+        date_en = d.strftime("%-d %B %Y")   # macOS/Linux
+    except Exception:
+        date_en = d.strftime("%d %B %Y")    # Windows fallback
+
+    # QR 1 — сайт, QR 2 — точка сбора (координаты приоритетны)
+    qr_site_url = f"https://www.costasolinfo.com/?ref={b.booking_code}"
+    lat = getattr(b, "pickup_lat", None)
+    lng = getattr(b, "pickup_lng", None)
+    if lat and lng:
+        maps_query = f"{lat},{lng}"
+    else:
+        parts = [getattr(b, "pickup_point_name", ""), getattr(b, "hotel_name", ""), "Costa del Sol"]
+        maps_query = " ".join(p for p in parts if p)
+    qr_maps_url = f"https://www.google.com/maps/search/?api=1&query={quote_plus(maps_query)}"
+
+    return {
+        "booking_code": b.booking_code,
+        "title_en": pick_title_en(getattr(b, "excursion_title", ""), max_words=3),
+        "date_en": date_en,
+        "excursion_language": b.excursion_language or "",
+        "company_name": b.company.name if b.company_id else "",
+        "hotel_name": b.hotel_name or "",
+        "pickup_time_str": b.pickup_time_str or "",
+        "adults": b.adults,
+        "children": b.children,
+        "infants": b.infants or 0,
+        "travelers": ticket_travelers(b),
+        "qr_site_url": qr_site_url,
+        "qr_maps_url": qr_maps_url,
+    }
+
+
+@lru_cache(maxsize=1)
+def _template_digest() -> str:
+    h = hashlib.sha256()
+    for name in TEMPLATE_PARTS:
+        tpl = get_template(name)
+        h.update((getattr(getattr(tpl, "template", None), "source", "") or "").encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def fingerprint(fields: dict) -> str:
+    payload = json.dumps(
+        {"v": TEMPLATE_VERSION, "tpl": _template_digest(), "f": fields},
+        sort_keys=True, default=str, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def multi_fingerprint(fields_list: list[dict]) -> str:
+    """Ключ общего PDF для нескольких билетов (порядок важен — это порядок страниц)."""
+    joined = "|".join(fingerprint(f) for f in fields_list)
+    return hashlib.sha256(f"multi:{joined}".encode("utf-8")).hexdigest()
+
+
+def booking_fingerprint(b) -> str:
+    return fingerprint(ticket_fields(b))
+
+
+def _cache_name(digest: str) -> str:
+    return f"{CACHE_PREFIX}/{digest[:2]}/{digest}.pdf"
+
+
+# ---------------------------------------------------------------------------
+# Рендер
+
+def _ticket_ctx(b, fields: dict) -> dict:
+    return {
+        "b": b,
+        "date_en": fields["date_en"],
+        "travelers": fields["travelers"],
+        "qr_site": qr.qr_data_uri(fields["qr_site_url"], QR_SIZE),
+        "qr_maps": qr.qr_data_uri(fields["qr_maps_url"], QR_SIZE),
+        "qr_site_url": fields["qr_site_url"],
+        "qr_maps_url": fields["qr_maps_url"],
+        "title_en": fields["title_en"],
+    }
+
+
+def render_ticket_html(b, fields: dict, *, logo_url: str) -> str:
+    ctx = _ticket_ctx(b, fields)
+    ctx["logo_url"] = logo_url
+    return render_to_string(TEMPLATE, ctx)
+
+
+def render_tickets_html(pairs: list, *, logo_url: str) -> str:
+    """
+    Один HTML на несколько билетов [(booking, fields), ...]. Одинаковые QR
+    (одна точка сбора) берутся из services.qr, а WeasyPrint встраивает
+    одинаковые data: URI и логотип в документ одним объектом.
+    """
+    return render_to_string(MULTI_TEMPLATE, {
+        "tickets": [_ticket_ctx(b, f) for b, f in pairs],
+        "logo_url": logo_url,
+    })
+
+
+def render_ticket_pdf(b, fields: dict) -> bytes:
+    """
+    HTML собираем здесь, сам PDF рендерит pdf_pool (отдельные процессы).
+    Сети нет: логотип и прочие /static/, /media/ берутся с диска (pdf_assets).
+    Может бросить pdf_pool.RenderBusy / RenderTimeout.
+    """
+    html = render_ticket_html(b, fields, logo_url=static("sales/logo.png"))
+    return pdf_pool.render(html)
+
+
+def render_tickets_pdf(pairs: list) -> bytes:
+    """Все билеты страницами одного документа — один проход WeasyPrint."""
+    html = render_tickets_html(pairs, logo_url=static("sales/logo.png"))
+    return pdf_pool.render(html)
+
+
+# ---------------------------------------------------------------------------
+# Кэш
+
+def cached_info(digest: str) -> Optional[datetime]:
+    """Время рендера закэшированного PDF или None, если его нет."""
+    name = _cache_name(digest)
+    try:
+        if default_storage.exists(name):
+            return default_storage.get_modified_time(name)
+    except Exception:
+        pass
+    return None
+
+
+def _get_or_render(digest: str, render) -> Tuple[bytes, datetime]:
+    """
+    PDF из кэша или после render() с сохранением.
+    Ошибки хранилища не мешают отдать PDF.
+    """
+    name = _cache_name(digest)
+    try:
+        if default_storage.exists(name):
+            with default_storage.open(name, "rb") as f:
+                return f.read(), default_storage.get_modified_time(name)
+    except Exception:
+        pass
+
+    pdf = render()
+    rendered_at = timezone.now()
+    try:
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(pdf))
+        rendered_at = default_storage.get_modified_time(name)
+    except Exception:
+        pass
+    return pdf, rendered_at
+
+
+def get_ticket_pdf(b, *, fields: Optional[dict] = None) -> Tuple[str, bytes, datetime]:
+    """Возвращает (hash, pdf, время рендера) для одного билета."""
+    fields = fields or ticket_fields(b)
+    digest = fingerprint(fields)
+    pdf, rendered_at = _get_or_render(digest, lambda: render_ticket_pdf(b, fields))
+    return digest, pdf, rendered_at
+
+
+def get_tickets_pdf(pairs: list, *, digest: Optional[str] = None) -> Tuple[str, bytes, datetime]:
+    """То же для нескольких билетов [(booking, fields), ...] одним документом."""
+    digest = digest or multi_fingerprint([f for _, f in pairs])
+    pdf, rendered_at = _get_or_render(digest, lambda: render_tickets_pdf(pairs))
+    return digest, pdf, rendered_at
+
+
+def invalidate(digest: str) -> None:
+    try:
+        default_storage.delete(_cache_name(digest))
+    except Exception:
+        pass
+
+
+def _purge_files(prefix: str, cutoff) -> int:
+    removed = 0
+    try:
+        buckets, _ = default_storage.listdir(prefix)
+    except Exception:
+        return 0
+    for bucket in buckets:
+        _, files = default_storage.listdir(f"{prefix}/{bucket}")
+        for fn in files:
+            name = f"{prefix}/{bucket}/{fn}"
+            if default_storage.get_modified_time(name) < cutoff:
+                default_storage.delete(name)
+                removed += 1
+    return removed
+
+
+def purge_older_than(days: int) -> int:
+    """
+    Удалить кэш билетов старше N дней (устаревшие версии после правок)
+    и QR-картинки того же возраста: QR пикапа, который ещё нужен, просто
+    сгенерируется заново.
+    """
+    from datetime import timedelta
+
+    cutoff = timezone.now() - timedelta(days=days)
+    return _purge_files(CACHE_PREFIX, cutoff) + _purge_files(qr.CACHE_PREFIX, cutoff)
@@ -1,16 +1,32 @@
 # sales/signals.py
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import BookingSale
+from .models import BookingSale, InboundEmail
+from .services import inbound_search
 
 @receiver(pre_save, sender=BookingSale)
-def fill_travelers_names(sender, instance: BookingSale, **kwargs):
+def fill_travelers_names(sender, instance: BookingSale, update_fields=None, **kwargs):
     """
     Перед сохранением брони обновляем поле-снапшот travelers_names
     из travelers_csv (списка ID гостей). Так билет не зависит от связей.
+    Запрос к Traveler делаем только если состав реально поменялся;
+    для массовых правок — BookingSale.refresh_travelers_names().
     """
+    if not instance.travelers_snapshot_stale(update_fields):
+        return
     try:
         instance.set_travelers_names_from_ids()
     except Exception:
         # не рушим сохранение из-за побочного снапшота
         pass
+
+
+@receiver(post_save, sender=InboundEmail)
+def index_inbound_email(sender, instance: InboundEmail, **kwargs):
+    """Письмо сохранено через ORM (админка, скрипты) — обновляем поисковый индекс."""
+    inbound_search.index_emails([instance])
+
+
+@receiver(post_delete, sender=InboundEmail)
+def unindex_inbound_email(sender, instance: InboundEmail, **kwargs):
+    inbound_search.remove([instance.pk])
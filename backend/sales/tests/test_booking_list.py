@@ -0,0 +1,33 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from sales.models import BookingSale, Company, FamilyBooking, Traveler
+
+
+class BookingListTests(TestCase):
+    def setUp(self):
+        self.guide = get_user_model().objects.create_user("guide", password="x")
+        self.companies = [Company.objects.create(name=f"Agency {i}", slug=f"agency-{i}") for i in range(3)]
+        self.fam = FamilyBooking.objects.create(ref_code="R1", hotel_id=1, hotel_name="Hotel", region_name="Málaga")
+        self.client.force_login(self.guide)
+
+    def add_bookings(self, n: int):
+        for i in range(n):
+            ids = [Traveler.objects.create(family=self.fam, first_name=f"Name{i}{j}", last_name="Ivanov").pk for j in range(2)]
+            BookingSale.objects.create(company=self.companies[i % 3], guide=self.guide, excursion_id=1, region_name="Málaga",
+                                       date=date(2026, 5, 1), booking_code=f"B{BookingSale.objects.count()}",
+                                       travelers_csv=",".join(map(str, ids)))
+
+    def test_query_count_does_not_grow_with_bookings(self):
+        # сессия, пользователь, брони с компаниями (JOIN), туристы всей страницы одним запросом
+        self.add_bookings(2)
+        with self.assertNumQueries(4):
+            self.assertEqual(len(self.client.get("/api/sales/bookings/").json()), 2)
+
+        self.add_bookings(6)
+        with self.assertNumQueries(4):
+            data = self.client.get("/api/sales/bookings/").json()
+        self.assertEqual(len(data), 8)
+        self.assertTrue(all(len(b["travelers_names"]) == 2 and b["company"]["name"] for b in data))
@@ -0,0 +1,59 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from sales.models import BookingSale, Company, FamilyBooking, Traveler
+
+
+class TravelersSnapshotTests(TestCase):
+    def setUp(self):
+        guide = get_user_model().objects.create_user("guide", password="x")
+        company = Company.objects.create(name="Agency", slug="agency")
+        fam = FamilyBooking.objects.create(ref_code="R1", hotel_id=1, hotel_name="Hotel", region_name="Málaga")
+        self.anna = Traveler.objects.create(family=fam, first_name="Anna", last_name="Ivanova")
+        self.oleg = Traveler.objects.create(family=fam, first_name="Oleg", last_name="Ivanov")
+        self.booking = BookingSale.objects.create(
+            company=company, guide=guide, family=fam, excursion_id=1, region_name="Málaga",
+            date=date(2026, 5, 1), booking_code="B1", travelers_csv=str(self.anna.pk),
+        )
+
+    def traveler_queries(self, save):
+        with CaptureQueriesContext(connection) as ctx:
+            save()
+        return [q["sql"] for q in ctx.captured_queries if '"sales_traveler"' in q["sql"]]
+
+    def test_created_with_snapshot(self):
+        self.assertEqual(self.booking.travelers_names, "Anna Ivanova")
+
+    def test_unchanged_csv_skips_recompute(self):
+        b = BookingSale.objects.get(pk=self.booking.pk)
+        b.status = "PENDING"
+        self.assertFalse(b.travelers_snapshot_stale())
+        self.assertEqual(self.traveler_queries(b.save), [])
+        self.assertEqual(self.traveler_queries(lambda: b.save(update_fields=["status"])), [])
+
+    def test_changed_csv_recomputes(self):
+        b = BookingSale.objects.get(pk=self.booking.pk)
+        b.travelers_csv = f"{self.oleg.pk},{self.anna.pk}"
+        self.assertTrue(b.travelers_snapshot_stale())
+        self.assertEqual(len(self.traveler_queries(b.save)), 1)
+        b.refresh_from_db()
+        self.assertEqual(b.travelers_names, "Anna Ivanova\nOleg Ivanov")
+
+    def test_refresh_rewrites_only_stale_snapshots(self):
+        other = BookingSale.objects.create(
+            company=self.booking.company, guide=self.booking.guide, excursion_id=1, region_name="Málaga",
+            date=date(2026, 5, 2), booking_code="B2", travelers_csv=str(self.oleg.pk),
+        )
+        # имя поменяли в обход сохранения брони — снапшот первой брони устарел
+        Traveler.objects.filter(pk=self.anna.pk).update(first_name="Anne")
+
+        with self.assertNumQueries(3):      # брони, туристы одним запросом, один bulk_update
+            fixed = BookingSale.refresh_travelers_names(BookingSale.objects.filter(pk__in=[self.booking.pk, other.pk]))
+
+        self.assertEqual(fixed, 1)
+        self.assertEqual(dict(BookingSale.objects.values_list("booking_code", "travelers_names")),
+                         {"B1": "Anne Ivanova", "B2": "Oleg Ivanov"})
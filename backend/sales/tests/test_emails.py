@@ -0,0 +1,38 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from sales.models import BookingSale, Company, FamilyBooking, Traveler
+from sales.services import emails
+
+
+class BookingVersionTests(TestCase):
+    def setUp(self):
+        guide = get_user_model().objects.create_user("guide", password="x")
+        company = Company.objects.create(name="Agency", slug="agency", email_for_orders="office@agency.test")
+        fam = FamilyBooking.objects.create(ref_code="R1", hotel_id=1, hotel_name="Hotel", region_name="Málaga")
+        self.anna = Traveler.objects.create(family=fam, first_name="Anna", last_name="Ivanova")
+        self.bookings = [
+            BookingSale.objects.create(
+                company=company, guide=guide, family=fam, excursion_id=1, excursion_title="Ronda",
+                region_name="Málaga", date=date(2026, 5, 1), booking_code=f"B{i}", travelers_csv=str(self.anna.pk),
+            )
+            for i in range(2)
+        ]
+
+    def test_version_follows_traveler_rows_in_db(self):
+        booking = self.bookings[0]
+        before = emails.booking_version(booking)
+        self.assertEqual(before, emails.booking_version(booking))
+        # без сигналов и без общего кэша: версия читается из БД
+        self.anna.first_name, self.anna.updated_at = "Anya", timezone.now()
+        Traveler.objects.bulk_update([self.anna], ["first_name", "updated_at"])
+        self.assertNotEqual(before, emails.booking_version(booking))
+
+    def test_batch_stamps_match_single(self):
+        batch = emails.ContextBatch(self.bookings)
+        with self.assertNumQueries(1):
+            stamps = [batch.stamp(b) for b in self.bookings]
+        self.assertEqual(stamps, [emails.traveler_stamps([b])[b.pk] for b in self.bookings])
@@ -0,0 +1,34 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from sales.models import BookingSale, Company
+
+URL = "/api/sales/bookings/export/"
+
+
+class BookingsExportTests(TestCase):
+    def setUp(self):
+        users = get_user_model().objects
+        self.guide = users.create_user("guide", password="x")
+        self.staff = users.create_user("office", password="x", is_staff=True)
+        company = Company.objects.create(name="Agency", slug="agency")
+        for i, day in enumerate((1, 15)):
+            BookingSale.objects.create(company=company, guide=self.guide, excursion_id=1, region_name="Málaga",
+                                       date=date(2026, 5, day), booking_code=f"B{i}")
+
+    def test_filters(self):
+        self.client.force_login(self.staff)
+        resp = self.client.get(URL, {"date_from": "2026-05-10", "guide": str(self.guide.pk)})
+        self.assertEqual(resp.status_code, 200)
+        lines = b"".join(resp.streaming_content).splitlines()
+        self.assertEqual(len(lines), 1)
+
+    def test_bad_params_are_400(self):
+        self.client.force_login(self.staff)
+        for params in ({"guide": "abc"}, {"company": "1;DROP"}, {"date_from": "2025-13-40"},
+                       {"date_to": "yesterday"}):
+            resp = self.client.get(URL, params)
+            self.assertEqual(resp.status_code, 400, params)
+            self.assertIn("detail", resp.json())
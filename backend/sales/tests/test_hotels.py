@@ -0,0 +1,56 @@
+from unittest import mock
+
+import requests
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from sales.forms import HotelAliasForm
+from sales.models import HotelAlias
+from sales.services import hotels
+
+
+class ResolveTests(TestCase):
+    def search(self, *results):
+        return mock.patch("sales.services.hotels.csi.search_hotels", side_effect=list(results))
+
+    def test_found_and_missing_are_persisted(self):
+        with self.search([{"id": 7, "name": "Hotel Sol", "region": "Marbella"}], {"items": []}):
+            out = hotels.resolve_many(["Hotel  SOL", "Nowhere Inn"])
+        self.assertEqual(out["Hotel  SOL"], hotels.Hotel(7, "Hotel Sol", "Marbella"))
+        self.assertEqual(out["Nowhere Inn"], hotels.Hotel(None, "Nowhere Inn", ""))
+        self.assertEqual(dict(HotelAlias.objects.values_list("alias", "hotel_id")), {"hotel sol": 7, "nowhere inn": None})
+
+    def test_csi_outage_is_not_cached_as_miss(self):
+        with self.search(requests.ConnectionError("down")):
+            self.assertEqual(hotels.resolve("Hotel Sol"), hotels.Hotel(None, "Hotel Sol", ""))
+        self.assertFalse(HotelAlias.objects.exists())
+
+        with self.search([{"id": 7, "name": "Hotel Sol"}]) as search:
+            self.assertEqual(hotels.resolve("Hotel Sol").id, 7)
+        search.assert_called_once()
+
+
+class HotelAliasAdminTests(TestCase):
+    def setUp(self):
+        self.sol = HotelAlias.objects.create(alias="hotel sol", raw_name="Hotel Sol", hotel_id=7, resolved_at=timezone.now())
+        self.mar = HotelAlias.objects.create(alias="hotel mar", raw_name="Hotel Mar", hotel_id=8, resolved_at=timezone.now())
+
+    def test_form_rejects_alias_collision(self):
+        form = HotelAliasForm(data={"raw_name": "HOTEL  sol", "hotel_id": 8}, instance=self.mar)
+        self.assertFalse(form.is_valid())
+        self.assertIn("raw_name", form.errors)
+
+    def test_form_recomputes_alias(self):
+        form = HotelAliasForm(data={"raw_name": "Hotel Mar ", "hotel_id": 9}, instance=self.mar)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save().alias, "hotel mar")
+
+    def test_admin_collision_is_form_error_not_500(self):
+        admin = get_user_model().objects.create_superuser("admin", "a@b.c", "x")
+        self.client.force_login(admin)
+        resp = self.client.post(f"/admin/sales/hotelalias/{self.mar.pk}/change/", {"raw_name": "hotel sol", "hotel_id": "8"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.context["adminform"].form.errors)
+        self.mar.refresh_from_db()
+        self.assertEqual(self.mar.alias, "hotel mar")
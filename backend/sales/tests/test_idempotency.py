@@ -0,0 +1,68 @@
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from sales import idempotency
+from sales.models import BookingSale, Company, IdempotencyKey, OutboundEmail
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.guide = get_user_model().objects.create_user("guide", password="x")
+        company = Company.objects.create(name="Agency", slug="agency")
+        self.booking = BookingSale.objects.create(company=company, guide=self.guide, excursion_id=1, region_name="Málaga",
+                                                  date=date(2026, 5, 1), booking_code="B1", status="PENDING")
+        self.client.force_login(self.guide)
+        self.scope = f"bookings-cancel:{self.guide.pk}:{self.booking.pk}"
+
+    def cancel(self, key="k1", reason="sick"):
+        return self.client.post(f"/api/sales/bookings/{self.booking.pk}/cancel/", {"reason": reason},
+                                content_type="application/json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def hash_of(self, reason):
+        class Req:
+            data = {"reason": reason}
+        return idempotency._request_hash(Req())
+
+    def test_replay_returns_stored_response_without_side_effects(self):
+        first = self.cancel()
+        again = self.cancel()
+
+        self.assertEqual((first.status_code, again.status_code), (200, 200))
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(again["Idempotent-Replayed"], "true")
+        self.assertEqual(OutboundEmail.objects.filter(kind="CANCELLATION").count(), 1)
+
+    def test_same_key_different_payload_is_422(self):
+        self.cancel(reason="sick")
+        self.assertEqual(self.cancel(reason="weather").status_code, 422)
+
+    def test_error_responses_are_not_stored(self):
+        BookingSale.objects.filter(pk=self.booking.pk).update(status="DRAFT")
+        self.assertEqual(self.cancel().status_code, 409)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        BookingSale.objects.filter(pk=self.booking.pk).update(status="PENDING")
+        resp = self.cancel()
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", resp)
+
+    def test_concurrent_request_sees_in_progress(self):
+        # первый запрос уже занял ключ (закоммичено) и ещё выполняется
+        IdempotencyKey.objects.create(scope=self.scope, key="k1", request_hash=self.hash_of("sick"),
+                                      expires_at=timezone.now() + idempotency.TTL)
+        resp = self.cancel()
+        self.assertEqual(resp.status_code, 409)
+        self.assertIn("in progress", resp.json()["detail"])
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_abandoned_in_progress_key_is_taken_over(self):
+        rec = IdempotencyKey.objects.create(scope=self.scope, key="k1", request_hash=self.hash_of("sick"),
+                                            expires_at=timezone.now() + idempotency.TTL)
+        IdempotencyKey.objects.filter(pk=rec.pk).update(created_at=timezone.now() - idempotency.IN_PROGRESS - timedelta(seconds=1))
+
+        self.assertEqual(self.cancel().status_code, 200)
+        rec.refresh_from_db()
+        self.assertEqual(rec.status_code, 200)
@@ -0,0 +1,177 @@
+import io
+import shutil
+import tempfile
+from unittest import mock
+
+import openpyxl
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from sales.importers import tourists_excel
+from sales.models import FamilyBooking, ImportJob, Traveler
+from sales.services import import_jobs
+
+HEADER = "Номер брони,Отель,Дата заезда,Фамилия,Имя,Дата рождения,Паспорт"
+
+
+def fake_search(name, limit=10, **kw):
+    return [{"id": 1000 + sum(map(ord, name)) % 1000, "name": name.upper(), "region": "Costa"}]
+
+
+def make_csv(rows) -> bytes:
+    """rows: (ref, hotel, last_name, first_name, dob, passport)."""
+    lines = [HEADER] + [f"{ref},{hotel},01.07.2025,{last},{first},{dob},{pp}" for ref, hotel, last, first, dob, pp in rows]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def make_xlsx(rows) -> bytes:
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for line in make_csv(rows).decode("utf-8").splitlines():
+        ws.append(line.split(","))
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def family_rows(families: int, per_family: int = 2):
+    return [
+        (f"R{f:03d}", f"Hotel {f % 3}", f"Ivanov{f}", f"Name{t}", f"0{t + 1}.01.1980", f"P{f}{t}")
+        for f in range(families) for t in range(per_family)
+    ]
+
+
+class ImporterTestCase(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.enterContext(mock.patch("sales.services.hotels.csi.search_hotels", side_effect=fake_search))
+
+    def chunked(self, rows: int):
+        return mock.patch.dict(tourists_excel.import_tourists_excel.__kwdefaults__, {"chunk_rows": rows})
+
+    def import_(self, data: bytes, name: str = "tourists.csv", **kw):
+        f = io.BytesIO(data)
+        f.name = name
+        return tourists_excel.import_tourists_excel(f, **{"dry_run": False, **kw})
+
+    def counts(self):
+        return FamilyBooking.objects.count(), Traveler.objects.count()
+
+
+class ImportTests(ImporterTestCase):
+    def test_csv_import(self):
+        result = self.import_(make_csv([("R1", "Hotel Sol", "ivanov ", "anna  maria", "05.03.1990", "X1")]))
+
+        self.assertEqual((result["created_families"], result["created_travelers"], result["skipped"]), (1, 1, 0))
+        t = Traveler.objects.select_related("family").get()
+        self.assertEqual((t.last_name, t.first_name, t.passport, str(t.dob)), ("Ivanov", "Anna Maria", "X1", "1990-03-05"))
+        self.assertEqual((t.family.ref_code, t.family.hotel_id), ("R1", fake_search("Hotel Sol")[0]["id"]))
+
+    def test_xlsx_matches_csv(self):
+        rows = family_rows(3)
+        keys = ("created_families", "created_travelers", "skipped", "total_rows")
+        csv_result = self.import_(make_csv(rows), dry_run=True)
+        xlsx_result = self.import_(make_xlsx(rows), name="tourists.xlsx", dry_run=True)
+        self.assertEqual([csv_result[k] for k in keys], [xlsx_result[k] for k in keys])
+        self.assertEqual(xlsx_result["created_travelers"], 6)
+
+    def test_dedupe_across_chunks(self):
+        rows = family_rows(6, per_family=3)          # семьи по 3 строки режутся пачками по 4
+        rows.append(("R000", "Hotel 0", "Ivanov0", "Name0", "01.01.1980", "NEW1"))   # повтор туриста в последней пачке
+
+        with self.chunked(4):
+            result = self.import_(make_csv(rows))
+
+        self.assertEqual((result["created_families"], result["created_travelers"]), (6, 18))
+        self.assertEqual(self.counts(), (6, 18))
+        self.assertEqual(Traveler.objects.get(last_name="Ivanov0", first_name="Name0").passport, "NEW1")
+
+    def test_reimport_is_idempotent(self):
+        data = make_csv(family_rows(4))
+        with self.chunked(3):
+            self.import_(data)
+            again = self.import_(data)
+
+        self.assertEqual(self.counts(), (4, 8))
+        self.assertEqual((again["created_families"], again["updated_families"], again["created_travelers"]), (0, 0, 0))
+
+    def test_dry_run_counts_match_real_run(self):
+        rows = family_rows(5, per_family=3)
+        keys = ("created_families", "created_travelers", "total_rows")
+        with self.chunked(4):
+            dry = self.import_(make_csv(rows), dry_run=True)
+            self.assertEqual(self.counts(), (0, 0))
+            real = self.import_(make_csv(rows))
+
+        self.assertEqual([dry[k] for k in keys], [5, 15, 15])
+        self.assertEqual([dry[k] for k in keys], [real[k] for k in keys])
+
+
+class ImportJobTests(ImporterTestCase):
+    def submit(self, data: bytes, **kw) -> ImportJob:
+        return import_jobs.submit(SimpleUploadedFile("tourists.csv", data), **kw)
+
+    def test_resume_after_failure_continues_from_next_row(self):
+        job = self.submit(make_csv(family_rows(6)))
+        process = tourists_excel._process
+        calls = []
+
+        def crash_on_second_chunk(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("worker died")
+            return process(*args, **kwargs)
+
+        with self.chunked(4), mock.patch.object(tourists_excel, "_process", side_effect=crash_on_second_chunk):
+            job = import_jobs.run_once()
+        self.assertEqual((job.status, job.next_row, job.rows_done), ("PENDING", 5, 4))
+        self.assertIn("worker died", job.last_error)
+
+        ImportJob.objects.filter(pk=job.pk).update(next_attempt_at=timezone.now())
+        with self.chunked(4):
+            job = import_jobs.run_once()
+
+        self.assertEqual((job.status, job.attempts), ("DONE", 2))
+        self.assertEqual((job.rows_done, job.created_families, job.created_travelers), (12, 6, 12))
+        self.assertEqual(self.counts(), (6, 12))
+
+    def test_lease_lost_mid_import_abandons_job(self):
+        job = self.submit(make_csv(family_rows(6)))
+        process = tourists_excel._process
+        chunks = []
+
+        def stolen_after_first_chunk(*args, **kwargs):
+            chunks.append(1)
+            if len(chunks) == 2:
+                # другой воркер забрал задание (аренда истекла)
+                ImportJob.objects.filter(pk=job.pk).update(next_attempt_at=timezone.now())
+            return process(*args, **kwargs)
+
+        with self.chunked(4), mock.patch.object(tourists_excel, "_process", side_effect=stolen_after_first_chunk):
+            job = import_jobs.run_once()
+
+        self.assertEqual(job.status, "RUNNING")
+        self.assertEqual(job.next_row, 5)               # первая пачка (4 строки) записана, вторая откатилась
+        self.assertEqual(Traveler.objects.count(), 4)
+        self.assertEqual(job.last_error, "")
+
+    def test_page_shows_only_own_jobs(self):
+        users = get_user_model().objects
+        owner, other = users.create_user("owner", password="x"), users.create_user("other", password="x")
+        staff = users.create_user("office", password="x", is_staff=True)
+        job = self.submit(make_csv(family_rows(1)), user=owner)
+        url = f"/api/sales/import/tourists/?job={job.pk}"
+
+        self.assertEqual(self.client.get(url).status_code, 302)     # без входа — на логин
+        for user, visible in ((owner, True), (other, False), (staff, True)):
+            self.client.force_login(user)
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.context.get("job") == job, visible, user.username)
+            self.assertEqual(self.client.get(f"/api/sales/imports/{job.pk}/").status_code, 200 if visible else 404)
+        self.assertFalse(FamilyBooking.objects.exists())
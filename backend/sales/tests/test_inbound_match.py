@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from sales.models import BookingSale, Company, InboundEmail
+from sales.services import inbound_match
+
+
+class ReconcileTests(TestCase):
+    def setUp(self):
+        self.guide = get_user_model().objects.create_user("guide", password="x")
+        self.company = Company.objects.create(name="Agency", slug="agency")
+        self.booking("ABCDE12345")
+
+    def booking(self, code):
+        return BookingSale.objects.create(company=self.company, guide=self.guide, excursion_id=1, region_name="Málaga",
+                                          date=timezone.localdate() + timedelta(days=3), booking_code=code)
+
+    def email(self, uid, subject, age_days=0):
+        e = InboundEmail.objects.create(uid=uid, subject=subject)
+        InboundEmail.objects.filter(pk=e.pk).update(created_at=timezone.now() - timedelta(days=age_days))
+        return e
+
+    def test_links_by_code_in_subject(self):
+        e = self.email("1", "Re: reserva ABCDE12345")
+        self.assertEqual(inbound_match.reconcile(), {"scanned": 1, "linked": 1})
+        e.refresh_from_db()
+        self.assertEqual(e.booking.booking_code, "ABCDE12345")
+        self.assertIsNotNone(e.match_checked_at)
+
+    def test_checked_old_mail_is_not_rescanned(self):
+        self.email("old", "Consulta FGHIJ67890", age_days=60)
+        self.email("new", "Consulta KLMNO13579")
+        self.assertEqual(inbound_match.reconcile()["scanned"], 2)
+
+        self.booking("FGHIJ67890")
+        self.booking("KLMNO13579")
+        # старое уже сверялось — плановый прогон его не читает, свежее сверяет снова
+        self.assertEqual(inbound_match.reconcile(), {"scanned": 1, "linked": 1})
+        self.assertEqual(inbound_match.reconcile(), {"scanned": 0, "linked": 0})
+
+        self.assertEqual(inbound_match.reconcile(relink=True), {"scanned": 2, "linked": 1})
+        self.assertFalse(InboundEmail.objects.filter(booking__isnull=True).exists())
@@ -0,0 +1,105 @@
+import importlib
+from datetime import datetime, timezone as dt_timezone
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from sales.models import InboundEmail, InboundEmailToken
+from sales.services import inbound_search
+
+
+def at(day: int) -> datetime:
+    return datetime(2025, 10, day, 10, 0, tzinfo=dt_timezone.utc)
+
+
+class FoldTests(TestCase):
+    def test_latin_diacritics_removed(self):
+        self.assertEqual(inbound_search.tokens("Cancelación Müller"), ["cancelacion", "muller"])
+
+    def test_cyrillic_kept(self):
+        self.assertEqual(inbound_search.tokens("Здравствуйте, Андрей! Ёжик"), ["здравствуйте", "андрей", "ёжик"])
+
+
+class SearchTestsMixin:
+    def setUp(self):
+        InboundEmail.objects.create(uid="1", subject="Здравствуйте, Андрей", snippet="Ёжик в тумане", date=at(1))
+        InboundEmail.objects.create(uid="2", subject="Cancelación reserva", snippet="Андрей отменил", date=at(2))
+        InboundEmail.objects.create(uid="3", subject="Другое", snippet="ничего", date=at(3))
+
+    def found(self, query):
+        _, hits = inbound_search.search(query)
+        return sorted(InboundEmail.objects.get(pk=pk).uid for pk, _, _ in hits)
+
+    def test_cyrillic_words(self):
+        self.assertEqual(self.found("здравствуйте"), ["1"])
+        self.assertEqual(self.found("Андрей"), ["1", "2"])
+        self.assertEqual(self.found("ёжик"), ["1"])
+        self.assertEqual(self.found("андр"), ["1", "2"])   # последнее слово — префикс
+
+    def test_latin_folding(self):
+        self.assertEqual(self.found("cancelacion"), ["2"])
+        self.assertEqual(self.found("CANCELACIÓN"), ["2"])
+
+    def test_filter_queryset_ordered_by_rank(self):
+        # в теме (письмо 1) весит больше, чем в тексте (письмо 2), хотя письмо 2 новее
+        qs = inbound_search.filter_queryset(InboundEmail.objects.all(), "андрей").order_by("-search_rank")
+        self.assertEqual([e.uid for e in qs], ["1", "2"])
+        self.assertEqual(qs.count(), 2)
+
+
+class FtsSearchTests(SearchTestsMixin, TestCase):
+    def setUp(self):
+        self.assertEqual(inbound_search.backend(), "fts5")
+        super().setUp()
+
+
+class TokenSearchTests(SearchTestsMixin, TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(inbound_search, "_fts_available", return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+
+class AdminSearchTests(TestCase):
+    def setUp(self):
+        admin = get_user_model().objects.create_superuser("admin", "a@b.c", "x")
+        self.client.force_login(admin)
+        InboundEmail.objects.create(uid="1", subject="Андрей", date=at(1))
+        for i in range(2, 6):
+            InboundEmail.objects.create(uid=str(i), subject="письмо", snippet=f"Андрей {i}", date=at(i))
+
+    def test_results_ranked(self):
+        resp = self.client.get("/admin/sales/inboundemail/", {"q": "андрей"})
+        self.assertEqual(resp.status_code, 200)
+        cl = resp.context["cl"]
+        self.assertEqual(cl.result_count, 5)
+        self.assertEqual(cl.result_list[0].uid, "1")
+
+    def test_column_sort_still_works(self):
+        resp = self.client.get("/admin/sales/inboundemail/", {"q": "андрей", "o": "3"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([e.uid for e in resp.context["cl"].result_list], ["1", "2", "3", "4", "5"])
+
+
+class MigrationBackfillTests(TestCase):
+    """0021 на не-SQLite: FTS5 нет, индекс по словам должен заполниться и для старых писем."""
+
+    def test_token_index_filled_for_existing_rows(self):
+        with mock.patch.object(inbound_search, "_fts_available", return_value=False):
+            InboundEmail.objects.create(uid="1", subject="Cancelación reserva", snippet="Андрей отменил")
+        InboundEmailToken.objects.all().delete()      # как строки, лежавшие до миграции
+        migration = importlib.import_module("sales.migrations.0021_inbound_search")
+        editor = mock.Mock(connection=mock.Mock(vendor="postgresql"))
+
+        migration.create_fts(apps, editor)
+
+        editor.execute.assert_not_called()
+        self.assertEqual(
+            set(InboundEmailToken.objects.values_list("token", "weight")),
+            {("cancelacion", 10), ("reserva", 10), ("андрей", 1), ("отменил", 1)},
+        )
+        with mock.patch.object(inbound_search, "_fts_available", return_value=False):
+            self.assertEqual([e.uid for e in inbound_search.filter_queryset(InboundEmail.objects.all(), "андрей")], ["1"])
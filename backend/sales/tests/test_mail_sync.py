@@ -0,0 +1,201 @@
+import io
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from sales.models import InboundEmail, MailboxSyncState
+from sales.services import mail_push, mail_sync, raw_mail
+
+
+def make_raw(i: int, subject: str = "", body: str = "") -> bytes:
+    return (
+        f"Message-ID: <m{i}@test>\r\nSubject: {subject or f'Hello {i}'}\r\nFrom: a@b.c\r\nTo: d@e.f\r\n"
+        f"Date: Mon, 06 Oct 2025 10:00:00 +0000\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n"
+        f"{body or f'Body number {i}'}\r\n"
+    ).encode()
+
+
+class MailTestCase(TestCase):
+    """FakeImapServer + временное хранилище для сырых писем."""
+
+    uidvalidity = 1
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.server = mail_push.FakeImapServer(uidvalidity=self.uidvalidity)
+        self.addCleanup(self.server.close)
+
+    def sync(self, **kw):
+        conn = mail_sync.connect(self.server.config)
+        try:
+            return mail_sync.MailboxSync(conn, account="fake", **kw).run()
+        finally:
+            conn.logout()
+
+
+class LegacyUidTests(MailTestCase):
+    uidvalidity = 7
+
+    def legacy(self, uids):
+        InboundEmail.objects.bulk_create(InboundEmail(uid=str(u), subject=f"old {u}") for u in uids)
+
+    def test_first_sync_adopts_legacy_uids(self):
+        for i in range(1, 6):
+            self.server.deliver(make_raw(i))
+        self.legacy([1, 2, 3])
+
+        stats = self.sync()
+
+        self.assertEqual(stats["created"], 2)
+        self.assertEqual(
+            sorted(InboundEmail.objects.values_list("uid", flat=True)),
+            [f"INBOX:7:{i}" for i in range(1, 6)],
+        )
+
+    def test_legacy_uids_ignored_after_uidvalidity_change(self):
+        # старые письма от прежней нумерации, курсор уже когда-то сохранялся
+        self.legacy(range(3, 9))
+        MailboxSyncState.objects.create(account="fake", mailbox="INBOX", uidvalidity=5, uidnext=9)
+        for i in range(1, 6):
+            self.server.deliver(make_raw(100 + i))
+
+        stats = self.sync()
+
+        self.assertEqual(stats["created"], 5)
+        self.assertEqual(InboundEmail.objects.filter(uid__startswith="INBOX:7:").count(), 5)
+        self.assertEqual(InboundEmail.objects.filter(uid__regex=r"^[0-9]+$").count(), 6)
+
+    def test_incremental_sync_skips_known(self):
+        for i in range(1, 4):
+            self.server.deliver(make_raw(i))
+        self.assertEqual(self.sync()["created"], 3)
+        self.server.deliver(make_raw(4))
+
+        stats = self.sync()
+
+        self.assertEqual((stats["fetched"], stats["created"]), (1, 1))
+        self.assertEqual(InboundEmail.objects.count(), 4)
+
+
+class CreatedCountTests(MailTestCase):
+    def test_rows_inserted_meanwhile_are_not_counted(self):
+        for i in range(1, 4):
+            self.server.deliver(make_raw(i))
+        # второй процесс успел записать письмо после того, как этот прочитал известные UID
+        InboundEmail.objects.create(uid="INBOX:1:2", subject="by other worker")
+        with mock.patch.object(mail_sync.MailboxSync, "known_uids", return_value=set()):
+            stats = self.sync()
+
+        self.assertEqual((stats["fetched"], stats["created"]), (3, 2))
+        self.assertEqual(stats["uids"], ["INBOX:1:1", "INBOX:1:3"])
+        self.assertEqual(InboundEmail.objects.get(uid="INBOX:1:2").subject, "by other worker")
+
+
+class RawMailPurgeTests(MailTestCase):
+    def test_purge_keeps_referenced_and_fresh_files(self):
+        for i in range(1, 4):
+            self.server.deliver(make_raw(i))
+        self.sync()
+        gone, kept, *_ = InboundEmail.objects.order_by("uid")
+        # то же письмо из другого ящика делит файл с kept
+        InboundEmail.objects.create(uid="Archive:1:1", message_id=kept.message_id, raw_key=kept.raw_key)
+        kept.delete()
+        gone.delete()
+
+        self.assertEqual(raw_mail.purge_orphans(), 0)          # ещё в пределах grace
+        self.assertEqual(raw_mail.purge_orphans(grace_hours=0), 1)
+
+        self.assertFalse(default_storage.exists(gone.raw_key))
+        self.assertTrue(default_storage.exists(kept.raw_key))
+        self.assertEqual(InboundEmail.objects.get(uid="Archive:1:1").body_text, "Body number 2")
+
+
+class IdleTests(MailTestCase):
+    def connect(self):
+        conn = mail_sync.connect(self.server.config)
+        self.addCleanup(conn.logout)
+        conn.select("INBOX", readonly=True)
+        return conn
+
+    def test_idle_wakes_on_new_mail(self):
+        conn = self.connect()
+        threading.Timer(0.2, self.server.deliver, [make_raw(1)]).start()
+        started = time.monotonic()
+        self.assertTrue(mail_push.idle(conn, 10))
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_idle_sees_exists_buffered_with_continuation(self):
+        conn = self.connect()
+        self.server.deliver(make_raw(1))    # пришло до IDLE: сервер сообщит одним пакетом с «+ idling»
+        started = time.monotonic()
+        self.assertTrue(mail_push.idle(conn, 10))
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_idle_times_out_quietly(self):
+        self.assertFalse(mail_push.idle(self.connect(), 0.3))
+
+
+class WatcherReconnectTests(MailTestCase):
+    def watch(self, on_sync):
+        watcher = mail_push.IdleWatcher(idle_seconds=30, config=self.server.config, on_sync=on_sync)
+        stop = threading.Event()
+        thread = threading.Thread(target=watcher.serve, kwargs={"stop": stop}, daemon=True)
+        self.enterContext(mock.patch.object(mail_push, "BACKOFF_BASE", 0.05))
+        # без БД: синхронизация здесь не проверяется, только цикл демона
+        self.enterContext(mock.patch.object(mail_sync.MailboxSync, "run", return_value={"created": 0}))
+        thread.start()
+
+        def finish():
+            stop.set()
+            self.server.drop_connections()
+            thread.join(5)
+        self.addCleanup(finish)
+        return watcher
+
+    def wait_for(self, predicate, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            self.assertLess(time.monotonic(), deadline, "timed out")
+            time.sleep(0.02)
+
+    def test_reconnects_after_connection_drop(self):
+        synced = []
+        watcher = self.watch(synced.append)
+        self.wait_for(lambda: self.server.idlers)
+        self.server.drop_connections()
+        self.wait_for(lambda: watcher.connects >= 2 and len(synced) >= 2)
+
+    def test_reconnects_after_unexpected_error(self):
+        calls = []
+
+        def on_sync(stats):
+            calls.append(stats)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+        watcher = self.watch(on_sync)
+        with self.assertLogs("sales.services.mail_push", "ERROR"):
+            self.wait_for(lambda: watcher.connects >= 2 and len(calls) >= 2)
+
+
+class WatchInboxCommandTests(TestCase):
+    def config_for(self, *args):
+        with mock.patch.object(mail_push, "IdleWatcher") as watcher, mock.patch("signal.signal"), \
+                mock.patch.dict("os.environ", {"IMAP_USE_SSL": "true"}):
+            call_command("watch_inbox", *args, stdout=io.StringIO())
+        return watcher.call_args.kwargs["config"]
+
+    def test_host_override_keeps_tls(self):
+        config = self.config_for("--host", "mail.example.com")
+        self.assertEqual((config["host"], config["ssl"]), ("mail.example.com", True))
+
+    def test_no_ssl_is_explicit(self):
+        config = self.config_for("--host", "127.0.0.1", "--port", "1143", "--no-ssl")
+        self.assertEqual((config["port"], config["ssl"]), (1143, False))
@@ -0,0 +1,88 @@
+from datetime import date
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from sales.models import BookingSale, Company, OutboundEmail
+from sales.services import outbox
+
+
+class DeliverPendingTests(TestCase):
+    def setUp(self):
+        guide = get_user_model().objects.create_user("guide", password="x")
+        company = Company.objects.create(name="Agency", slug="agency", email_for_orders="office@agency.test")
+        self.bookings = [
+            BookingSale.objects.create(company=company, guide=guide, excursion_id=1, excursion_title="Ronda",
+                                       region_name="Málaga", date=date(2026, 5, 1), booking_code=f"B{i}")
+            for i in range(3)
+        ]
+        outbox.queue_emails("RESERVATION", self.bookings)
+        patcher = mock.patch.object(outbox, "_build_message", side_effect=self.build)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.on_build = None
+
+    def build(self, row, contexts=None):
+        if self.on_build:
+            self.on_build(row)
+        return EmailMessage(f"Reserva {row.booking.booking_code}", "body", to=["office@agency.test"])
+
+    def test_sends_whole_batch(self):
+        stats = outbox.deliver_pending()
+        self.assertEqual(stats, {"sent": 3, "retried": 0, "failed": 0, "skipped": 0})
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(OutboundEmail.objects.exclude(status="SENT").exists())
+
+    def test_row_taken_over_during_slow_batch_is_not_sent_twice(self):
+        last = OutboundEmail.objects.order_by("id").last()
+
+        def slow(row):
+            if row.pk != last.pk:
+                # пачка идёт дольше аренды: последнюю строку уже забрал другой воркер
+                OutboundEmail.objects.filter(pk=last.pk).update(next_attempt_at=timezone.now())
+        self.on_build = slow
+
+        stats = outbox.deliver_pending()
+
+        self.assertEqual((stats["sent"], stats["skipped"]), (2, 1))
+        self.assertEqual([m.subject for m in mail.outbox], ["Reserva B0", "Reserva B1"])
+        last.refresh_from_db()
+        self.assertEqual((last.status, last.attempts), ("PENDING", 0))
+
+
+class QueueDigestTests(TestCase):
+    @override_settings(BOOKINGS_FALLBACK_EMAIL="bookings@costasolinfo.test")
+    def test_groups_by_company_even_with_shared_address(self):
+        guide = get_user_model().objects.create_user("guide", password="x")
+        bookings = []
+        for slug in ("north", "south"):
+            company = Company.objects.create(name=slug.title(), slug=slug)     # без своего адреса — фолбэк
+            bookings += [
+                BookingSale.objects.create(company=company, guide=guide, excursion_id=1, region_name="Málaga",
+                                           date=date(2026, 5, 1), booking_code=f"{slug}{i}")
+                for i in range(2)
+            ]
+
+        batches = outbox.queue_digest_emails(bookings)
+
+        self.assertEqual(sorted(batches.values()), [[b.pk for b in bookings[:2]], [b.pk for b in bookings[2:]]])
+        digests = OutboundEmail.objects.filter(kind="DIGEST")
+        self.assertEqual(sorted(d.booking.company.slug for d in digests), ["north", "south"])
+
+
+class QueuedResponsesTests(TestCase):
+    def test_batch_cancel_reports_queued(self):
+        guide = get_user_model().objects.create_user("guide", password="x")
+        company = Company.objects.create(name="Agency", slug="agency")
+        b = BookingSale.objects.create(company=company, guide=guide, excursion_id=1, region_name="Málaga",
+                                       date=date(2026, 5, 1), booking_code="B1", status="PENDING")
+        self.client.force_login(guide)
+        resp = self.client.post("/api/sales/bookings/batch/cancel/", {"booking_ids": [b.pk]}, content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["email_status"], "queued")
+        self.assertNotIn("email_sent_ok", resp.json())
+        self.assertEqual(OutboundEmail.objects.filter(kind="CANCELLATION", status="PENDING").count(), 1)
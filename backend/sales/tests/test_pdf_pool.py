@@ -0,0 +1,51 @@
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from sales.services import pdf_pool
+
+
+class SlowHTML:
+    def __init__(self, **kw):
+        pass
+
+    def write_pdf(self):
+        time.sleep(5)
+        return b"%PDF"
+
+
+class WorkerDeadlineTests(SimpleTestCase):
+    """_render_in_worker вызывается прямо в тестовом процессе, как в процессе пула."""
+
+    def setUp(self):
+        self.enterContext(mock.patch.object(pdf_pool, "load_weasyprint", return_value=SlowHTML))
+        self.enterContext(mock.patch.dict(pdf_pool._worker_state, {"base_url": "http://assets.local/", "fetcher": None}))
+
+    def test_running_render_is_interrupted(self):
+        started = time.monotonic()
+        with self.assertRaises(pdf_pool.RenderTimeout):
+            pdf_pool._render_in_worker("<p>x</p>", time.time() + 0.2)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_task_past_deadline_is_skipped(self):
+        with mock.patch.object(SlowHTML, "write_pdf") as write_pdf, self.assertRaises(pdf_pool.RenderTimeout):
+            pdf_pool._render_in_worker("<p>x</p>", time.time() - 1)
+        write_pdf.assert_not_called()
+
+    def test_timer_is_cleared_after_render(self):
+        with mock.patch.object(SlowHTML, "write_pdf", return_value=b"%PDF"):
+            self.assertEqual(pdf_pool._render_in_worker("<p>x</p>", time.time() + 0.1), b"%PDF")
+        time.sleep(0.2)     # сигнал от снятого таймера не должен прилететь позже
+
+
+class WarmUpTests(SimpleTestCase):
+    def test_warm_document_uses_ticket_stylesheet(self):
+        html = pdf_pool._warm_html()
+        self.assertIn("@page { size: 72mm 100mm", html)
+        self.assertIn("DejaVu Sans", html)
+
+    def test_inline_mode_starts_nothing(self):
+        with mock.patch.object(pdf_pool, "WORKERS", 0), mock.patch("threading.Thread") as thread:
+            pdf_pool.warm_in_background()
+        thread.assert_not_called()
@@ -0,0 +1,84 @@
+import importlib.util
+import time
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.test import TestCase
+from django.utils import timezone
+
+from sales.models import PrintJob
+from sales.services import print_spooler
+
+
+class FlakyPort:
+    """Порт, который обрывается на записи `fail_on` (один раз)."""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.written = []
+        self.closed = 0
+
+    def write(self, data: bytes):
+        if data == self.fail_on:
+            self.fail_on = None
+            raise OSError("Write timeout")
+        self.written.append(data)
+
+    def close(self):
+        self.closed += 1
+
+
+def ticket(n: int) -> bytes:
+    return f"! 0 200 200 100 1\r\nTEXT 4 0 0 0 T{n}\r\nPRINT\r\n".encode()
+
+
+class SpoolerTests(TestCase):
+    def setUp(self):
+        self.jobs = PrintJob.objects.bulk_create(PrintJob(payload=ticket(i)) for i in range(3))
+
+    def due_now(self):
+        PrintJob.objects.filter(status="PENDING").update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+    def test_prints_batch_in_one_session(self):
+        port = FlakyPort()
+        stats = print_spooler.Spooler(port).run_once()
+        self.assertEqual(stats, {"printed": 3, "retried": 0, "failed": 0})
+        self.assertEqual(port.written, [ticket(0), ticket(1), ticket(2)])
+        self.assertEqual(port.closed, 0)
+        self.assertFalse(PrintJob.objects.exclude(status="DONE").exists())
+
+    def test_failure_mid_batch_retries_only_unprinted(self):
+        port = FlakyPort(fail_on=ticket(1))
+        spooler = print_spooler.Spooler(port)
+
+        self.assertEqual(spooler.run_once(), {"printed": 1, "retried": 2, "failed": 0})
+        self.assertEqual(port.closed, 1)
+        self.assertEqual(dict(PrintJob.objects.values_list("payload", "status")),
+                         {ticket(0): "DONE", ticket(1): "PENDING", ticket(2): "PENDING"})
+
+        self.due_now()
+        self.assertEqual(spooler.run_once()["printed"], 2)
+        self.assertEqual(port.written, [ticket(0), ticket(1), ticket(2)])    # каждый билет — ровно один раз
+
+    def test_gives_up_after_max_attempts(self):
+        PrintJob.objects.update(attempts=print_spooler.MAX_ATTEMPTS - 1)
+        stats = print_spooler.Spooler(FlakyPort(fail_on=ticket(0))).run_once()
+        self.assertEqual(stats, {"printed": 0, "retried": 0, "failed": 3})
+        self.assertEqual(set(PrintJob.objects.values_list("status", flat=True)), {"FAILED"})
+
+
+@skipUnless(importlib.util.find_spec("serial"), "pyserial не установлен")
+class FakePrinterTests(TestCase):
+    def test_serial_session_reaches_printer(self):
+        fake = print_spooler.FakePrinter()
+        self.addCleanup(fake.close)
+        PrintJob.objects.bulk_create(PrintJob(payload=ticket(i)) for i in range(2))
+        device = print_spooler.SerialPrinter(fake.port)
+        self.addCleanup(device.close)
+
+        self.assertEqual(print_spooler.Spooler(device).run_once()["printed"], 2)
+        deadline = time.monotonic() + 2
+        while fake.jobs_printed() < 2 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(fake.jobs_printed(), 2)
+        self.assertEqual(device.sessions, 1)
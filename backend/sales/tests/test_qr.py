@@ -0,0 +1,41 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.test import SimpleTestCase, override_settings
+
+from sales.services import qr
+
+
+class QrCacheTests(SimpleTestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        for fn in (qr.qr_png, qr.qr_data_uri):
+            fn.cache_clear()
+            self.addCleanup(fn.cache_clear)
+        self.generate = self.enterContext(mock.patch.object(qr, "_generate", side_effect=lambda d, s: f"png:{s}:{d}".encode()))
+
+    def test_memory_hit(self):
+        url = "https://maps.example/pickup-1"
+        self.assertEqual(qr.qr_png(url, 100), qr.qr_png(url, 100))
+        self.assertEqual(self.generate.call_count, 1)
+        self.assertEqual(qr.qr_png.cache_info().hits, 1)
+
+    def test_disk_reused_by_other_process(self):
+        url = "https://maps.example/pickup-2"
+        png = qr.qr_png(url, 100)
+        self.assertTrue(default_storage.exists(qr._cache_name(url, 100)))
+
+        qr.qr_png.cache_clear()         # как другой воркер: память пустая, файл на диске есть
+        self.assertEqual(qr.qr_png(url, 100), png)
+        self.assertEqual(self.generate.call_count, 1)
+
+    def test_size_is_part_of_key(self):
+        url = "https://maps.example/pickup-3"
+        qr.qr_png(url, 100)
+        qr.qr_png(url, 200)
+        self.assertEqual(self.generate.call_count, 2)
+        self.assertTrue(qr.qr_data_uri(url, 100).startswith("data:image/png;base64,"))
@@ -0,0 +1,47 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from sales.models import BookingSale, Company, FamilyBooking, Traveler
+from sales.services import requirements
+
+
+class RequirementsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        guide = get_user_model().objects.create_user("guide", password="x")
+        company = Company.objects.create(name="Agency", slug="agency")
+        fam = FamilyBooking.objects.create(ref_code="R1", hotel_id=1, hotel_name="Hotel", region_name="Málaga")
+        self.anna = Traveler.objects.create(family=fam, first_name="Anna", last_name="Ivanova",
+                                            passport="X1", nationality="RU")
+        self.oleg = Traveler.objects.create(family=fam, first_name="Oleg", last_name="Ivanov", nationality="RU")
+        self.booking = BookingSale.objects.create(
+            company=company, guide=guide, family=fam, excursion_id=1, excursion_title="Гранада и Альгамбра",
+            region_name="Málaga", date=date(2026, 5, 1), booking_code="B1",
+            travelers_csv=f"{self.anna.pk};{self.oleg.pk}",
+        )
+
+    def test_parse_travelers_csv_accepts_semicolons(self):
+        self.assertEqual(requirements.parse_travelers_csv("12, 15;33;x"), [12, 15, 33])
+
+    def test_missing_fields_reported(self):
+        problems = requirements.validate_bookings([self.booking])[self.booking.pk]
+        self.assertEqual(problems, [{"booking_id": self.booking.pk, "traveler_id": self.oleg.pk, "missing": ["passport"]}])
+
+    def test_cache_sees_changes_without_signals(self):
+        self.assertIn(self.booking.pk, requirements.validate_bookings([self.booking]))
+        # как импорт или другой процесс: bulk_update без post_save, локальный кэш не сбрасывался
+        self.oleg.passport, self.oleg.updated_at = "X2", timezone.now()
+        Traveler.objects.bulk_update([self.oleg], ["passport", "updated_at"])
+        self.assertEqual(requirements.validate_bookings([self.booking]), {})
+
+    def test_cache_sees_deleted_traveler(self):
+        self.oleg.passport = "X2"
+        self.oleg.save()
+        self.assertEqual(requirements.validate_bookings([self.booking]), {})
+        Traveler.objects.filter(pk=self.anna.pk)._raw_delete("default")
+        problems = requirements.validate_bookings([self.booking])[self.booking.pk]
+        self.assertEqual(problems[0]["missing"], ["not_found"])
@@ -0,0 +1,27 @@
+from django.test import SimpleTestCase
+
+from sales.services import thermal
+
+FIELDS = {
+    "title_en": "Granada", "booking_code": "ABCDE12345", "date_en": "Friday, 1 May 2026",
+    "excursion_language": "ru", "company_name": "Агентство Юг", "hotel_name": "Hotel Sol",
+    "pickup_time_str": "08:15", "adults": 2, "children": 0, "infants": 0,
+    "travelers": ["Щукина Юлия", "José Müller"],
+    "qr_site_url": "https://costasolinfo.com", "qr_maps_url": "https://maps.example/p",
+}
+
+
+class FoldTests(SimpleTestCase):
+    def test_cyrillic_is_transliterated(self):
+        self.assertEqual(thermal._fold("Пётр Щукин"), "Petr Shchukin")
+        self.assertEqual(thermal._fold("Мальцева Юлия"), "Maltseva Iuliia")
+        self.assertEqual(thermal._fold("Підгірний Євген"), "Pidgirnii Ievgen")
+
+    def test_latin_accents_stripped(self):
+        self.assertEqual(thermal._fold(" José\nMüller "), "Jose Muller")
+
+    def test_cpcl_keeps_guest_names(self):
+        cpcl = thermal.render_cpcl(FIELDS).decode("ascii")
+        self.assertIn("Shchukina Iuliia", cpcl)
+        self.assertIn("Company: Agentstvo Iug", cpcl)
+        self.assertNotIn("?", cpcl)
@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+
+from sales import views_api
+from sales.services import qr, tickets
+
+
+class PurgeCacheTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+
+    def put(self, name: str, age_days: int = 0) -> str:
+        name = default_storage.save(name, ContentFile(b"x"))
+        old = time.time() - age_days * 86400
+        os.utime(default_storage.path(name), (old, old))
+        return name
+
+    def test_purges_old_tickets_and_qr_images(self):
+        old_pdf = self.put(f"{tickets.CACHE_PREFIX}/ab/old.pdf", 40)
+        new_pdf = self.put(f"{tickets.CACHE_PREFIX}/ab/new.pdf")
+        old_qr = self.put(f"{qr.CACHE_PREFIX}/cd/old.png", 40)
+        new_qr = self.put(f"{qr.CACHE_PREFIX}/cd/new.png", 1)
+
+        self.assertEqual(tickets.purge_older_than(30), 2)
+
+        self.assertEqual([default_storage.exists(n) for n in (old_pdf, new_pdf, old_qr, new_qr)],
+                         [False, True, False, True])
+
+
+class TicketsPdfViewTests(TestCase):
+    def test_too_many_ids_rejected_before_query(self):
+        ids = ",".join(str(i) for i in range(1, views_api.TICKETS_PDF_MAX + 2))
+        with self.assertNumQueries(0):
+            resp = self.client.get("/api/sales/bookings/tickets.pdf", {"ids": ids})
+        self.assertEqual(resp.status_code, 400)
@@ -58,13 +58,24 @@ urlpatterns = [
     # Бронирования (боевые)
     path("bookings/create/", v.BookingCreateView.as_view(), name="booking-create"),
     path("bookings/", v.BookingListView.as_view(), name="booking-list"),
+    path("bookings/export/", v.bookings_export, name="bookings-export"),
     path("bookings/family/<int:fam_id>/drafts/", v.FamilyBookingDraftsView.as_view(), name="family-drafts"),
     path("bookings/batch/preview/", v.BookingBatchPreviewView.as_view(), name="bookings-batch-preview"),
     path("bookings/batch/send/", v.BookingBatchSendView.as_view(), name="bookings-batch-send"),
     path("bookings/<int:pk>/ticket.pdf", v.booking_ticket_pdf, name="booking-ticket-pdf"),
+    path("bookings/<int:pk>/ticket.cpcl", v.booking_ticket_thermal, {"fmt": "cpcl"}, name="booking-ticket-cpcl"),
+    path("bookings/<int:pk>/ticket.zpl", v.booking_ticket_thermal, {"fmt": "zpl"}, name="booking-ticket-zpl"),
+    path("bookings/tickets.pdf", v.bookings_tickets_pdf, name="bookings-tickets-pdf"),
+    path("bookings/print/", v.BookingPrintView.as_view(), name="bookings-print"),
 
     # Бронирования — работа с отдельной бронью
     path("bookings/<int:pk>/", v.BookingDetailView.as_view(), name="booking-detail"),
     path("bookings/<int:pk>/cancel/", v.BookingCancelView.as_view(), name="booking-cancel"),
     path("bookings/batch/cancel/", v.BookingBatchCancelView.as_view(), name="bookings-batch-cancel"),
+
+    # Входящие письма
+    path("inbound-emails/search/", v.InboundEmailSearchView.as_view(), name="inbound-emails-search"),
+
+    # Фоновый импорт туристов
+    path("imports/<int:pk>/", v.ImportJobView.as_view(), name="import-job"),
 ]
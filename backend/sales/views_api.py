@@ -1,91 +1,47 @@
 # backend/sales/views_api.py
-# --- TEMP PATCH: pydyf PDF ctor mismatch (WeasyPrint 61.x expects args) ---
+# PDF-стек (WeasyPrint, pydyf, qrcode, PIL) грузится лениво в services.pdf_pool / services.qr
 import re, html
 
-def pick_title_en(title: str, max_words: int = 3) -> str:
-    if not title:
-        return ""
-    # 1) сперва ищем английский сегмент после разделителей
-    parts = re.split(r"\s*[\/\|\-–—]\s*", title)
-    for part in parts:
-        words = re.findall(r"[A-Za-z][A-Za-z'’\-]*", part)
-        if words:
-            return " ".join(words[:max_words])
-    # 2) иначе любые английские слова из всей строки
-    words = re.findall(r"[A-Za-z][A-Za-z'’\-]*", title)
-    if words:
-        return " ".join(words[:max_words])
-    # 3) фолбэк — первое слово исходного названия
-    return (title.strip().split() or [""])[0]
-
-import inspect
-import pydyf
-
-if len(inspect.signature(pydyf.PDF.__init__).parameters) == 1:  # только (self)
-    _orig_init = pydyf.PDF.__init__
-
-    def _patched_init(self, version='1.7', identifier=None, *args, **kwargs):
-        # старый pydyf не ждет аргументы -> просто вызываем оригинал
-        _orig_init(self)
-        # WeasyPrint ожидает, что у PDF есть .version (bytes) и .identifier
-        try:
-            self.version = (
-                version if isinstance(version, (bytes, bytearray))
-                else str(version).encode('ascii')
-            )
-        except Exception:
-            self.version = b'1.7'
-        self.identifier = identifier
-
-    pydyf.PDF.__init__ = _patched_init
-# --- END TEMP PATCH ---
-
-from urllib.parse import quote_plus
-from PIL import Image
-from pathlib import Path
 from collections import defaultdict
 from datetime import date
 from decimal import Decimal
-from weasyprint import HTML
-from io import BytesIO
-import io
-import base64, os
-import qrcode
 import datetime as dt
 from django.utils import timezone
 from django.db import transaction
 from rest_framework.parsers import JSONParser
-from sales.services.emails import send_booking_email
-
-from sales.services.emails import send_cancellation_email
+from sales.services.outbox import queue_emails, queue_digest_emails, queue_cancellation_email
 from sales.services.titles import spanish_excursion_name, compose_bilingual_title
+from sales.services.requirements import validate_bookings as _validate_bookings
+from sales.idempotency import idempotent
+from sales.services import tickets, pdf_pool, thermal, print_spooler, inbound_search, import_jobs
+from sales.services.hotels import resolve as resolve_hotel
 
 from django.db.models import Q
 from django.core.exceptions import FieldError   # ← ДОБАВИТЬ
 from django.conf import settings
 from django.contrib.auth import get_user_model, authenticate, login as auth_login
 from django.shortcuts import render, get_object_or_404
-from django.template.loader import render_to_string
-from django.templatetags.static import static
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_GET, require_POST
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie, csrf_protect
 from django.middleware.csrf import get_token
 from django.utils.dateparse import parse_date
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import never_cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from sales.services.costasolinfo import NotFoundError
 from .services import costasolinfo as csi
 from .services.costasolinfo import get_client, pricing_quote
 from rest_framework.authentication import SessionAuthentication
 
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.generics import RetrieveAPIView
 from rest_framework.views import APIView
 from rest_framework import status, viewsets
-from .models import FamilyBooking, Traveler, Company, BookingSale
+from .models import FamilyBooking, Traveler, Company, BookingSale, InboundEmail
 from django.apps import apps
 from .serializers import (
     CompanySerializer,
@@ -105,120 +61,146 @@ WEEKDAYS = ["mon","tue","wed","thu","fri","sat","sun"]
 
 FamilyBooking = apps.get_model('sales', 'FamilyBooking')
 
-logo_path = os.path.join(settings.BASE_DIR, "sales", "static", "sales", "logo.png")
-logo_b64 = ""
-if os.path.exists(logo_path):
-    with open(logo_path, "rb") as f:
-        logo_b64 = base64.b64encode(f.read()).decode("utf-8")
 
+def _ticket_pdf_response(request, digest: str, produce, filename: str):
+    """
+    Общая часть ticket.pdf / tickets.pdf: ETag = hash содержимого, 304 на
+    условный GET без рендера, 503 если очередь рендера занята.
+    produce() → (digest, pdf, rendered_at).
+    """
+    etag = f'"{digest}"'
+    rendered_at = tickets.cached_info(digest)
+    not_modified = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(rendered_at.timestamp()) if rendered_at else None,
+    )
+    if not_modified is not None:
+        return not_modified
+
+    # рендер без HTTP-запросов к себе: ассеты читаются с диска (services.pdf_assets)
+    try:
+        _, pdf, rendered_at = produce()
+    except (pdf_pool.RenderBusy, pdf_pool.RenderTimeout) as e:
+        resp = JsonResponse({"detail": str(e)}, status=503)
+        resp["Retry-After"] = "2"
+        return resp
+
+    resp = HttpResponse(pdf, content_type="application/pdf")
+    resp["Content-Disposition"] = f'inline; filename="{filename}"'
+    resp["ETag"] = etag
+    resp["Last-Modified"] = http_date(rendered_at.timestamp())
+    resp["Cache-Control"] = "private, no-cache"   # браузер кэширует, но всегда сверяет ETag
+    return resp
 
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def booking_ticket_pdf(request, pk: int):
-    from .models import BookingSale, Traveler
-
-    # --- утилита для английского короткого названия ---
-    def pick_title_en(title: str, max_words: int = 3) -> str:
-        if not title:
-            return ""
-        # сначала пытаемся вытащить англ. сегмент после разделителей
-        parts = re.split(r"\s*[\/\|\-–—]\s*", title)
-        for part in parts:
-            words = re.findall(r"[A-Za-z][A-Za-z'’\-]*", part)
-            if words:
-                return " ".join(words[:max_words])
-        # затем любые англ. слова из всей строки
-        words = re.findall(r"[A-Za-z][A-Za-z'’\-]*", title)
-        if words:
-            return " ".join(words[:max_words])
-        # фолбэк — первое слово целиком
-        return (title.strip().split() or [""])[0]
-
-    b = get_object_or_404(BookingSale, pk=pk)
-
-    # 1) Дата EN
-    d = getattr(b, "date", None) or localdate()
-    try:
-        date_en = d.strftime("%-d %B %Y")   # macOS/Linux
-    except Exception:
-        date_en = d.strftime("%d %B %Y")    # Windows fallback
-
-    # 2) Гости
-    travelers = []
-    if getattr(b, "travelers_names", None):
-        travelers = [x.strip() for x in b.travelers_names.splitlines() if x.strip()]
-    if not travelers:
-        ids_raw = (getattr(b, "travelers_csv", "") or "").strip()
-        if ids_raw:
-            try:
-                ids = [int(x) for x in ids_raw.replace(";", ",").split(",") if x.strip().isdigit()]
-                qs = Traveler.objects.filter(id__in=ids).order_by("id")
-                travelers = [f"{t.first_name} {t.last_name}".strip() for t in qs]
-            except Exception:
-                travelers = []
-
-    # 3) Два QR
-    # 3a) сайт
-    qr_site_url = f"https://www.costasolinfo.com/?ref={b.booking_code}"
-    # 3b) карта точки (координаты приоритетны)
-    lat = getattr(b, "pickup_lat", None)
-    lng = getattr(b, "pickup_lng", None)
-    if lat and lng:
-        maps_query = f"{lat},{lng}"
-    else:
-        parts = [getattr(b, "pickup_point_name", ""), getattr(b, "hotel_name", ""), "Costa del Sol"]
-        maps_query = " ".join(p for p in parts if p)
-    qr_maps_url = f"https://www.google.com/maps/search/?api=1&query={quote_plus(maps_query)}"
-
-    def make_qr_data_uri(url: str, size=(100, 100)) -> str:
-        img = qrcode.make(url)              # PIL.Image
-        if size:
-            img = img.resize(size, Image.NEAREST)
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("utf-8")
-
-    qr_site = make_qr_data_uri(qr_site_url)
-    qr_maps = make_qr_data_uri(qr_maps_url)
-
-    # 4) Логотип через static (WeasyPrint подтянет благодаря base_url)
-    logo_url = request.build_absolute_uri(static("sales/logo.png"))
-
-    # 5) Английское короткое название (ВАЖНО: посчитать ДО ctx)
-    title_en = pick_title_en(getattr(b, "excursion_title", ""), max_words=3)
-
-    # 6) Рендер
-    ctx = {
-        "b": b,
-        "date_en": date_en,
-        "travelers": travelers,
-        "logo_url": logo_url,
-        "qr_site": qr_site,
-        "qr_maps": qr_maps,
-        "qr_site_url": qr_site_url,
-        "qr_maps_url": qr_maps_url,
-        "title_en": title_en,
-    }
-    html = render_to_string("sales/ticket.html", ctx)
-    pdf = HTML(string=html, base_url=request.build_absolute_uri("/")).write_pdf()
+    """
+    GET /api/sales/bookings/<pk>/ticket.pdf
+    PDF берётся из кэша по содержимому (services.tickets); ETag = hash полей
+    билета, поэтому повторные открытия гидом отдаются как 304 без рендера.
+    """
+    b = get_object_or_404(BookingSale.objects.select_related("company"), pk=pk)
+    fields = tickets.ticket_fields(b)
+    return _ticket_pdf_response(
+        request,
+        tickets.fingerprint(fields),
+        lambda: tickets.get_ticket_pdf(b, fields=fields),
+        f"ticket_{b.booking_code}.pdf",
+    )
 
-    resp = HttpResponse(pdf, content_type="application/pdf")
-    resp["Content-Disposition"] = f'inline; filename="ticket_{b.booking_code}.pdf"'
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def booking_ticket_thermal(request, pk: int, fmt: str):
+    """
+    GET /api/sales/bookings/<pk>/ticket.cpcl | ticket.zpl
+    Тот же билет в родных командах Zebra (текст + QR принтера), без PDF.
+    """
+    b = get_object_or_404(BookingSale.objects.select_related("company"), pk=pk)
+    payload = thermal.render_booking(b, fmt)
+    resp = HttpResponse(payload, content_type="application/octet-stream")
+    resp["Content-Disposition"] = f'attachment; filename="ticket_{b.booking_code}.{fmt}"'
     return resp
 
-def encode_logo_b64(max_w=400, max_h=120):
-    path = Path(settings.BASE_DIR) / "sales" / "static" / "sales" / "logo.png"
-    if not path.exists():
-        return ""
-    with Image.open(path) as im:
-        im = im.convert("RGBA")
-        im.thumbnail((max_w, max_h))  # мягкое масштабирование, сохранит пропорции
-        buf = io.BytesIO()
-        im.save(buf, format="PNG")
-        return base64.b64encode(buf.getvalue()).decode("utf-8")
 
-logo_b64 = encode_logo_b64()
+@method_decorator(csrf_exempt, name="dispatch")
+class BookingPrintView(APIView):
+    """
+    POST /api/sales/bookings/print/
+    Body JSON: { "family_id": 123 } ИЛИ { "booking_ids": [1,2,3] },
+               опционально "format": "cpcl"|"zpl", "printer": "<имя>"
+    Ставит билеты в очередь спулера Zebra (manage.py print_spooler).
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    @idempotent("bookings-print")
+    def post(self, request):
+        booking_ids = request.data.get("booking_ids") or []
+        family_id = request.data.get("family_id")
+        fmt = (request.data.get("format") or "cpcl").lower()
+        printer = (request.data.get("printer") or "default").strip()[:64]
+        if fmt not in thermal.RENDERERS:
+            return Response({"detail": "format must be 'cpcl' or 'zpl'"}, status=400)
+
+        qs = BookingSale.objects.select_related("company")
+        if booking_ids:
+            qs = qs.filter(id__in=booking_ids)
+        elif family_id:
+            qs = qs.filter(family_id=family_id).exclude(status="CANCELLED")
+        else:
+            return Response({"detail": "Pass family_id or booking_ids"}, status=400)
+
+        jobs = print_spooler.queue_tickets(list(qs.order_by("date", "id")), fmt=fmt, printer=printer)
+        return Response({"queued": len(jobs), "job_ids": [j.id for j in jobs], "printer": printer}, status=200)
+
+
+TICKETS_PDF_MAX = 100
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def bookings_tickets_pdf(request):
+    """
+    GET /api/sales/bookings/tickets.pdf?family_id=<id>
+    GET /api/sales/bookings/tickets.pdf?ids=1,2,3
+    Все билеты одним PDF (страница на бронь) за один рендер — для печати
+    на стойке отеля. Для семьи берутся неаннулированные брони по дате.
+    """
+    family_id = request.GET.get("family_id")
+    ids_raw = request.GET.get("ids") or ""
+    qs = BookingSale.objects.select_related("company")
+
+    if ids_raw:
+        ids = list(dict.fromkeys(int(x) for x in ids_raw.split(",") if x.strip().isdigit()))
+        if len(ids) > TICKETS_PDF_MAX:      # до запроса к БД
+            return Response({"detail": f"Too many tickets (max {TICKETS_PDF_MAX})"}, status=400)
+        by_id = qs.in_bulk(ids)
+        bookings = [by_id[i] for i in ids if i in by_id]   # порядок как в запросе
+    elif family_id and str(family_id).isdigit():
+        bookings = list(
+            qs.filter(family_id=int(family_id))
+            .exclude(status="CANCELLED")
+            .order_by("date", "id")[:TICKETS_PDF_MAX + 1]   # лишнюю читаем только чтобы отказать
+        )
+    else:
+        return Response({"detail": "Pass family_id or ids"}, status=400)
+
+    if not bookings:
+        return Response({"detail": "No bookings found"}, status=404)
+    if len(bookings) > TICKETS_PDF_MAX:
+        return Response({"detail": f"Too many tickets (max {TICKETS_PDF_MAX})"}, status=400)
+
+    pairs = [(b, tickets.ticket_fields(b)) for b in bookings]
+    digest = tickets.multi_fingerprint([f for _, f in pairs])
+    name = f"tickets_family_{family_id}.pdf" if not ids_raw else f"tickets_{len(pairs)}.pdf"
+    return _ticket_pdf_response(
+        request, digest, lambda: tickets.get_tickets_pdf(pairs, digest=digest), name,
+    )
+
 
 @ensure_csrf_cookie
 def csrf_view(request):
@@ -266,7 +248,7 @@ def login_view(request):
     }, status=200)
 
 class BookingSaleViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = BookingSale.objects.all()
+    queryset = BookingSale.objects.select_related("company")
 
     def get_serializer_class(self):
         # список -> краткий; деталка -> детальный
@@ -327,46 +309,14 @@ def _resolve_user(request):
         .first()
     )
 
-def _normalize_name(s: str) -> str:
-    """Убираем лишнее и приводим к нижнему регистру для сравнения."""
-    s = (s or "").strip().lower()
-    s = re.sub(r"\s+", " ", s)
-    return s
-
 def _resolve_hotel_id_by_name(hotel_name: str) -> int | None:
     """
-    Ищет hotel_id в CSI по названию отеля.
-    Приоритет: точное совпадение → начинается с → первый результат.
+    Ищет hotel_id по названию отеля: сначала таблица алиасов,
+    потом CSI (точное совпадение → начинается с → первый результат).
     """
     if not hotel_name:
         return None
-
-    try:
-        res = csi.search_hotels(hotel_name, limit=10)
-        items = res if isinstance(res, list) else (res.get("items") or [])
-        if not items:
-            return None
-
-        target = _normalize_name(hotel_name)
-        # 1) точное совпадение
-        for it in items:
-            name = _normalize_name(it.get("name") or it.get("title") or "")
-            if name == target:
-                return int(it.get("id"))
-
-        # 2) начинается с
-        for it in items:
-            name = _normalize_name(it.get("name") or it.get("title") or "")
-            if name.startswith(target) or target.startswith(name):
-                return int(it.get("id"))
-
-        # 3) первый адекватный
-        for it in items:
-            if it.get("id"):
-                return int(it["id"])
-    except Exception:
-        pass
-    return None
+    return resolve_hotel(hotel_name).id
 
 def _weekday_slug(date_str: str) -> str | None:
     # Делает парсер терпимым: обрезаем мусор, берём только YYYY-MM-DD
@@ -843,73 +793,6 @@ class FamilyBookingDraftsView(APIView):
         return Response(rows)
 
 
-SPECIAL_MAP = {
-    # требования «на каждого участника»
-    "granada":   {"all": ["first_name", "last_name", "passport", "nationality"]},
-    "gibraltar": {"all": ["nationality"]},
-    "tangier":   {"all": ["first_name", "last_name", "passport", "nationality", "gender", "dob", "doc_type", "doc_expiry"]},
-    "seville":   {"all": ["first_name", "last_name", "passport", "nationality", "dob"]},  # возраст считаем из dob
-}
-
-SPECIAL_TITLES = {
-    "granada":  ("granada", "гранада"),
-    "gibraltar":("gibraltar", "гибралтар"),
-    "tangier":  ("tanger", "tangier", "танжер"),
-    "seville":  ("seville", "севилья"),
-}
-
-def _guess_special_key(title: str | None) -> str | None:
-    s = (title or "").lower()
-    for key, needles in SPECIAL_TITLES.items():
-        if any(n in s for n in needles):
-            return key
-    return None
-
-def _parse_travelers_csv(csv: str) -> list[int]:
-    return [int(x) for x in str(csv or "").split(",") if x.strip().isdigit()]
-
-def _validate_booking_requirements(b) -> list[dict]:
-    """
-    Проверяет бронь b на спец-требования.
-    Возвращает список проблем:
-      {"booking_id": int, "traveler_id": int|None, "missing": [field,...]}
-    Пустой список = всё ок.
-    """
-    key = _guess_special_key(getattr(b, "excursion_title", ""))
-    if not key:
-        return []  # не спецэкскурсия
-
-    need = SPECIAL_MAP.get(key, {}).get("all", [])
-    trav_ids = _parse_travelers_csv(getattr(b, "travelers_csv", ""))
-
-    problems = []
-    if not trav_ids:
-        problems.append({"booking_id": b.id, "traveler_id": None, "missing": ["participants"]})
-        return problems
-
-    # Разом тянем нужные поля
-    fields = ["id", "first_name", "last_name", "passport", "nationality", "dob", "gender", "doc_type", "doc_expiry", "passport_expiry"]
-    travelers = {t.id: t for t in Traveler.objects.filter(id__in=trav_ids).only(*fields)}
-
-    for tid in trav_ids:
-        t = travelers.get(tid)
-        if not t:
-            problems.append({"booking_id": b.id, "traveler_id": tid, "missing": ["not_found"]})
-            continue
-        miss = []
-        for f in need:
-            val = getattr(t, f, None)
-            if not val:
-                # допускаем подмену doc_expiry на паспортный срок, если он есть
-                if f == "doc_expiry" and getattr(t, "passport_expiry", None):
-                    continue
-                miss.append(f)
-        if miss:
-            problems.append({"booking_id": b.id, "traveler_id": tid, "missing": miss})
-
-    return problems
-
-
 @method_decorator(csrf_exempt, name="dispatch")
 class BookingBatchPreviewView(APIView):
     """
@@ -942,17 +825,17 @@ class BookingBatchPreviewView(APIView):
         total = 0.0
         blocked = 0
 
-        # Валидация спец-экскурсий на лету
-        problems_all = {}  # booking_id -> [problem,...]
+        # Валидация спец-экскурсий пачкой (результат кэшируется и для send)
+        bookings = list(qs.order_by("-created_at"))
+        problems_all = _validate_bookings(bookings)  # booking_id -> [problem,...]
 
-        for b in qs.order_by("-created_at"):
+        for b in bookings:
             gross = float(b.gross_total or 0)
             total += gross
 
-            probs = _validate_booking_requirements(b)
+            probs = problems_all.get(b.id, [])
             if probs:
                 blocked += 1
-                problems_all[b.id] = probs
 
             items.append({
                 "id": b.id,
@@ -994,15 +877,18 @@ class BookingBatchPreviewView(APIView):
 class BookingBatchSendView(APIView):
     """
     POST /api/sales/bookings/batch/send/
-    Body JSON: { "family_id": 123 } ИЛИ { "booking_ids": [1,2,3] }
-    Переводит выбранные черновики из DRAFT -> PENDING и (опционально) запускает отправку.
+    Body JSON: { "family_id": 123 } ИЛИ { "booking_ids": [1,2,3] }, опционально "digest": true
+    Переводит выбранные черновики из DRAFT -> PENDING и ставит письма партнёрам в outbox.
+    digest=true: одно письмо на партнёра (группа по email_for_orders) с общим batch_code.
     """
     authentication_classes = []
     permission_classes = [AllowAny]
 
+    @idempotent("bookings-batch-send")
     def post(self, request):
         booking_ids = request.data.get("booking_ids") or []
         family_id = request.data.get("family_id")
+        digest = str(request.data.get("digest") or "").lower() in ("1", "true", "yes")
 
         user = _resolve_user(request)
 
@@ -1018,10 +904,12 @@ class BookingBatchSendView(APIView):
         except FieldError:
             return Response({"detail": "В модели BookingSale нет поля family."}, status=400)
 
-        # Валидация перед отправкой: если есть «дыры» — 422 и список проблем
-        problems = []
-        for b in qs:
-            problems += _validate_booking_requirements(b)
+        bookings = list(qs)           # материализуем queryset, чтобы переиспользовать
+
+        # Валидация перед отправкой: если есть «дыры» — 422 и список проблем.
+        # После preview результат обычно уже лежит в кэше.
+        problems_map = _validate_bookings(bookings)
+        problems = [p for b in bookings for p in problems_map.get(b.id, [])]
 
         if problems:
             return Response(
@@ -1029,35 +917,27 @@ class BookingBatchSendView(APIView):
                 status=422  # Unprocessable Entity
             )
 
-        # --- отправка писем + перевод статусов ---------------------------------------
-        bookings = list(qs)           # материализуем queryset, чтобы переиспользовать
-        sent_ids = []
-        failed_ids = []
-
-        for b in bookings:
-            try:
-                ok = send_booking_email(b, subject_prefix="[SalesPortal]")
-            except Exception:
-                ok = False
-            if ok:
-                sent_ids.append(b.id)
+        # --- постановка писем в outbox + перевод статусов (одной транзакцией) --------
+        # Само SMTP делает воркер `manage.py send_outbox`, ответ уходит сразу.
+        sent_ids = [b.id for b in bookings]
+        batches = {}
+        with transaction.atomic():
+            if digest:
+                batches = queue_digest_emails(bookings)
             else:
-                failed_ids.append(b.id)
-
-        # Переводим в PENDING только те, что реально ушли
-        if sent_ids:
-            upd = {"status": "PENDING"}
-            if hasattr(BookingSale, "sent_at"):
-                upd["sent_at"] = timezone.now()
-            BookingSale.objects.filter(id__in=sent_ids).update(**upd)
+                queue_emails("RESERVATION", bookings)
+            if sent_ids:
+                BookingSale.objects.filter(id__in=sent_ids).update(status="PENDING")
 
         return Response(
             {
-                "sent": len(sent_ids),
-                "failed_ids": failed_ids,
+                "email_status": "queued",                                # письма ещё не отправлены — их шлёт outbox
+                "queued": len(batches) if digest else len(sent_ids),   # писем в очереди
+                "batches": batches,                                      # {batch_code: [ids]} в режиме digest
+                "failed_ids": [],
                 "updated_to_pending": len(sent_ids),
             },
-            status=200 if sent_ids and not failed_ids else 207  # 207 = частичный успех
+            status=200 if sent_ids else 207  # 207 = частичный успех
         )
 
 
@@ -1075,6 +955,7 @@ class BookingBatchCancelView(APIView):
     authentication_classes = []
     permission_classes = [AllowAny]
 
+    @idempotent("bookings-batch-cancel")
     @transaction.atomic
     def post(self, request):
         booking_ids = request.data.get("booking_ids") or []
@@ -1103,14 +984,8 @@ class BookingBatchCancelView(APIView):
         if not to_cancel and not already:
             return Response({"updated": 0, "cancelled_ids": [], "already_cancelled": []}, status=200)
 
-        # 1) Письма об аннуляции (не прерывают процесс, просто считаем успех/ошибки)
-        emailed_ok, emailed_fail = [], []
-        for b in BookingSale.objects.filter(id__in=to_cancel):
-            try:
-                ok = send_cancellation_email(b, reason)
-            except Exception:
-                ok = False
-            (emailed_ok if ok else emailed_fail).append(b.id)
+        # 1) Письма об аннуляции — в outbox, в этой же транзакции (шлёт воркер)
+        queue_emails("CANCELLATION", BookingSale.objects.filter(id__in=to_cancel), reason=reason)
 
         # 2) Обновляем статус/время/причину для всех к аннуляции
         now = timezone.now()
@@ -1127,8 +1002,8 @@ class BookingBatchCancelView(APIView):
             "updated": len(to_cancel),
             "cancelled_ids": to_cancel,      # все, кому сменили статус
             "already_cancelled": already,    # были отменены раньше
-            "email_sent_ok": emailed_ok,     # для логов/индикаторов на фронте
-            "email_failed_ids": emailed_fail
+            "email_status": "queued",        # письма ещё не отправлены — их шлёт outbox
+            "email_queued": to_cancel,
         }, status=200)
 
 
@@ -1562,6 +1437,7 @@ class BookingCreateView(APIView):
     authentication_classes = []          # ← отключаем DRF SessionAuthentication (и его CSRF)
     permission_classes = [AllowAny]      # как и было для dev
 
+    @idempotent("bookings-create")
     def post(self, request):
         ser = BookingSaleCreateSerializer(data=request.data, context={"request": request})
         ser.is_valid(raise_exception=True)
@@ -1572,10 +1448,144 @@ class BookingListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        qs = BookingSale.objects.filter(guide=request.user).order_by("-created_at")[:200]
+        qs = (
+            BookingSale.objects
+            .filter(guide=request.user)
+            .select_related("company")
+            .order_by("-created_at")[:200]
+        )
         return Response(BookingSaleListSerializer(qs, many=True).data)
 
 
+# ───── Потоковая выгрузка броней (NDJSON / CSV) ───────────────────────────────
+EXPORT_COLUMNS = [
+    ("id", "id"),
+    ("booking_code", "booking_code"),
+    ("status", "status"),
+    ("date", "date"),
+    ("excursion_id", "excursion_id"),
+    ("excursion_title", "excursion_title"),
+    ("excursion_language", "excursion_language"),
+    ("company", "company__name"),
+    ("guide", "guide__username"),
+    ("hotel_name", "hotel_name"),
+    ("region_name", "region_name"),
+    ("pickup_point_name", "pickup_point_name"),
+    ("pickup_time_str", "pickup_time_str"),
+    ("room_number", "room_number"),
+    ("adults", "adults"),
+    ("children", "children"),
+    ("infants", "infants"),
+    ("gross_total", "gross_total"),
+    ("net_total", "net_total"),
+    ("commission", "commission"),
+    ("travelers_names", "travelers_names"),
+    ("batch_code", "batch_code"),
+    ("sent_at", "sent_at"),
+    ("created_at", "created_at"),
+]
+EXPORT_CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """Псевдо-буфер для csv.writer: write() просто возвращает строку."""
+    def write(self, value):
+        return value
+
+
+def _export_id_param(request, name: str):
+    raw = (request.GET.get(name) or "").strip()
+    if raw and not raw.isdigit():
+        raise ValueError(f"{name} must be an integer id")
+    return int(raw) if raw else None
+
+
+def _export_date_param(request, name: str):
+    raw = (request.GET.get(name) or "").strip()
+    try:
+        d = parse_date(raw) if raw else None
+    except ValueError:      # формат верный, дата нет: 2025-13-40
+        d = None
+    if raw and d is None:
+        raise ValueError(f"{name} must be a valid date YYYY-MM-DD")
+    return d
+
+
+def _export_queryset(request):
+    """Брони для выгрузки по параметрам запроса. ValueError — параметр некорректен (400)."""
+    guide_id = _export_id_param(request, "guide")
+    company_id = _export_id_param(request, "company")
+    d_from = _export_date_param(request, "date_from")
+    d_to = _export_date_param(request, "date_to")
+
+    qs = BookingSale.objects.all()
+    if not request.user.is_staff:
+        qs = qs.filter(guide=request.user)
+    elif guide_id is not None:
+        qs = qs.filter(guide_id=guide_id)
+
+    if d_from:
+        qs = qs.filter(date__gte=d_from)
+    if d_to:
+        qs = qs.filter(date__lte=d_to)
+    statuses = [x.strip().upper() for x in (request.GET.get("status") or "").split(",") if x.strip()]
+    if statuses:
+        qs = qs.filter(status__in=statuses)
+    if company_id is not None:
+        qs = qs.filter(company_id=company_id)
+
+    return qs.order_by("date", "id").values_list(*(src for _, src in EXPORT_COLUMNS))
+
+
+@require_GET
+def bookings_export(request):
+    """
+    GET /api/sales/bookings/export/?format=ndjson|csv&date_from=&date_to=&status=PENDING,PAID&company=
+    Отдаёт брони потоком: queryset читается кусками через .iterator(),
+    только нужные колонки, ответ начинает уходить сразу.
+    Гид видит свои брони, staff — все (или ?guide=<id>).
+    Обычная Django-вьюха: DRF перехватывает параметр ?format= для своих рендереров.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
+
+    fmt = (request.GET.get("format") or "ndjson").lower()
+    if fmt not in ("ndjson", "csv"):
+        return JsonResponse({"detail": "format must be 'ndjson' or 'csv'"}, status=400)
+
+    try:
+        rows = _export_queryset(request).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    except ValueError as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+    names = [name for name, _ in EXPORT_COLUMNS]
+    stamp = timezone.localdate().isoformat()
+
+    if fmt == "csv":
+        import csv
+        writer = csv.writer(_Echo())
+
+        def stream():
+            yield writer.writerow(names)
+            for row in rows:
+                yield writer.writerow(["" if v is None else v for v in row])
+
+        resp = StreamingHttpResponse(stream(), content_type="text/csv; charset=utf-8")
+    else:
+        from django.core.serializers.json import DjangoJSONEncoder
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+        def stream():
+            for row in rows:
+                yield encoder.encode(dict(zip(names, row))) + "\n"
+
+        resp = StreamingHttpResponse(stream(), content_type="application/x-ndjson; charset=utf-8")
+
+    resp["Content-Disposition"] = f'attachment; filename="bookings-{stamp}.{fmt}"'
+    resp["Cache-Control"] = "no-store"
+    resp["X-Accel-Buffering"] = "no"   # nginx: не буферизовать поток
+    return resp
+
+
 class BookingDetailView(APIView):
     """
     GET    /api/sales/bookings/<pk>/       → данные одной брони
@@ -1597,6 +1607,7 @@ class BookingDetailView(APIView):
         b = self.get_object(pk)
         if b.status != "DRAFT":
             return Response({"detail": "Only DRAFT bookings can be deleted"}, status=409)
+        tickets.invalidate(tickets.booking_fingerprint(b))
         b.delete()
         return Response({"deleted": 1, "id": pk}, status=200)
 
@@ -1646,10 +1657,13 @@ class BookingDetailView(APIView):
                 try: data[k] = float(data[k])
                 except Exception: return Response({"detail": f"{k} must be number"}, status=400)
 
-        # обновляем
+        # обновляем; закэшированный билет старой версии больше не нужен
+        old_ticket = tickets.booking_fingerprint(b)
         for k, v in data.items():
             setattr(b, k, v)
         b.save(update_fields=[*data.keys()] or None)
+        if tickets.booking_fingerprint(b) != old_ticket:
+            transaction.on_commit(lambda: tickets.invalidate(old_ticket))
 
         return Response(_booking_to_json(b), status=200)
 
@@ -1664,6 +1678,7 @@ class BookingCancelView(APIView):
     authentication_classes = [SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
+    @idempotent("bookings-cancel")
     @transaction.atomic
     def post(self, request, pk: int):
         b = get_object_or_404(BookingSale, pk=pk)
@@ -1678,11 +1693,8 @@ class BookingCancelView(APIView):
 
         reason = (request.data or {}).get("reason") or ""
 
-        # Письмо об аннуляции (если не ушло — всё равно продолжаем)
-        try:
-            send_cancellation_email(b, reason)
-        except Exception:
-            pass
+        # Письмо об аннуляции — в outbox, уйдёт вместе с коммитом транзакции
+        queue_cancellation_email(b, reason)
 
         # Обновляем статус и время
         b.status = "CANCELLED"
@@ -1699,4 +1711,68 @@ class BookingCancelView(APIView):
             ]
         )
 
-        return Response(_booking_to_json(b), status=200)
\ No newline at end of file
+        return Response(_booking_to_json(b), status=200)
+
+
+# ───── Поиск по входящим письмам ─────────────────────────────────────────────
+class InboundEmailSearchView(APIView):
+    """
+    GET /api/sales/inbound-emails/search/?q=...&page=1&page_size=20
+    Полнотекстовый поиск (тема, от, кому, текст) с ранжированием. Только для офиса.
+    """
+    permission_classes = [IsAdminUser]
+    MAX_PAGE_SIZE = 100
+
+    def get(self, request):
+        q = (request.query_params.get("q") or "").strip()
+        try:
+            page = max(1, int(request.query_params.get("page", "1")))
+            page_size = min(self.MAX_PAGE_SIZE, max(1, int(request.query_params.get("page_size", "20"))))
+        except ValueError:
+            return Response({"detail": "page and page_size must be integers"}, status=400)
+        if not q:
+            return Response({"detail": "q is required"}, status=400)
+
+        total, hits = inbound_search.search(q, page=page, page_size=page_size)
+        rows = (
+            InboundEmail.objects
+            .filter(pk__in=[pk for pk, _, _ in hits])
+            .select_related("booking")
+            .only("id", "subject", "from_email", "to_email", "date", "snippet", "booking__booking_code")
+            .in_bulk()
+        )
+        results = []
+        for pk, score, snip in hits:
+            e = rows.get(pk)
+            if e is None:
+                continue
+            results.append({
+                "id": e.id,
+                "subject": e.subject or "",
+                "from_email": e.from_email or "",
+                "to_email": e.to_email or "",
+                "date": e.date,
+                "booking_id": e.booking_id,
+                "booking_code": e.booking.booking_code if e.booking_id else None,
+                "snippet": snip or e.snippet or "",
+                "score": round(score, 6),
+            })
+        return Response({
+            "count": total,
+            "page": page,
+            "page_size": page_size,
+            "backend": inbound_search.backend(),
+            "results": results,
+        })
+
+
+class ImportJobView(APIView):
+    """
+    GET /api/sales/imports/<id>/
+    Прогресс фонового импорта туристов: статус, строки, счётчики, замечания по строкам.
+    Сотрудники офиса видят все задания, остальные — только свои.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk: int):
+        return Response(import_jobs.status(get_object_or_404(import_jobs.visible_to(request.user), pk=pk)))
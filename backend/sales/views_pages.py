@@ -1,19 +1,26 @@
 # sales/views_pages.py
-from django.shortcuts import render
-from django.views.decorators.http import require_http_methods
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.views.decorators.http import require_http_methods
 
 from .forms import TouristsImportForm
-from .importers.tourists_excel import import_file  # ← используем адаптер
+from .services import import_jobs
 
+@login_required(login_url="admin:login")
 @require_http_methods(["GET", "POST"])
 def tourists_import_page(request):
     """
     Страница импорта туристов из Excel/CSV.
     Форма должна быть с enctype="multipart/form-data".
     В форме есть поля:
-      - file  : загружаемый файл
-      - dryrun: чекбокс «Пробный запуск (без сохранения)»
+      - file   : загружаемый файл
+      - dry_run: чекбокс «Только проверка (без сохранения)»
+
+    Файл ставится в очередь (ImportJob, manage.py import_worker), страница
+    переходит на ?job=<id> и обновляется, пока импорт не закончится.
+    Чужие задания видны только сотрудникам офиса (как в /api/sales/imports/<id>/).
     """
     if request.method == "POST":
         form = TouristsImportForm(request.POST, request.FILES)
@@ -21,40 +28,21 @@ def tourists_import_page(request):
             messages.error(request, "Проверьте форму — есть ошибки.")
             return render(request, "sales/tourists_import.html", {"form": form})
 
-        up_file = form.cleaned_data["file"]
-        dry_run = form.cleaned_data.get("dryrun", True)
-
-        try:
-            # import_file сам прочитает и запустит импортёр
-            report = import_file(up_file, dry_run=dry_run)
-
-            # Сообщение пользователю
-            if dry_run:
-                messages.info(
-                    request,
-                    f"Пробный запуск: будет создано семей: {report.get('families_created', 0)}, "
-                    f"туристов: {report.get('travelers_created', 0)}. "
-                    f"Пропущено строк: {report.get('skipped', 0)}."
-                )
-            else:
-                messages.success(
-                    request,
-                    f"Импорт выполнен: создано семей: {report.get('families_created', 0)}, "
-                    f"туристов: {report.get('travelers_created', 0)}. "
-                    f"Пропущено строк: {report.get('skipped', 0)}."
-                )
-
-            # Показать отчёт (если шаблон это поддерживает)
-            return render(request, "sales/tourists_import.html", {
-                "form": form,
-                "report": report,   # можно вывести цифры и замечания
-            })
-
-        except Exception as e:
-            messages.error(request, f"Ошибка импорта: {e}")
-            # падаем обратно на форму
-            return render(request, "sales/tourists_import.html", {"form": form})
+        job = import_jobs.submit(
+            form.cleaned_data["file"],
+            dry_run=form.cleaned_data.get("dry_run", False),
+            user=request.user,
+        )
+        messages.info(request, f"Файл принят, импорт #{job.id} поставлен в очередь.")
+        return redirect(f"{reverse('sales:tourists_import_page')}?job={job.id}")
 
     # GET
-    form = TouristsImportForm(initial={"dryrun": True})
-    return render(request, "sales/tourists_import.html", {"form": form})
+    form = TouristsImportForm(initial={"dry_run": True})
+    ctx = {"form": form}
+    job_id = request.GET.get("job", "")
+    if job_id.isdigit():
+        job = import_jobs.visible_to(request.user).filter(pk=int(job_id)).first()
+        if job is not None:
+            # отчёт: цифры, сопоставление колонок и замечания — из задания
+            ctx.update(job=job, report=import_jobs.status(job), running=job.status in ("PENDING", "RUNNING"))
+    return render(request, "sales/tourists_import.html", ctx)
@@ -136,7 +136,12 @@ CORS_ALLOW_HEADERS = [
     "x-csrftoken",
     "x-requested-with",
     "authorization",
+    "idempotency-key",
 ]
+CORS_EXPOSE_HEADERS = ["idempotent-replayed"]
+
+# Сколько хранить ответы по Idempotency-Key (повторы POST с мобильных)
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
 
 CSRF_TRUSTED_ORIGINS = [
     "http://127.0.0.1:3000",
@@ -175,7 +180,7 @@ DATABASES = {
 }
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 20 * 1024 * 1024  # 20 MB
-FILE_UPLOAD_MAX_MEMORY_SIZE = 20 * 1024 * 1024
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(2.5 * 1024 * 1024)  # больше — во временный файл (импорт туристов читает потоком)
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -199,6 +204,16 @@ STATICFILES_DIRS = [BASE_DIR / "static"]
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Рендер PDF билетов в отдельных процессах (0 — прямо в процессе Django).
+# По умолчанию — половина ядер, не больше 4: каждый процесс держит WeasyPrint (~100 МБ)
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+PDF_RENDER_QUEUE_LIMIT = int(os.getenv("PDF_RENDER_QUEUE_LIMIT", "16"))
+PDF_RENDER_TIMEOUT = float(os.getenv("PDF_RENDER_TIMEOUT", "20"))
+
+# Спулер печати Zebra (manage.py print_spooler)
+PRINT_SPOOLER_PORT = os.getenv("PRINT_SPOOLER_PORT", "")
+PRINT_SPOOLER_BAUD = int(os.getenv("PRINT_SPOOLER_BAUD", "19200"))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 load_dotenv(os.path.join(BASE_DIR, '..', '.env'))
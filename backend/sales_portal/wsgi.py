@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sales_portal.settings')
 
 application = get_wsgi_application()
+
+# процессы рендера PDF поднимаются в фоне при старте воркера, а не на первом билете
+from sales.services import pdf_pool  # noqa: E402
+
+pdf_pool.warm_in_background()
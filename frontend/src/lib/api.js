@@ -104,6 +104,13 @@ export async function initCsrf() {
   }
 }
 
+// Ключ для Idempotency-Key: один на действие пользователя, повторы шлют тот же
+// (в компонентах — через useIdempotencyKeys из ./idempotency.js)
+export function newIdempotencyKey() {
+  if (globalThis.crypto?.randomUUID) return globalThis.crypto.randomUUID();
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
 // -------- API ФУНКЦИИ --------
 
 export async function previewBatch(familyId) {
@@ -113,9 +120,14 @@ export async function previewBatch(familyId) {
   });
 }
 
-export async function sendBatch(familyId) {
+function idempotencyHeaders(key) {
+  return key ? { "Idempotency-Key": key } : {};
+}
+
+export async function sendBatch(familyId, { idempotencyKey } = {}) {
   return jsonFetch("/api/sales/bookings/batch/send/", {
     method: "POST",
+    headers: idempotencyHeaders(idempotencyKey),
     body: JSON.stringify({ family_id: Number(familyId) }),
   });
 }
@@ -136,9 +148,10 @@ export async function deleteBooking(id) {
   return true;
 }
 
-export async function cancelBooking(id, reason = "") {
+export async function cancelBooking(id, reason = "", { idempotencyKey } = {}) {
   return jsonFetch(`/api/sales/bookings/${id}/cancel/`, {
     method: "POST",
+    headers: idempotencyHeaders(idempotencyKey),
     body: JSON.stringify({ reason }),
   });
 }
@@ -0,0 +1,27 @@
+// frontend/src/lib/idempotency.js
+import { useMemo, useRef } from 'react';
+import { newIdempotencyKey } from './api.js';
+
+/**
+ * Ключи Idempotency-Key на действия пользователя.
+ * keyFor(action) выдаёт один и тот же ключ, пока действие не завершилось
+ * успешно (done) — повтор после сетевой ошибки или двойной клик шлют тот же
+ * ключ, и сервер не выполнит действие дважды. action — строка, описывающая
+ * действие вместе с данными (другие данные = другое действие, новый ключ).
+ */
+export function useIdempotencyKeys() {
+  const keys = useRef(new Map());
+  return useMemo(() => ({
+    keyFor(action) {
+      let key = keys.current.get(action);
+      if (!key) {
+        key = newIdempotencyKey();
+        keys.current.set(action, key);
+      }
+      return key;
+    },
+    done(action) {
+      keys.current.delete(action);
+    },
+  }), []);
+}
@@ -4,6 +4,7 @@ import { useNavigate, useParams, useSearchParams } from 'react-router-dom';
 import { getBooking, updateBooking, deleteBooking, cancelBooking } from '../lib/api.js';
 import { patchTraveler } from '../lib/api.js';
 import SpecialTravelerFields from '../components/SpecialTravelerFields.jsx';
+import { useIdempotencyKeys } from '../lib/idempotency.js';
 
 const fmtMoney = (v, cur='EUR') =>
   new Intl.NumberFormat(undefined, { style:'currency', currency:cur, maximumFractionDigits: 2 })
@@ -75,6 +76,7 @@ export default function EditBookingScreen() {
 
   const original = useRef(null);
   const toastTimer = useRef(null);
+  const idem = useIdempotencyKeys(); // Idempotency-Key аннуляции: повтор после ошибки — с тем же ключом
 
   const isDraft = (data?.status === 'DRAFT');
   const isCancelled = (data?.status === 'CANCELLED');
@@ -235,8 +237,10 @@ export default function EditBookingScreen() {
     if (isDraft) { showToast('Черновик не аннулируют — его удаляют'); return; }
     if (isCancelled) { showToast('Бронь уже аннулирована'); return; }
     const reason = prompt('Причина аннуляции (необязательно):', '') || '';
+    const cancelAction = `cancel:${id}:${reason}`;
     try {
-      const j = await cancelBooking(id, reason);
+      const j = await cancelBooking(id, reason, { idempotencyKey: idem.keyFor(cancelAction) });
+      idem.done(cancelAction);
       setData(j);
       original.current = pickEditable(j);
       showToast('Бронь аннулирована');
@@ -13,6 +13,7 @@ import {
   cancelBooking,         // ← добавлено
   jsonFetch,             // ← для batch cancel
 } from '../lib/api.js';
+import { useIdempotencyKeys } from '../lib/idempotency.js';
 
 // ===== helpers: дни недели / даты ============================================
 const WEEKDAY_CODE_TO_NUM = { mon:1, tue:2, wed:3, thu:4, fri:5, sat:6, sun:0 };
@@ -166,6 +167,7 @@ export default function FamilyScreen() {
 
   // данные
   const [fam, setFam] = useState(null);
+  const idem = useIdempotencyKeys(); // Idempotency-Key: один на действие, повторы — с тем же
   const [excursions, setExcursions] = useState([]);
   const [companies, setCompanies] = useState([]);
 
@@ -446,17 +448,19 @@ export default function FamilyScreen() {
       return;
     }
 
+    const createAction = `create:${JSON.stringify(body)}`;
     setBookingLoading(true);
     try {
       const res = await fetch(`/api/sales/bookings/create/`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idem.keyFor(createAction) },
         credentials: 'include',
         body: JSON.stringify(body),
       });
       const text = await res.text();
       const data = text ? JSON.parse(text) : null;
       if (!res.ok) throw new Error(data?.detail || JSON.stringify(data));
+      idem.done(createAction);
 
       // попытка взять id из ответа API
       let newId =
@@ -528,14 +532,17 @@ export default function FamilyScreen() {
       return;
     }
 
+    const sendAction = `send:${idsToSend.join(',')}`;
     setSending(true);
     setPreviewError('');
     try {
       // можно и через ваш sendBatch(familyId), но тут — явные ids
       await jsonFetch('/api/sales/bookings/batch/send/', {
         method: 'POST',
+        headers: { 'Idempotency-Key': idem.keyFor(sendAction) },
         body: JSON.stringify({ booking_ids: idsToSend }),
       });
+      idem.done(sendAction);
 
       // перечитать черновики
       const r2 = await fetch(`/api/sales/bookings/family/${familyId}/drafts/`, { credentials: 'include' });
@@ -612,8 +619,10 @@ export default function FamilyScreen() {
   async function cancelOne(id) {
     const reason = window.prompt('Причина аннуляции (необязательно):', '');
     if (reason === null) return;
+    const cancelAction = `cancel:${id}:${reason}`;
     try {
-      await cancelBooking(id, reason); // ← всегда с токеном
+      await cancelBooking(id, reason, { idempotencyKey: idem.keyFor(cancelAction) }); // ← всегда с токеном
+      idem.done(cancelAction);
       const r2 = await fetch(`/api/sales/bookings/family/${familyId}/drafts/?_=${Date.now()}`, {
         credentials: 'include'
       });
@@ -636,11 +645,14 @@ export default function FamilyScreen() {
     }
     if (!confirm(`Аннулировать ${ids.length} бронирование(я)?`)) return;
 
+    const cancelAction = `cancel-batch:${ids.join(',')}`;
     try {
       await jsonFetch('/api/sales/bookings/batch/cancel/', {
         method:'POST',
+        headers: { 'Idempotency-Key': idem.keyFor(cancelAction) },
         body: JSON.stringify({ booking_ids: ids }),
       });
+      idem.done(cancelAction);
       await Promise.all([
         fetch(`/api/sales/bookings/family/${familyId}/drafts/`, { credentials:'include' })
           .then(r=>r.json()).then(j=> setDrafts(Array.isArray(j)? j : (j.items||[]))),